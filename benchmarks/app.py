@@ -0,0 +1,18 @@
+"""
+ASGI entry point for benchmark runs: main.app with the fake YouTube
+extractors installed first. Started by benchmarks.loadtest with the fake
+upstream's environment; not meant for anything else.
+
+    uvicorn benchmarks.app:app
+"""
+import os
+import json
+from benchmarks import fake_youtube
+
+fake_youtube.install(
+    os.environ["BENCH_UPSTREAM_URL"],
+    {ext: tuple(fmt) for ext, fmt in json.loads(os.environ["BENCH_FIXTURE_FORMATS"]).items()},
+    search_latency=float(os.environ.get("BENCH_SEARCH_LATENCY", "0"))
+)
+
+from main import app  # noqa: E402,F401
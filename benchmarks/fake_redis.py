@@ -0,0 +1,220 @@
+"""
+A minimal Redis stand-in for the benchmarks: a server holding strings
+with expiry, enough for RedisState (GET, SET with NX/PX/EX, DEL,
+PEXPIRE/EXPIRE, and EVAL of the two lock scripts it sends). Replies use
+whichever protocol the connection's HELLO asked for (RESP2 by default).
+
+    python -m benchmarks.fake_redis --port 6399
+
+Single-threaded asyncio, so every command is atomic, as in Redis.
+"""
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from services.shared_state import RELEASE_SCRIPT, RENEW_SCRIPT
+
+
+class CommandError(Exception):
+    pass
+
+
+class Store:
+    def __init__(self):
+        self.data = {}
+        self.commands = 0
+
+    def _live(self, key: bytes):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        entry = self._live(key)
+        return entry[0] if entry else None
+
+    def set(self, key, value, *options):
+        expires_at, nx = None, False
+        i = 0
+        while i < len(options):
+            option = options[i].upper()
+            if option == b"NX":
+                nx = True
+            elif option in (b"PX", b"EX"):
+                amount = int(options[i + 1])
+                expires_at = time.monotonic() + (amount / 1000 if option == b"PX" else amount)
+                i += 1
+            else:
+                raise CommandError(f"syntax error near {option.decode()}")
+            i += 1
+        if nx and self._live(key) is not None:
+            return None
+        self.data[key] = (value, expires_at)
+        return "OK"
+
+    def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._live(key) is not None:
+                del self.data[key]
+                removed += 1
+        return removed
+
+    def pexpire(self, key, ms):
+        entry = self._live(key)
+        if entry is None:
+            return 0
+        self.data[key] = (entry[0], time.monotonic() + int(ms) / 1000)
+        return 1
+
+    def eval(self, script, numkeys, *args):
+        keys, argv = args[:int(numkeys)], args[int(numkeys):]
+        script = script.decode()
+        if script == RELEASE_SCRIPT:
+            return self.delete(keys[0]) if self.get(keys[0]) == argv[0] else 0
+        if script == RENEW_SCRIPT:
+            return self.pexpire(keys[0], argv[1]) if self.get(keys[0]) == argv[0] else 0
+        raise CommandError("only the lock scripts are supported")
+
+    def execute(self, name: bytes, args: list):
+        self.commands += 1
+        name = name.upper()
+        if name == b"PING":
+            return "PONG"
+        if name == b"HELLO":
+            proto = int(args[0]) if args else 2
+            if proto not in (2, 3):
+                raise CommandError("NOPROTO unsupported protocol version")
+            return Hello({"server": "fake-redis", "version": "7.2.0", "proto": proto, "mode": "standalone"})
+        if name in (b"CLIENT", b"SELECT", b"FLUSHALL"):
+            if name == b"FLUSHALL":
+                self.data.clear()
+            return "OK"
+        if name == b"GET":
+            return self.get(args[0])
+        if name == b"SET":
+            return self.set(*args)
+        if name == b"DEL":
+            return self.delete(*args)
+        if name == b"PEXPIRE":
+            return self.pexpire(args[0], args[1])
+        if name == b"EXPIRE":
+            return self.pexpire(args[0], int(args[1]) * 1000)
+        if name == b"DBSIZE":
+            return sum(1 for key in list(self.data) if self._live(key) is not None)
+        if name == b"EVAL":
+            return self.eval(*args)
+        raise CommandError(f"unknown command '{name.decode()}'")
+
+
+class Hello(dict):
+    pass
+
+
+def encode(value, proto: int = 2) -> bytes:
+    if isinstance(value, Hello):
+        # A map in RESP3, a flat array of pairs in RESP2
+        pairs = [encode(item, proto) for pair in value.items() for item in pair]
+        head = b"%%%d\r\n" % len(value) if proto == 3 else b"*%d\r\n" % len(pairs)
+        return head + b"".join(pairs)
+    if value is None:
+        return b"_\r\n" if proto == 3 else b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return b"+" + value.encode() + b"\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+async def read_command(reader: asyncio.StreamReader) -> list:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, e.g. from redis-cli or telnet
+        return line.split()
+    args = []
+    for _ in range(int(line[1:])):
+        size = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+def serve(port: int):
+    store = Store()
+
+    async def handle(reader, writer):
+        proto = 2
+        try:
+            while (command := await read_command(reader)) is not None:
+                if not command:
+                    continue
+                try:
+                    result = store.execute(command[0], command[1:])
+                    if isinstance(result, Hello):
+                        proto = result["proto"]
+                    reply = encode(result, proto)
+                except (CommandError, IndexError, ValueError) as e:
+                    reply = b"-ERR " + str(e).encode() + b"\r\n"
+                writer.write(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, "127.0.0.1", port)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+class FakeRedis:
+    """Runs the fake server in a child process on a free port; use as a context manager."""
+    def __init__(self):
+        self.port = None
+        self._process = None
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    def __enter__(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self._process = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_redis", "--port", str(self.port)])
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=1) as sock:
+                    sock.sendall(b"PING\r\n")
+                    if sock.recv(16).startswith(b"+PONG"):
+                        return self
+            except OSError:
+                pass
+            if time.monotonic() > deadline or self._process.poll() is not None:
+                self._process.terminate()
+                raise RuntimeError("fake redis did not come up")
+            time.sleep(0.05)
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.wait(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+    serve(args.port)
+
+
+if __name__ == "__main__":
+    main()
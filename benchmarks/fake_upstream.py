@@ -0,0 +1,367 @@
+"""
+Local stand-ins for the metadata providers and YouTube's media servers,
+for the benchmarks.
+
+Serves Spotify-style Web API routes, Tidal-style v2 JSON:API routes (both
+behind a client-credentials token endpoint) and the audio fixtures the
+fake yt-dlp extractor points at, with a configurable artificial latency
+on the API calls. Runs on 127.0.0.1 in a separate uvicorn process so it
+does not compete with the code under test for the GIL.
+
+    python -m benchmarks.fake_upstream --port 8099 --latency 0.05 --fixtures /tmp/fixtures
+
+The catalog is synthetic and deterministic: track <n> is "Track <n>" by
+"Bench Artist", Spotify ID <n> zero-padded to 22 digits, Tidal ID <n>.
+Every album/playlist ID maps to its own block of track numbers.
+
+With --rate-limit, Spotify API calls beyond that many per second get a
+429 with Retry-After, like the real quota; /stats reports call counts.
+POST /faults injects provider trouble at runtime, e.g.
+{"tidal": {"latency": 5, "error_rate": 0.5, "status": 503}} slows every
+Tidal API call by 5s and fails half of them; {"tidal": {}} clears it.
+Album art URLs point at /covers/..., which serves fixture cover.jpg.
+"""
+import os
+import sys
+import time
+import zlib
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, FileResponse, Response
+from starlette.routing import Route
+
+ARTIST = "Bench Artist"
+ALBUM = "Bench Album"
+SPOTIFY_PAGE_SIZE = 100
+TIDAL_PAGE_SIZE = 20
+
+
+def track_duration_ms(n: int) -> int:
+    """Between 2:30 and 4:30, so candidates of one search differ by duration."""
+    return (150 + n % 120) * 1000
+
+
+def collection_track_numbers(collection_id: str, size: int) -> list:
+    base = (zlib.crc32(collection_id.encode()) % 1_000_000) * 10_000
+    return [base + i for i in range(size)]
+
+
+def spotify_track_id(n: int) -> str:
+    return f"{n:022d}"
+
+
+def cover_images(base_url: str) -> list:
+    return [{"url": f"{base_url}/covers/b1/{size}.jpg", "width": size, "height": size} for size in (640, 300, 64)]
+
+
+def spotify_track(n: int, simplified: bool = False, base_url: str = "") -> dict:
+    track = {
+        "id": spotify_track_id(n),
+        "type": "track",
+        "name": f"Track {n}",
+        "artists": [{"name": ARTIST}],
+        "duration_ms": track_duration_ms(n),
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{spotify_track_id(n)}"},
+        "external_ids": {"isrc": f"QZBENCH{n % 100000:05d}"},
+    }
+    if not simplified:
+        track["album"] = {"name": ALBUM, "images": cover_images(base_url)}
+    return track
+
+
+def tidal_track(n: int) -> dict:
+    minutes, seconds = divmod(track_duration_ms(n) // 1000, 60)
+    return {
+        "id": str(n),
+        "type": "tracks",
+        "attributes": {"title": f"Track {n}", "duration": f"PT{minutes}M{seconds}S", "isrc": f"QZBENCH{n % 100000:05d}"},
+        "relationships": {
+            "artists": {"data": [{"id": "a1", "type": "artists"}]},
+            "albums": {"data": [{"id": "b1", "type": "albums"}]},
+        },
+    }
+
+
+def tidal_included(base_url: str) -> list:
+    return [
+        {"id": "a1", "type": "artists", "attributes": {"name": ARTIST}},
+        {"id": "b1", "type": "albums", "attributes": {"title": ALBUM},
+         "relationships": {"coverArt": {"data": [{"id": "c1", "type": "artworks"}]}}},
+        {"id": "c1", "type": "artworks", "attributes": {"files": [
+            {"href": f"{base_url}/covers/b1/{size}.jpg", "meta": {"width": size, "height": size}}
+            for size in (80, 640, 1280)
+        ]}},
+    ]
+
+
+def tidal_track_payload(track_id: str, base_url: str = "") -> dict:
+    return {"data": tidal_track(int(track_id)), "included": tidal_included(base_url)}
+
+
+def build_app(latency: float, playlist_size: int = 25, fixtures_dir: str = None, rate_limit: int = 0) -> Starlette:
+    counters = {"spotify_calls": 0, "spotify_throttled": 0, "spotify_faults": 0, "tidal_calls": 0, "tidal_faults": 0}
+    faults = {"spotify": {}, "tidal": {}}
+    window = {"second": 0, "calls": 0}
+
+    async def delay():
+        if latency:
+            await asyncio.sleep(latency)
+
+    def throttled():
+        """Fixed one-second window per Spotify API call; a 429 response when it is used up."""
+        counters["spotify_calls"] += 1
+        if not rate_limit:
+            return None
+        second = int(time.monotonic())
+        if window["second"] != second:
+            window["second"], window["calls"] = second, 0
+        window["calls"] += 1
+        if window["calls"] <= rate_limit:
+            return None
+        counters["spotify_throttled"] += 1
+        return JSONResponse({"error": {"status": 429, "message": "API rate limit exceeded"}},
+                            status_code=429, headers={"Retry-After": "1"})
+
+    async def injected(provider: str):
+        """Applies the provider's POST /faults settings: extra latency, then an error at error_rate."""
+        fault = faults[provider]
+        if fault.get("latency"):
+            await asyncio.sleep(fault["latency"])
+        if fault.get("error_rate") and random.random() < fault["error_rate"]:
+            counters[f"{provider}_faults"] += 1
+            return JSONResponse({"error": "injected fault"}, status_code=fault.get("status", 503))
+        return None
+
+    async def set_faults(request):
+        if request.method == "POST":
+            body = await request.json()
+            for provider in faults:
+                if provider in body:
+                    faults[provider] = dict(body[provider] or {})
+        return JSONResponse(faults)
+
+    async def stats(request):
+        return JSONResponse(counters)
+
+    def base(request) -> str:
+        return str(request.base_url).rstrip("/")
+
+    def page_params(request, default_limit: int):
+        offset = int(request.query_params.get("offset", 0))
+        limit = int(request.query_params.get("limit", default_limit))
+        return offset, limit
+
+    async def token(request):
+        return JSONResponse({"access_token": "bench-token", "token_type": "Bearer", "expires_in": 86400})
+
+    # --- Spotify ---
+    async def spotify_get_track(request):
+        await delay()
+        if (limited := throttled()) is not None:
+            return limited
+        if (failed := await injected("spotify")) is not None:
+            return failed
+        track_id = request.path_params["track_id"]
+        if not track_id.isdigit():
+            return JSONResponse({"error": {"status": 404, "message": "Not found."}}, status_code=404)
+        return JSONResponse(spotify_track(int(track_id), base_url=base(request)))
+
+    async def spotify_get_tracks(request):
+        await delay()
+        if (limited := throttled()) is not None:
+            return limited
+        if (failed := await injected("spotify")) is not None:
+            return failed
+        ids = [i for i in request.query_params.get("ids", "").split(",") if i]
+        return JSONResponse({"tracks": [spotify_track(int(i), base_url=base(request)) if i.isdigit() else None
+                                        for i in ids]})
+
+    def spotify_page(request, numbers, wrap):
+        offset, limit = page_params(request, SPOTIFY_PAGE_SIZE)
+        items = [wrap(n) for n in numbers[offset:offset + limit]]
+        following = None
+        if offset + limit < len(numbers):
+            following = str(request.url.include_query_params(offset=offset + limit, limit=limit))
+        return {"items": items, "next": following, "offset": offset, "limit": limit, "total": len(numbers)}
+
+    async def spotify_playlist_items(request):
+        await delay()
+        if (limited := throttled()) is not None:
+            return limited
+        if (failed := await injected("spotify")) is not None:
+            return failed
+        numbers = collection_track_numbers(request.path_params["playlist_id"], playlist_size)
+        wrap = lambda n: {"track": spotify_track(n, base_url=base(request))}
+        return JSONResponse(spotify_page(request, numbers, wrap))
+
+    async def spotify_album(request):
+        await delay()
+        if (limited := throttled()) is not None:
+            return limited
+        if (failed := await injected("spotify")) is not None:
+            return failed
+        album_id = request.path_params["album_id"]
+        numbers = collection_track_numbers(album_id, playlist_size)
+        tracks = spotify_page(request, numbers, lambda n: spotify_track(n, simplified=True))
+        if tracks["next"]:
+            tracks["next"] = tracks["next"].replace(f"/albums/{album_id}?", f"/albums/{album_id}/tracks?")
+        return JSONResponse({"id": album_id, "name": ALBUM, "images": cover_images(base(request)), "tracks": tracks})
+
+    async def spotify_album_tracks(request):
+        await delay()
+        if (limited := throttled()) is not None:
+            return limited
+        if (failed := await injected("spotify")) is not None:
+            return failed
+        numbers = collection_track_numbers(request.path_params["album_id"], playlist_size)
+        return JSONResponse(spotify_page(request, numbers, lambda n: spotify_track(n, simplified=True)))
+
+    # --- Tidal ---
+    async def tidal_get_track(request):
+        await delay()
+        counters["tidal_calls"] += 1
+        if (failed := await injected("tidal")) is not None:
+            return failed
+        track_id = request.path_params["track_id"]
+        if not track_id.isdigit():
+            return JSONResponse({"errors": [{"status": "404"}]}, status_code=404)
+        return JSONResponse(tidal_track_payload(track_id, base(request)))
+
+    async def tidal_get_tracks(request):
+        await delay()
+        counters["tidal_calls"] += 1
+        if (failed := await injected("tidal")) is not None:
+            return failed
+        ids = [i for i in request.query_params.get("filter[id]", "").split(",") if i.isdigit()]
+        return JSONResponse({"data": [tidal_track(int(i)) for i in ids], "included": tidal_included(base(request))})
+
+    async def tidal_collection_items(request):
+        await delay()
+        counters["tidal_calls"] += 1
+        if (failed := await injected("tidal")) is not None:
+            return failed
+        collection, collection_id = request.path_params["collection"], request.path_params["collection_id"]
+        numbers = collection_track_numbers(collection_id, playlist_size)
+        cursor = int(request.query_params.get("page[cursor]", 0))
+        body = {"data": [{"id": str(n), "type": "tracks"} for n in numbers[cursor:cursor + TIDAL_PAGE_SIZE]],
+                "links": {}}
+        if cursor + TIDAL_PAGE_SIZE < len(numbers):
+            body["links"]["next"] = (f"/{collection}/{collection_id}/relationships/items"
+                                     f"?countryCode=US&page[cursor]={cursor + TIDAL_PAGE_SIZE}")
+        return JSONResponse(body)
+
+    # --- Cover art ---
+    async def cover(request):
+        path = os.path.join(fixtures_dir or "", "cover.jpg")
+        if not fixtures_dir or not os.path.exists(path):
+            return Response(status_code=404)
+        return FileResponse(path, media_type="image/jpeg")
+
+    # --- YouTube media ---
+    async def youtube_audio(request):
+        # Any video ID gets the fixture for the requested container
+        ext = request.path_params["filename"].rsplit(".", 1)[-1]
+        path = os.path.join(fixtures_dir or "", f"fixture.{ext}")
+        if not fixtures_dir or not os.path.exists(path):
+            return Response(status_code=404)
+        return FileResponse(path)
+
+    return Starlette(routes=[
+        Route("/ready", token),
+        Route("/stats", stats),
+        Route("/faults", set_faults, methods=["GET", "POST"]),
+        Route("/spotify/token", token, methods=["POST"]),
+        Route("/spotify/v1/tracks", spotify_get_tracks),
+        Route("/spotify/v1/tracks/{track_id}", spotify_get_track),
+        Route("/spotify/v1/playlists/{playlist_id}/items", spotify_playlist_items),
+        Route("/spotify/v1/albums/{album_id}", spotify_album),
+        Route("/spotify/v1/albums/{album_id}/tracks", spotify_album_tracks),
+        Route("/tidal/token", token, methods=["POST"]),
+        Route("/tidal/v2/tracks", tidal_get_tracks),
+        Route("/tidal/v2/tracks/{track_id}", tidal_get_track),
+        Route("/tidal/v2/{collection}/{collection_id}/relationships/items", tidal_collection_items),
+        Route("/covers/{album_id}/{size}.jpg", cover),
+        Route("/youtube/audio/{filename}", youtube_audio),
+    ])
+
+
+class FakeUpstream:
+    """Runs build_app() in a child process on a free port; use as a context manager."""
+    def __init__(self, latency: float = 0.05, playlist_size: int = 25, fixtures_dir: str = None,
+                 rate_limit: int = 0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.playlist_size = playlist_size
+        self.fixtures_dir = fixtures_dir
+        self.port = None
+        self._process = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def env(self) -> dict:
+        """Environment that points the real services at this server."""
+        return {
+            "SPOTIFY_AUTH_URL": f"{self.base_url}/spotify/token",
+            "SPOTIFY_API_URL": f"{self.base_url}/spotify/v1",
+            "SPOTIFY_CLIENT_ID": "bench",
+            "SPOTIFY_CLIENT_SECRET": "bench",
+            "TIDAL_AUTH_URL": f"{self.base_url}/tidal/token",
+            "TIDAL_API_URL": f"{self.base_url}/tidal/v2",
+            "TIDAL_CLIENT_ID": "bench",
+            "TIDAL_CLIENT_SECRET": "bench",
+            "BENCH_UPSTREAM_URL": self.base_url,
+        }
+
+    def __enter__(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        cmd = [sys.executable, "-m", "benchmarks.fake_upstream", "--port", str(self.port),
+               "--latency", str(self.latency), "--playlist-size", str(self.playlist_size),
+               "--rate-limit", str(self.rate_limit)]
+        if self.fixtures_dir:
+            cmd += ["--fixtures", self.fixtures_dir]
+        self._process = subprocess.Popen(cmd)
+        wait_until_ready(f"{self.base_url}/ready", self._process)
+        return self
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.wait(timeout=5)
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.terminate()
+                raise RuntimeError(f"{url} did not come up")
+            time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--playlist-size", type=int, default=25)
+    parser.add_argument("--fixtures", help="directory with fixture.<ext> audio files")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Spotify API calls per second before 429s")
+    args = parser.parse_args()
+    uvicorn.run(build_app(args.latency, args.playlist_size, args.fixtures, args.rate_limit),
+                host="127.0.0.1", port=args.port, log_level="warning", backlog=4096)
+
+
+if __name__ == "__main__":
+    main()
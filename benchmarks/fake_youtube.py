@@ -0,0 +1,101 @@
+"""
+yt-dlp extractors that stand in for YouTube in benchmark runs.
+
+`ytsearch<N>:<query>` returns a few synthetic candidates for the query
+(the right upload plus decoys with other durations and titles), and
+watch URLs resolve to the fixtures served by benchmarks.fake_upstream.
+install() puts both in front of yt-dlp's own extractors; call it before
+any YoutubeDL instance is created.
+"""
+import re
+import time
+import base64
+import hashlib
+from yt_dlp.extractor.common import InfoExtractor, SearchInfoExtractor
+
+TRACK_QUERY_RE = re.compile(r"track (\d+)", re.IGNORECASE)
+
+# Set by install()
+MEDIA_BASE_URL = None
+SEARCH_LATENCY = 0.0
+FIXTURE_FORMATS = {}
+# video_id -> search entry, so watch URLs resolve to what the search promised
+KNOWN_VIDEOS = {}
+
+
+def video_id_for(seed: str) -> str:
+    return base64.urlsafe_b64encode(hashlib.sha1(seed.encode()).digest()).decode()[:11]
+
+
+def search_entries(query: str) -> list:
+    from benchmarks.fake_upstream import ARTIST, track_duration_ms
+
+    match = TRACK_QUERY_RE.search(query)
+    n = int(match.group(1)) if match else 0
+    duration = track_duration_ms(n) // 1000
+    title = f"{ARTIST} - Track {n}"
+    entries = [
+        {"title": f"{title} (Official Audio)", "duration": duration, "channel": f"{ARTIST} - Topic"},
+        {"title": f"{title} (Karaoke Version)", "duration": duration + 14, "channel": "Sing King"},
+        {"title": f"{title} (Live)", "duration": duration + 95, "channel": "Concert Uploads"},
+    ]
+    for entry in entries:
+        entry["id"] = video_id_for(f"{query}|{entry['title']}")
+        KNOWN_VIDEOS[entry["id"]] = entry
+    return entries
+
+
+class FakeYoutubeIE(InfoExtractor):
+    IE_NAME = "bench:youtube"
+    _VALID_URL = r"https?://(?:www\.)?youtube\.com/watch\?v=(?P<id>[0-9A-Za-z_-]{11})"
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        entry = KNOWN_VIDEOS.get(video_id) or {"title": f"Bench video {video_id}", "duration": 200,
+                                                "channel": "Bench"}
+        formats = [{
+            "format_id": ext,
+            "url": f"{MEDIA_BASE_URL}/youtube/audio/{video_id}.{ext}",
+            "ext": ext,
+            "acodec": acodec,
+            "vcodec": "none",
+            "abr": abr,
+        } for ext, (acodec, abr) in FIXTURE_FORMATS.items()]
+        return {
+            "id": video_id,
+            "title": entry["title"],
+            "duration": entry["duration"],
+            "channel": entry["channel"],
+            "formats": formats,
+        }
+
+
+class FakeYoutubeSearchIE(SearchInfoExtractor):
+    IE_NAME = "bench:youtube:search"
+    _SEARCH_KEY = "ytsearch"
+
+    def _search_results(self, query):
+        if SEARCH_LATENCY:
+            time.sleep(SEARCH_LATENCY)
+        for entry in search_entries(query):
+            yield self.url_result(
+                f"https://www.youtube.com/watch?v={entry['id']}", FakeYoutubeIE, entry["id"], entry["title"],
+                duration=entry["duration"], channel=entry["channel"]
+            )
+
+
+def install(media_base_url: str, fixture_formats: dict, search_latency: float = 0.0):
+    global MEDIA_BASE_URL, SEARCH_LATENCY, FIXTURE_FORMATS
+    MEDIA_BASE_URL = media_base_url
+    SEARCH_LATENCY = search_latency
+    FIXTURE_FORMATS = dict(fixture_formats)
+
+    from yt_dlp.extractor import import_extractors
+    from yt_dlp.globals import extractors
+    import_extractors()
+    # Earlier entries win URL matching, as with yt-dlp's own plugins
+    extractors.value = {
+        "FakeYoutubeSearchIE": FakeYoutubeSearchIE,
+        "FakeYoutubeIE": FakeYoutubeIE,
+        **extractors.value,
+    }
@@ -0,0 +1,51 @@
+"""
+Audio fixtures served as YouTube's media streams in benchmark runs.
+
+With ffmpeg on PATH: a sine tone as Opus/WebM and AAC/M4A, the two
+containers YouTube actually serves, so mp3 output is a real encode and m4a
+a stream copy, plus a 1280x1280 cover.jpg for the album art. Without
+ffmpeg only a silent MP3 is written (raw MPEG-1 Layer III frames) and
+conversions can only use the "original" format.
+"""
+import os
+import shutil
+import subprocess
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, stereo, no CRC: 417-byte frames of 1152 samples
+MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0x00])
+MP3_FRAME_SIZE = 417
+MP3_FRAMES_PER_SECOND = 44100 / 1152
+
+# ext -> (yt-dlp acodec, abr); the higher abr wins 'bestaudio'
+FORMATS = {
+    "webm": ("opus", 160),
+    "m4a": ("mp4a.40.2", 128),
+    "mp3": ("mp3", 128),
+}
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def make_fixtures(directory: str, seconds: int = 30) -> dict:
+    """Writes fixture.<ext> files into directory; returns {ext: (acodec, abr)} for what exists."""
+    os.makedirs(directory, exist_ok=True)
+    if ffmpeg_available():
+        tone = ["-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}:sample_rate=48000", "-ac", "2"]
+        for ext, args in (("webm", ["-c:a", "libopus", "-b:a", "160k"]), ("m4a", ["-c:a", "aac", "-b:a", "128k"])):
+            path = os.path.join(directory, f"fixture.{ext}")
+            if not os.path.exists(path):
+                subprocess.run(["ffmpeg", "-y", "-loglevel", "error", *tone, *args, path], check=True)
+        cover = os.path.join(directory, "cover.jpg")
+        if not os.path.exists(cover):
+            subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=1280x1280",
+                            "-frames:v", "1", "-q:v", "2", cover], check=True)
+        return {ext: FORMATS[ext] for ext in ("webm", "m4a")}
+
+    path = os.path.join(directory, "fixture.mp3")
+    if not os.path.exists(path):
+        frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+        with open(path, "wb") as fh:
+            fh.write(frame * int(seconds * MP3_FRAMES_PER_SECOND))
+    return {"mp3": FORMATS["mp3"]}
@@ -0,0 +1,454 @@
+"""
+End-to-end load scenarios against the real app, with Spotify, Tidal and
+YouTube replaced by local fakes (benchmarks.fake_upstream,
+benchmarks.fake_youtube).
+
+    python -m benchmarks.loadtest --json results.json
+    python -m benchmarks.loadtest --only hot_metadata --baseline results.json
+
+Scenarios:
+  single_convert         sequential /v1/convert of distinct tracks (full pipeline, cold)
+  hot_metadata           concurrent /v1/{spotify,tidal}/meta for already cached tracks
+  playlist_fanout        one /v1/convert/batch over a playlist, latency per streamed track
+  concurrent_duplicates  the same /v1/convert fired concurrently (single-flight)
+  download_serve         GETs of a finished file from /downloads, half of them ranged
+  bundle_download        GETs of a ZIP bundle of converted tracks, half of them resumed mid-archive
+
+Each scenario gets a fresh app process (uvicorn) and empty cache
+directories. Reported per scenario: throughput, p50/p95/p99 latency,
+CPU seconds and peak RSS of the app's process tree (transcode workers and
+their ffmpeg children included), plus a few counters from the health
+endpoint. --baseline prints the change against an earlier --json file.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+import httpx
+from benchmarks import fixtures
+from services.http_client import AsyncHTTPClient
+from benchmarks.fake_upstream import FakeUpstream, wait_until_ready, spotify_track_id
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# --- App process tree accounting ---
+
+def process_tree(root: int) -> list:
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fh:
+                stat = fh.read()
+        except OSError:
+            continue
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        tree.append(pid)
+        pending.extend(children.get(pid, []))
+    return tree
+
+
+def cpu_seconds(pids: list) -> float:
+    """utime + stime of each process plus that of its reaped children (ffmpeg)."""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as fh:
+                stat = fh.read()
+        except OSError:
+            continue
+        fields = stat[stat.rindex(")") + 2:].split()
+        total += sum(int(v) for v in fields[11:15])
+    return total / CLK_TCK
+
+
+def reset_peak_rss(pids: list):
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/clear_refs", "w") as fh:
+                fh.write("5")
+        except OSError:
+            pass
+
+
+def peak_rss_mb(pids: list) -> float:
+    total_kb = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as fh:
+                for line in fh:
+                    if line.startswith("VmHWM:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1)
+
+
+class AppServer:
+    """The app under uvicorn in a child process, with its own scratch directories."""
+    def __init__(self, env: dict, workdir: str, workers: int = 1):
+        self.env = env
+        self.workdir = workdir
+        self.workers = workers
+        self.process = None
+        self.base_url = None
+
+    def __enter__(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        self._log = open(os.path.join(self.workdir, "app.log"), "ab")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "benchmarks.app:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning", "--no-access-log", "--workers", str(self.workers)],
+            # cwd: spotipy drops its token cache file there
+            cwd=self.workdir, env=self.env, stdout=self._log, stderr=subprocess.STDOUT
+        )
+        wait_until_ready(f"{self.base_url}/", self.process, timeout=60)
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+
+
+# --- Scenarios ---
+# Each one is (warmup, measure). measure returns (latencies, errors, units);
+# units is what throughput counts (requests, or tracks for the fan-out).
+
+def spotify_url(n: int) -> str:
+    return f"https://open.spotify.com/track/{spotify_track_id(n)}"
+
+
+async def gather_limited(concurrency: int, calls):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run(call):
+        async with limit:
+            return await call()
+    return await asyncio.gather(*(run(call) for call in calls))
+
+
+class LoadClient:
+    """
+    Request side of the scenarios. Built on the app's own sharded
+    AsyncHTTPClient: a single large httpx pool would be the bottleneck
+    at a hundred requests in flight.
+    """
+    def __init__(self, base_url: str, concurrency: int):
+        self.base_url = base_url
+        self.http = AsyncHTTPClient()
+        self.http.max_connections = self.http.max_per_host = concurrency
+        self.http.timeout = 600
+        self.stream_client = httpx.AsyncClient(timeout=600)
+
+    async def post(self, path: str, json: dict) -> httpx.Response:
+        return await self.http.request("POST", self.base_url + path, json=json)
+
+    async def get(self, path: str) -> httpx.Response:
+        return await self.http.request("GET", self.base_url + path)
+
+    def stream(self, method: str, path: str, json: dict):
+        # Streaming bypasses the shards; the fan-out scenario opens a single request
+        return self.stream_client.stream(method, self.base_url + path, json=json)
+
+    async def aclose(self):
+        await self.stream_client.aclose()
+        await self.http.aclose()
+
+
+async def timed_post(client: LoadClient, path: str, body: dict):
+    start = time.perf_counter()
+    try:
+        resp = await client.post(path, json=body)
+        ok = resp.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+async def single_convert_measure(client, args):
+    latencies, errors = [], 0
+    for i in range(args.converts):
+        latency, ok = await timed_post(client, "/v1/convert",
+                                       {"url": spotify_url(10_000 + i), "audio_format": args.audio_format})
+        latencies.append(latency)
+        errors += not ok
+    return latencies, errors, args.converts
+
+
+def hot_metadata_requests(args):
+    requests_ = []
+    for i in range(args.requests):
+        n = 20_000 + i % args.hot_tracks
+        if i % 2:
+            requests_.append(("/v1/tidal/meta", {"url": f"https://tidal.com/browse/track/{n}"}))
+        else:
+            requests_.append(("/v1/spotify/meta", {"url": spotify_url(n)}))
+    return requests_
+
+
+async def hot_metadata_warmup(client, args):
+    await gather_limited(args.concurrency, [
+        lambda path=path, body=body: client.post(path, json=body)
+        for path, body in hot_metadata_requests(args)[:2 * args.hot_tracks]
+    ])
+
+
+async def hot_metadata_measure(client, args):
+    results = await gather_limited(args.concurrency, [
+        lambda path=path, body=body: timed_post(client, path, body)
+        for path, body in hot_metadata_requests(args)
+    ])
+    return [r[0] for r in results], sum(not r[1] for r in results), args.requests
+
+
+async def playlist_fanout_measure(client, args):
+    latencies, errors, tracks = [], 0, 0
+    start = time.perf_counter()
+    body = {"url": "https://open.spotify.com/playlist/benchfanout", "audio_format": args.audio_format}
+    async with client.stream("POST", "/v1/convert/batch", json=body) as resp:
+        if resp.status_code != 200:
+            return [time.perf_counter() - start], 1, 0
+        async for line in resp.aiter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["event"] == "track":
+                tracks += 1
+                latencies.append(time.perf_counter() - start)
+                errors += event["status"] != "completed"
+    return latencies, errors, tracks
+
+
+async def concurrent_duplicates_measure(client, args):
+    body = {"url": spotify_url(30_000), "audio_format": args.audio_format}
+    results = await gather_limited(args.duplicates, [
+        lambda: timed_post(client, "/v1/convert", body) for _ in range(args.duplicates)
+    ])
+    return [r[0] for r in results], sum(not r[1] for r in results), args.duplicates
+
+
+async def download_serve_warmup(client, args):
+    resp = await client.post("/v1/convert", json={"url": spotify_url(40_000), "audio_format": args.audio_format})
+    resp.raise_for_status()
+    args.download_path = "/downloads/" + resp.json()["filename"]
+
+
+async def download_serve_measure(client, args):
+    async def fetch(i: int):
+        # Every other request resumes halfway through, like a seeking player
+        headers = {"Range": "bytes=4096-"} if i % 2 else {}
+        start = time.perf_counter()
+        try:
+            resp = await client.http.request("GET", client.base_url + args.download_path, headers=headers)
+            ok = resp.status_code in (200, 206)
+        except httpx.HTTPError:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    results = await gather_limited(args.concurrency, [lambda i=i: fetch(i) for i in range(args.downloads)])
+    return [r[0] for r in results], sum(not r[1] for r in results), args.downloads
+
+
+async def bundle_download_warmup(client, args):
+    filenames = []
+    for i in range(args.bundle_tracks):
+        resp = await client.post("/v1/convert",
+                                 json={"url": spotify_url(50_000 + i), "audio_format": args.audio_format})
+        resp.raise_for_status()
+        filenames.append(resp.json()["filename"])
+    resp = await client.post("/v1/bundles", json={"filenames": filenames, "format": "zip"})
+    resp.raise_for_status()
+    bundle = resp.json()
+    args.bundle_path, args.bundle_size = "/bundles/" + bundle["download_url"].rsplit("/", 1)[1], bundle["size"]
+
+
+async def bundle_download_measure(client, args):
+    async def fetch(i: int):
+        # Every other request resumes an interrupted download halfway through
+        headers = {"Range": f"bytes={args.bundle_size // 2}-"} if i % 2 else {}
+        start = time.perf_counter()
+        try:
+            resp = await client.http.request("GET", client.base_url + args.bundle_path, headers=headers)
+            ok = resp.status_code in (200, 206)
+        except httpx.HTTPError:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    results = await gather_limited(args.concurrency, [lambda i=i: fetch(i) for i in range(args.bundles)])
+    return [r[0] for r in results], sum(not r[1] for r in results), args.bundles
+
+
+SCENARIOS = {
+    "single_convert": (None, single_convert_measure),
+    "hot_metadata": (hot_metadata_warmup, hot_metadata_measure),
+    "playlist_fanout": (None, playlist_fanout_measure),
+    "concurrent_duplicates": (None, concurrent_duplicates_measure),
+    "download_serve": (download_serve_warmup, download_serve_measure),
+    "bundle_download": (bundle_download_warmup, bundle_download_measure),
+}
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies: list, errors: int, units: int, seconds: float) -> dict:
+    ms = lambda v: round(v * 1000, 1)
+    return {
+        "units": units,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput_per_s": round(units / seconds, 2) if seconds else None,
+        "p50_ms": ms(statistics.median(latencies)) if latencies else None,
+        "p95_ms": ms(percentile(latencies, 95)) if latencies else None,
+        "p99_ms": ms(percentile(latencies, 99)) if latencies else None,
+    }
+
+
+async def run_scenario(name: str, base_url: str, pid: int, args) -> dict:
+    warmup, measure = SCENARIOS[name]
+    client = LoadClient(base_url, max(args.concurrency, args.duplicates))
+    try:
+        if warmup:
+            await warmup(client, args)
+
+        pids = process_tree(pid)
+        reset_peak_rss(pids)
+        cpu_before = cpu_seconds(pids)
+        start = time.perf_counter()
+        latencies, errors, units = await measure(client, args)
+        elapsed = time.perf_counter() - start
+        pids = process_tree(pid)
+
+        result = summarize(latencies, errors, units, elapsed)
+        result["cpu_seconds"] = round(cpu_seconds(pids) - cpu_before, 3)
+        result["peak_rss_mb"] = peak_rss_mb(pids)
+
+        health = (await client.get("/")).json()
+        result["server"] = {
+            "singleflight": health.get("singleflight"),
+            "transcode": health.get("youtube", {}).get("transcode"),
+            "tagging": health.get("youtube", {}).get("tagging"),
+            "metadata_cache": health.get("metadata_cache"),
+        }
+    finally:
+        await client.aclose()
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict):
+    print("\nchange vs baseline (throughput, p95):")
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or not before.get("throughput_per_s") or not before.get("p95_ms"):
+            print(f"  {name}: no baseline")
+            continue
+        throughput = (current["throughput_per_s"] / before["throughput_per_s"] - 1) * 100
+        p95 = (current["p95_ms"] / before["p95_ms"] - 1) * 100
+        print(f"  {name}: throughput {throughput:+.1f}%  p95 {p95:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help="comma-separated scenario names")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated metadata API latency in seconds")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="simulated YouTube search latency")
+    parser.add_argument("--fixture-seconds", type=int, default=30, help="length of the audio fixture")
+    parser.add_argument("--audio-format", help="default: mp3, or original when ffmpeg is not installed")
+    parser.add_argument("--converts", type=int, default=5, help="single_convert: sequential conversions")
+    parser.add_argument("--requests", type=int, default=2000, help="hot_metadata: requests")
+    parser.add_argument("--hot-tracks", type=int, default=100, help="hot_metadata: distinct cached tracks")
+    parser.add_argument("--concurrency", type=int, default=100, help="hot_metadata: requests in flight")
+    parser.add_argument("--playlist-size", type=int, default=25, help="playlist_fanout: tracks")
+    parser.add_argument("--duplicates", type=int, default=20, help="concurrent_duplicates: identical requests")
+    parser.add_argument("--downloads", type=int, default=500, help="download_serve: requests")
+    parser.add_argument("--bundle-tracks", type=int, default=10, help="bundle_download: tracks in the bundle")
+    parser.add_argument("--bundles", type=int, default=50, help="bundle_download: requests")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="earlier --json output to compare against")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {sorted(unknown)}")
+    if args.audio_format is None:
+        args.audio_format = "mp3" if fixtures.ffmpeg_available() else "original"
+        if args.audio_format == "original":
+            print("WARNING: ffmpeg not found, converting with audio_format=original", file=sys.stderr)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "scenarios": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="spotify2mp3-bench-") as scratch:
+        fixture_formats = fixtures.make_fixtures(os.path.join(scratch, "fixtures"), args.fixture_seconds)
+        with FakeUpstream(args.latency, args.playlist_size, os.path.join(scratch, "fixtures")) as upstream:
+            for name in names:
+                workdir = tempfile.mkdtemp(prefix=f"{name}-", dir=scratch)
+                env = {
+                    **os.environ,
+                    **upstream.env(),
+                    "BENCH_FIXTURE_FORMATS": json.dumps(fixture_formats),
+                    "BENCH_SEARCH_LATENCY": str(args.search_latency),
+                    "DOWNLOAD_DIR": os.path.join(workdir, "downloads"),
+                    "CACHE_INDEX_PATH": os.path.join(workdir, "cache", "index.db"),
+                    "SINGLEFLIGHT_LOCK_DIR": os.path.join(workdir, "cache", "locks"),
+                    "SHARED_STATE_PATH": os.path.join(workdir, "cache", "state.db"),
+                    "PYTHONPATH": REPO_ROOT,
+                }
+                env.pop("METADATA_CACHE_DB", None)
+                # No collector here; export only when one is configured explicitly
+                env.setdefault("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+                print(f"running {name} ...", file=sys.stderr)
+                with AppServer(env, workdir) as app:
+                    results["scenarios"][name] = asyncio.run(run_scenario(name, app.base_url, app.process.pid, args))
+
+    print(json.dumps(results["scenarios"], indent=2))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            compare(results, json.load(fh))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Load test: metadata lookups through the blocking threadpool path vs the
+async httpx path, against a local fake Tidal with artificial latency.
+
+    python -m benchmarks.metadata_load --requests 2000 --concurrency 500
+
+Every request asks for a distinct track ID so the metadata cache never
+answers; what is measured is how many upstream calls each handler style
+keeps in flight.
+"""
+import os
+import time
+import json
+import asyncio
+import argparse
+import statistics
+import httpx
+from fastapi import FastAPI
+from benchmarks.fake_upstream import FakeUpstream
+
+
+def build_apps():
+    # Imported late so the services pick up the fake upstream's environment
+    from models import SongMetadata, TidalRequest
+    from services.tidal_service import TidalService
+    from services.http_client import AsyncHTTPClient
+    from services.async_tidal_service import AsyncTidalService
+
+    sync_app = FastAPI()
+    tidal_service = TidalService()
+
+    @sync_app.post("/v1/tidal/meta", response_model=SongMetadata)
+    def sync_meta(request: TidalRequest):
+        return tidal_service.get_metadata(request.url)
+
+    async_app = FastAPI()
+    http = AsyncHTTPClient()
+    async_tidal_service = AsyncTidalService(TidalService(), http)
+
+    @async_app.post("/v1/tidal/meta", response_model=SongMetadata)
+    async def async_meta(request: TidalRequest):
+        return await async_tidal_service.get_metadata(request.url)
+
+    return sync_app, async_app, http
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def drive(app, total: int, concurrency: int, offset: int) -> dict:
+    latencies = []
+    errors = 0
+    limit = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def one(i: int):
+            nonlocal errors
+            async with limit:
+                start = time.perf_counter()
+                resp = await client.post("/v1/tidal/meta",
+                                         json={"url": f"https://tidal.com/browse/track/{offset + i}"})
+                latencies.append(time.perf_counter() - start)
+                if resp.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": total,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "req_per_s": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+async def run(args) -> dict:
+    sync_app, async_app, http = build_apps()
+    results = {
+        "upstream_latency_ms": args.latency * 1000,
+        "concurrency": args.concurrency,
+        "sync_threadpool": await drive(sync_app, args.requests, args.concurrency, offset=1_000_000),
+        "async_httpx": await drive(async_app, args.requests, args.concurrency, offset=2_000_000),
+    }
+    await http.aclose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated upstream latency in seconds")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    with FakeUpstream(latency=args.latency) as upstream:
+        os.environ.update(upstream.env())
+        # One process: nothing to share, and no state file left behind
+        os.environ.setdefault("SHARED_STATE_BACKEND", "memory")
+        results = asyncio.run(run(args))
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Load test: metadata cache hit ratio as uvicorn workers are added, per
+SharedState backend (memory = per-process, local = SQLite on the host,
+redis = benchmarks.fake_redis standing in for a Redis server).
+
+    python -m benchmarks.shared_state_load --workers 1 2 4 --requests 2000 --hot-tracks 100
+
+Every request is a Tidal lookup from a fixed set of hot tracks, on a new
+connection so the kernel spreads them over the workers. The hit ratio is
+1 - upstream calls / requests, counted by the fake Tidal: with per-process
+caches every worker has to fetch each track itself.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import urllib.request
+import httpx
+from benchmarks.fake_redis import FakeRedis
+from benchmarks.fake_upstream import FakeUpstream
+from benchmarks.loadtest import AppServer, REPO_ROOT, gather_limited, summarize
+
+BACKENDS = ("memory", "local", "redis")
+
+
+def upstream_stats(base_url: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}/stats") as resp:
+        return json.load(resp)
+
+
+async def drive(base_url: str, args) -> dict:
+    latencies, errors = [], 0
+    # No keep-alive: each request picks a worker afresh
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def one(i: int):
+            nonlocal errors
+            start = time.perf_counter()
+            resp = await client.post("/v1/tidal/meta", json={"url": f"https://tidal.com/browse/track/{30_000 + i % args.hot_tracks}"})
+            latencies.append(time.perf_counter() - start)
+            if resp.status_code != 200:
+                errors += 1
+
+        start = time.perf_counter()
+        await gather_limited(args.concurrency, [lambda i=i: one(i) for i in range(args.requests)])
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, args.requests, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--hot-tracks", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated upstream latency in seconds")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {"requests": args.requests, "hot_tracks": args.hot_tracks}
+    with tempfile.TemporaryDirectory(prefix="shared-state-bench-") as scratch, \
+            FakeUpstream(latency=args.latency) as upstream, FakeRedis() as redis:
+        for backend in args.backends:
+            results[backend] = {}
+            for workers in args.workers:
+                workdir = tempfile.mkdtemp(prefix=f"{backend}-{workers}-", dir=scratch)
+                env = {
+                    **os.environ,
+                    **upstream.env(),
+                    "BENCH_FIXTURE_FORMATS": "{}",
+                    "DOWNLOAD_DIR": os.path.join(workdir, "downloads"),
+                    "CACHE_INDEX_PATH": os.path.join(workdir, "cache", "index.db"),
+                    "SINGLEFLIGHT_LOCK_DIR": os.path.join(workdir, "cache", "locks"),
+                    "SHARED_STATE_BACKEND": backend,
+                    "SHARED_STATE_PATH": os.path.join(workdir, "cache", "state.db"),
+                    "REDIS_URL": redis.url,
+                    # A fresh namespace per run, so nothing carries over
+                    "REDIS_KEY_PREFIX": f"bench-{workers}:",
+                    "PYTHONPATH": REPO_ROOT,
+                }
+                env.pop("METADATA_CACHE_DB", None)
+                env.setdefault("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+                print(f"running {backend} x{workers} ...", file=sys.stderr)
+                with AppServer(env, workdir, workers=workers) as app:
+                    before = upstream_stats(upstream.base_url)["tidal_calls"]
+                    result = asyncio.run(drive(app.base_url, args))
+                    calls = upstream_stats(upstream.base_url)["tidal_calls"] - before
+                result["upstream_calls"] = calls
+                result["hit_ratio"] = round(1 - calls / args.requests, 4)
+                results[backend][f"workers_{workers}"] = result
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Load test: bursty cold Spotify lookups, one GET per track vs micro-batched
+GET /tracks?ids=, against a local fake Spotify that enforces a per-second
+quota with 429 + Retry-After.
+
+    python -m benchmarks.spotify_burst --bursts 5 --burst-size 400 --rate-limit 20
+
+Every request asks for a distinct track so the metadata cache never
+answers. Reported per mode: throughput, latency, failed requests, and the
+upstream calls and 429s the fake saw.
+"""
+import os
+import time
+import json
+import asyncio
+import argparse
+import statistics
+import urllib.request
+import httpx
+from fastapi import FastAPI
+from benchmarks.fake_upstream import FakeUpstream
+from benchmarks.metadata_load import percentile
+
+MODES = {
+    # One call per track and no client-side pacing: every 429 is waited out call by call
+    "per_track": {"SPOTIFY_BATCH_SIZE": "1", "SPOTIFY_RATE_LIMIT": "100000", "SPOTIFY_RATE_BURST": "100000"},
+    "batched": {},
+}
+
+
+def build_app(overrides: dict):
+    # Imported late so the services pick up the fake upstream's environment
+    from models import ConvertRequest, SongMetadata
+    from services.spotify_service import SpotifyService
+    from services.http_client import AsyncHTTPClient
+    from services.async_spotify_service import AsyncSpotifyService
+
+    saved = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        http = AsyncHTTPClient()
+        service = AsyncSpotifyService(SpotifyService(), http)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    app = FastAPI()
+
+    @app.post("/v1/spotify/meta", response_model=SongMetadata)
+    async def meta(request: ConvertRequest):
+        return await service.get_metadata(request.url)
+
+    return app, http, service
+
+
+def upstream_stats(base_url: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}/stats") as resp:
+        return json.load(resp)
+
+
+async def drive(app, bursts: int, burst_size: int, gap: float, offset: int) -> dict:
+    latencies = []
+    errors = 0
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        async def one(n: int):
+            nonlocal errors
+            start = time.perf_counter()
+            resp = await client.post("/v1/spotify/meta", json={"url": f"spotify:track:{offset + n:022d}"})
+            latencies.append(time.perf_counter() - start)
+            if resp.status_code != 200:
+                errors += 1
+
+        start = time.perf_counter()
+        waves = []
+        for b in range(bursts):
+            waves.append(asyncio.gather(*(one(b * burst_size + i) for i in range(burst_size))))
+            if b < bursts - 1:
+                await asyncio.sleep(gap)
+        await asyncio.gather(*waves)
+        elapsed = time.perf_counter() - start
+
+    total = bursts * burst_size
+    return {
+        "requests": total,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "req_per_s": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+async def run(args, base_url: str) -> dict:
+    results = {"upstream_latency_ms": args.latency * 1000, "upstream_rate_limit": args.rate_limit}
+    for i, (mode, overrides) in enumerate(MODES.items()):
+        app, http, service = build_app(overrides)
+        before = upstream_stats(base_url)
+        result = await drive(app, args.bursts, args.burst_size, args.gap, offset=(i + 1) * 10_000_000)
+        after = upstream_stats(base_url)
+        result["upstream_calls"] = after["spotify_calls"] - before["spotify_calls"]
+        result["upstream_429s"] = after["spotify_throttled"] - before["spotify_throttled"]
+        result["batches"] = service.batcher.stats()
+        result["rate_limiter"] = service.rate_limiter.stats()
+        results[mode] = result
+        await http.aclose()
+        # Let the fake's quota window roll over between modes
+        await asyncio.sleep(1.5)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--burst-size", type=int, default=400)
+    parser.add_argument("--gap", type=float, default=1.0, help="seconds between bursts")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated upstream latency in seconds")
+    parser.add_argument("--rate-limit", type=int, default=20, help="fake Spotify calls per second before 429s")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    with FakeUpstream(latency=args.latency, rate_limit=args.rate_limit) as upstream:
+        os.environ.update(upstream.env())
+        # One process: nothing to share, and no state file left behind
+        os.environ.setdefault("SHARED_STATE_BACKEND", "memory")
+        results = asyncio.run(run(args, upstream.base_url))
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Cold-start benchmark: how long a fresh worker takes to import main, to
+answer its first health check, and to serve its first metadata lookup
+(which builds the Spotify services on demand).
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --app-dir /path/to/other/checkout   # compare trees
+
+Each run is a new interpreter with an empty download directory. The OTLP
+endpoint points at a closed local port, so exporter setup is paid for but
+nothing is sent.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+from benchmarks.fake_upstream import FakeUpstream
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def worker_env(workdir: str, upstream_env: dict) -> dict:
+    return {
+        **os.environ,
+        **upstream_env,
+        "DOWNLOAD_DIR": os.path.join(workdir, "downloads"),
+        "CACHE_INDEX_PATH": os.path.join(workdir, "cache", "index.db"),
+        "SINGLEFLIGHT_LOCK_DIR": os.path.join(workdir, "cache", "locks"),
+        "SHARED_STATE_PATH": os.path.join(workdir, "cache", "state.db"),
+        "OTEL_EXPORTER_OTLP_ENDPOINT": f"http://127.0.0.1:{free_port()}",
+    }
+
+
+def measure_import(app_dir: str, env: dict) -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=app_dir, env=env,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def rss_kib(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as fh:
+        for line in fh:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def measure_server(app_dir: str, env: dict, timeout: float = 60) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            try:
+                with urllib.request.urlopen(f"{base}/", timeout=1) as resp:
+                    if resp.status == 200:
+                        break
+            except OSError:
+                if proc.poll() is not None or time.perf_counter() - started > timeout:
+                    raise RuntimeError("worker did not become healthy")
+                time.sleep(0.005)
+        healthy = time.perf_counter() - started
+        rss_healthy = rss_kib(proc.pid)
+
+        request = urllib.request.Request(
+            f"{base}/v1/spotify/meta", data=json.dumps({"url": f"spotify:track:{7:022d}"}).encode(),
+            headers={"Content-Type": "application/json"}
+        )
+        first = time.perf_counter()
+        with urllib.request.urlopen(request, timeout=30) as resp:
+            resp.read()
+        first_metadata = time.perf_counter() - first
+        return {
+            "healthy_s": healthy,
+            "first_metadata_s": first_metadata,
+            "rss_healthy_mib": rss_healthy / 1024,
+            "rss_after_metadata_mib": rss_kib(proc.pid) / 1024,
+        }
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def summarize(samples: list) -> dict:
+    return {"median": round(statistics.median(samples), 3), "min": round(min(samples), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--app-dir", default=REPO_ROOT, help="tree containing main.py")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    imports, servers = [], []
+    with FakeUpstream(latency=0.0) as upstream:
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory(prefix="startup-") as workdir:
+                env = worker_env(workdir, upstream.env())
+                imports.append(measure_import(args.app_dir, env))
+            with tempfile.TemporaryDirectory(prefix="startup-") as workdir:
+                servers.append(measure_server(args.app_dir, worker_env(workdir, upstream.env())))
+
+    results = {
+        "app_dir": args.app_dir,
+        "runs": args.runs,
+        "import_main_s": summarize(imports),
+        **{key: summarize([run[key] for run in servers]) for key in servers[0]},
+    }
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Track -> video index: what a node warmed from another node's export saves
+over one that has to search, and what the index itself costs at scale.
+
+    python -m benchmarks.track_index --tracks 20 --entries 100000
+
+End to end, against the fakes (as in benchmarks.loadtest):
+  cold      a fresh node converts --tracks distinct Spotify tracks; each is searched for
+  export    GET /v1/track-index/export from that node
+  warm      a second fresh node POSTs the export to /v1/track-index/import, then
+            converts the same tracks, and the Tidal releases sharing their ISRCs
+Reported per phase: conversion latency percentiles, YouTube searches the
+app ran (search cache misses) and the index counters from its health.
+
+In process, with --entries synthetic mappings: import rate, export size
+per entry and the latency of lookups by source ID and by ISRC.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+import httpx
+from benchmarks import fixtures
+from benchmarks.fake_upstream import FakeUpstream
+from benchmarks.loadtest import AppServer, REPO_ROOT, percentile, spotify_url
+
+FIRST_TRACK = 30_000
+
+
+def app_env(upstream, fixture_formats: dict, workdir: str, args) -> dict:
+    env = {
+        **os.environ,
+        **upstream.env(),
+        "BENCH_FIXTURE_FORMATS": json.dumps(fixture_formats),
+        "BENCH_SEARCH_LATENCY": str(args.search_latency),
+        "DOWNLOAD_DIR": os.path.join(workdir, "downloads"),
+        "CACHE_INDEX_PATH": os.path.join(workdir, "cache", "index.db"),
+        "SINGLEFLIGHT_LOCK_DIR": os.path.join(workdir, "cache", "locks"),
+        "SHARED_STATE_PATH": os.path.join(workdir, "cache", "state.db"),
+        "PYTHONPATH": REPO_ROOT,
+    }
+    env.pop("METADATA_CACHE_DB", None)
+    env.pop("TRACK_INDEX_PATH", None)
+    env.pop("TRACK_INDEX_SNAPSHOT", None)
+    env.setdefault("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+    return env
+
+
+async def convert_all(client: httpx.AsyncClient, urls: list, audio_format: str) -> dict:
+    """Sequential conversions, then the counters that show whether YouTube was searched."""
+    latencies, errors = [], 0
+    for url in urls:
+        start = time.perf_counter()
+        resp = await client.post("/v1/convert", json={"url": url, "audio_format": audio_format})
+        latencies.append(time.perf_counter() - start)
+        errors += resp.status_code != 200
+    health = (await client.get("/")).json()
+    return {
+        "requests": len(urls),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "youtube_searches": health.get("youtube", {}).get("search_cache", {}).get("misses", 0),
+        "track_index": health.get("track_index"),
+    }
+
+
+async def cold_node(base_url: str, urls: list, args) -> tuple:
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        cold = await convert_all(client, urls, args.audio_format)
+        start = time.perf_counter()
+        resp = await client.get("/v1/track-index/export")
+        resp.raise_for_status()
+        snapshot = resp.content
+        export = {"ms": round((time.perf_counter() - start) * 1000, 1), "bytes": len(snapshot),
+                  "entries": snapshot.count(b"\n")}
+    return cold, export, snapshot
+
+
+async def warm_node(base_url: str, snapshot: bytes, urls: list, tidal_urls: list, args) -> dict:
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        start = time.perf_counter()
+        resp = await client.post("/v1/track-index/import", content=snapshot,
+                                 headers={"content-type": "application/x-ndjson"})
+        resp.raise_for_status()
+        imported = {"ms": round((time.perf_counter() - start) * 1000, 1), **resp.json()}
+        same = await convert_all(client, urls, args.audio_format)
+        by_isrc = await convert_all(client, tidal_urls, args.audio_format)
+    return {"import": imported, "same_tracks": same, "tidal_by_isrc": by_isrc}
+
+
+def index_scale(scratch: str, entries: int, lookups: int) -> dict:
+    from services.track_index import TrackIndex
+
+    os.environ["SHARED_STATE_BACKEND"] = "memory"
+    now = int(time.time())
+    lines = [json.dumps({"source_id": f"spotify:track:{n:022d}", "video_id": f"v{n:010d}",
+                         "confidence": 0.9, "matched_at": now, "isrc": f"QZ{n:010d}"})
+             for n in range(entries)]
+    index = TrackIndex(os.path.join(scratch, "scale.db"))
+    start = time.perf_counter()
+    index.import_lines(lines)
+    import_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    exported = sum(len(chunk) for chunk in index.export())
+    export_seconds = time.perf_counter() - start
+
+    rng = random.Random(1)
+    timings = {"source_id": [], "isrc": []}
+    for _ in range(lookups):
+        n = rng.randrange(entries)
+        start = time.perf_counter()
+        index.lookup(f"spotify:track:{n:022d}")
+        timings["source_id"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        index.lookup(None, f"QZ{n:010d}")
+        timings["isrc"].append(time.perf_counter() - start)
+    db_bytes = sum(os.path.getsize(os.path.join(scratch, name)) for name in os.listdir(scratch)
+                   if name.startswith("scale.db"))
+    return {
+        "entries": entries,
+        "import_entries_per_s": round(entries / import_seconds),
+        "export_entries_per_s": round(entries / export_seconds),
+        "export_bytes_per_entry": round(exported / entries, 1),
+        "db_bytes_per_entry": round(db_bytes / entries, 1),
+        **{f"lookup_{kind}_p50_us": round(statistics.median(values) * 1e6, 1) for kind, values in timings.items()},
+        **{f"lookup_{kind}_p99_us": round(percentile(values, 99) * 1e6, 1) for kind, values in timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=20, help="distinct tracks converted per phase")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="simulated YouTube search latency")
+    parser.add_argument("--fixture-seconds", type=int, default=30, help="length of the audio fixture")
+    parser.add_argument("--audio-format", help="default: mp3, or original when ffmpeg is not installed")
+    parser.add_argument("--entries", type=int, default=100_000, help="synthetic mappings for the scale run")
+    parser.add_argument("--lookups", type=int, default=10_000, help="lookups timed in the scale run")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    if args.audio_format is None:
+        args.audio_format = "mp3" if fixtures.ffmpeg_available() else "original"
+
+    urls = [spotify_url(FIRST_TRACK + i) for i in range(args.tracks)]
+    # The fake Tidal gives track n the same ISRC as Spotify track n
+    tidal_urls = [f"https://tidal.com/browse/track/{FIRST_TRACK + i}" for i in range(args.tracks)]
+    results = {"tracks": args.tracks, "audio_format": args.audio_format, "search_latency": args.search_latency}
+    with tempfile.TemporaryDirectory(prefix="track-index-bench-") as scratch:
+        fixture_formats = fixtures.make_fixtures(os.path.join(scratch, "fixtures"), args.fixture_seconds)
+        with FakeUpstream(0.02, fixtures_dir=os.path.join(scratch, "fixtures")) as upstream:
+            workdir = tempfile.mkdtemp(prefix="cold-", dir=scratch)
+            print("running cold node ...", file=sys.stderr)
+            with AppServer(app_env(upstream, fixture_formats, workdir, args), workdir) as app:
+                results["cold"], results["export"], snapshot = asyncio.run(cold_node(app.base_url, urls, args))
+            workdir = tempfile.mkdtemp(prefix="warm-", dir=scratch)
+            print("running warm node ...", file=sys.stderr)
+            with AppServer(app_env(upstream, fixture_formats, workdir, args), workdir) as app:
+                results["warm"] = asyncio.run(warm_node(app.base_url, snapshot, urls, tidal_urls, args))
+
+        print("running index scale ...", file=sys.stderr)
+        scale_dir = tempfile.mkdtemp(prefix="scale-", dir=scratch)
+        results["scale"] = index_scale(scale_dir, args.entries, args.lookups)
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Fault-injection run: what a Tidal slowdown or outage does to the rest of
+the app, with the upstream guards (adaptive concurrency limit + circuit
+breaker) at their defaults and with them effectively turned off.
+
+    python -m benchmarks.upstream_faults --phase-seconds 10 --tidal-concurrency 40
+
+Tidal lookups go through the blocking /v1/tidal/meta/batch endpoint (one
+fresh track per request, so the cache never answers) and share the
+threadpool with the "victim" traffic, /v1/youtube/search against the fake
+extractor. The fake Tidal is switched through four phases via its
+POST /faults: healthy, brownout (every call slower than TIDAL_TIMEOUT),
+outage (every call a 503) and recovered. Reported per phase and endpoint:
+status codes and latency percentiles by request start, plus the Tidal
+guard as / showed it at the end of the phase.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import tempfile
+import httpx
+from benchmarks.fake_upstream import FakeUpstream
+from benchmarks.loadtest import AppServer, REPO_ROOT, summarize
+
+PHASES = [
+    ("healthy", {}),
+    ("brownout", {"latency": 5}),
+    ("outage", {"error_rate": 1.0, "status": 503}),
+    ("recovered", {}),
+]
+
+MODES = {
+    "guarded": {},
+    # Limits no one reaches and a breaker that never opens
+    "unguarded": {
+        "TIDAL_CONCURRENCY": "100000",
+        "TIDAL_MAX_CONCURRENCY": "100000",
+        "TIDAL_LATENCY_TARGET_MS": "0",
+        "UPSTREAM_BREAKER_FAILURE_RATIO": "2",
+    },
+}
+
+
+async def drive(app_url: str, upstream_url: str, args) -> dict:
+    current = {"phase": None}
+    records = []
+    ids = itertools.count(60_000)
+    stop = asyncio.Event()
+
+    def tidal_request():
+        return "/v1/tidal/meta/batch", {"urls": [f"https://tidal.com/browse/track/{next(ids)}"]}
+
+    def victim_request():
+        return "/v1/youtube/search", {"query": f"Bench Artist - Track {next(ids)}"}
+
+    async def worker(client, make_request):
+        while not stop.is_set():
+            phase = current["phase"]
+            path, body = make_request()
+            start = time.perf_counter()
+            try:
+                status = (await client.post(path, json=body)).status_code
+            except httpx.HTTPError:
+                status = "error"
+            records.append((phase, path, status, time.perf_counter() - start))
+
+    limits = httpx.Limits(max_connections=args.tidal_concurrency + args.victim_concurrency + 4)
+    snapshots = {}
+    async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=300) as client, \
+            httpx.AsyncClient(base_url=upstream_url) as upstream:
+        workers = []
+        for name, fault in PHASES:
+            await upstream.post("/faults", json={"tidal": fault})
+            current["phase"] = name
+            if not workers:
+                workers = [asyncio.ensure_future(worker(client, tidal_request))
+                           for _ in range(args.tidal_concurrency)]
+                workers += [asyncio.ensure_future(worker(client, victim_request))
+                            for _ in range(args.victim_concurrency)]
+            await asyncio.sleep(args.phase_seconds)
+            start = time.perf_counter()
+            health = (await client.get("/")).json()
+            tidal = health.get("upstreams", {}).get("tidal", {})
+            snapshots[name] = {
+                "health_ms": round((time.perf_counter() - start) * 1000, 1),
+                **{key: tidal.get(key) for key in ("state", "limit", "in_flight", "queued", "opened",
+                                                    "rejected_unavailable", "rejected_overloaded")},
+            }
+        stop.set()
+        await asyncio.gather(*workers)
+
+    results = {}
+    for name, _ in PHASES:
+        phase = {"tidal_guard": snapshots[name]}
+        for label, path in (("tidal", "/v1/tidal/meta/batch"), ("victim", "/v1/youtube/search")):
+            rows = [r for r in records if r[0] == name and r[1] == path]
+            statuses = {}
+            for row in rows:
+                statuses[str(row[2])] = statuses.get(str(row[2]), 0) + 1
+            summary = summarize([r[3] for r in rows], sum(r[2] != 200 for r in rows), len(rows), args.phase_seconds)
+            phase[label] = {**summary, "statuses": statuses}
+        results[name] = phase
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--phase-seconds", type=float, default=10)
+    parser.add_argument("--tidal-concurrency", type=int, default=40, help="Tidal requests kept in flight")
+    parser.add_argument("--victim-concurrency", type=int, default=4, help="YouTube searches kept in flight")
+    parser.add_argument("--tidal-timeout", type=float, default=2, help="TIDAL_TIMEOUT for the app")
+    parser.add_argument("--breaker-cooldown", type=float, default=3, help="UPSTREAM_BREAKER_COOLDOWN for the app")
+    parser.add_argument("--latency", type=float, default=0.02, help="healthy upstream latency in seconds")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {"phase_seconds": args.phase_seconds, "tidal_concurrency": args.tidal_concurrency}
+    with tempfile.TemporaryDirectory(prefix="upstream-faults-bench-") as scratch, \
+            FakeUpstream(latency=args.latency) as upstream:
+        for mode in args.modes:
+            workdir = tempfile.mkdtemp(prefix=f"{mode}-", dir=scratch)
+            env = {
+                **os.environ,
+                **upstream.env(),
+                # Searches resolve formats but never fetch them
+                "BENCH_FIXTURE_FORMATS": json.dumps({"webm": ["opus", 160]}),
+                "BENCH_SEARCH_LATENCY": "0.05",
+                "DOWNLOAD_DIR": os.path.join(workdir, "downloads"),
+                "CACHE_INDEX_PATH": os.path.join(workdir, "cache", "index.db"),
+                "SINGLEFLIGHT_LOCK_DIR": os.path.join(workdir, "cache", "locks"),
+                "SHARED_STATE_PATH": os.path.join(workdir, "cache", "state.db"),
+                "TIDAL_TIMEOUT": str(args.tidal_timeout),
+                "UPSTREAM_BREAKER_COOLDOWN": str(args.breaker_cooldown),
+                "PYTHONPATH": REPO_ROOT,
+                **MODES[mode],
+            }
+            env.pop("METADATA_CACHE_DB", None)
+            env.setdefault("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+            print(f"running {mode} ...", file=sys.stderr)
+            with AppServer(env, workdir) as app:
+                results[mode] = asyncio.run(drive(app.base_url, upstream.base_url, args))
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
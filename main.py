@@ -1,10 +1,14 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import StreamingResponse, FileResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from urllib.parse import quote
 from opentelemetry import trace
-from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+import os
+import threading
 
 # 1. Setup OpenTelemetry
 resource = Resource.create(attributes={
@@ -12,13 +16,18 @@ resource = Resource.create(attributes={
     "compose_service": "spotify2mp3"
 })
 
-tracer_provider = TracerProvider(resource=resource)
-otlp_exporter = OTLPSpanExporter(endpoint="http://jaeger:4317", insecure=True)
-span_processor = BatchSpanProcessor(otlp_exporter)
-tracer_provider.add_span_processor(span_processor)
+# Fraction of traces kept; lower it under heavy load. An empty endpoint disables export.
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "http://jaeger:4317")
+TRACE_SAMPLE_RATIO = float(os.environ.get("OTEL_TRACES_SAMPLER_ARG", "1.0"))
+
+tracer_provider = TracerProvider(resource=resource, sampler=ParentBased(TraceIdRatioBased(TRACE_SAMPLE_RATIO)))
 trace.set_tracer_provider(tracer_provider)
 
-import os
+def attach_otlp_exporter():
+    # The gRPC exporter stack is slow to import; spans started before it is attached are not exported
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=OTLP_ENDPOINT, insecure=True)))
 
 # 2. Initialize FastAPI
 app = FastAPI(
@@ -38,99 +47,269 @@ async def strip_path_prefix(request: Request, call_next):
     response = await call_next(request)
     return response
 
-from services.spotify_service import SpotifyService
-from services.youtube_service import YouTubeService
-from services.tidal_service import TidalService
-from models import ConvertRequest, ConvertResponse, SongMetadata, YouTubeSearchResult, YouTubeSearchRequest, YouTubeDownloadRequest, TidalRequest
-
-from fastapi.staticfiles import StaticFiles
+from services.registry import Services
+from services.shared_state import peek_shared_state
+from services import telemetry
+import json
+from models import ConvertRequest, ConvertResponse, SongMetadata, YouTubeSearchResult, YouTubeSearchRequest, YouTubeDownloadRequest, TidalRequest, TidalBatchRequest, TidalBatchResponse, JobSubmitResponse, JobStatus, BatchConvertRequest, BatchTrackResult, BundleRequest, BundleResponse, TrackIndexImportResponse
 
 # ... previous code ...
 
 # 3. Instrument FastAPI
 FastAPIInstrumentor.instrument_app(app)
 
-# Mount downloads directory
-os.makedirs("/app/downloads", exist_ok=True)
-app.mount("/downloads", StaticFiles(directory="/app/downloads"), name="downloads")
-
 # --- Services ---
-spotify_service = SpotifyService()
-youtube_service = YouTubeService()
-tidal_service = TidalService()
+# Built on first use, so a new worker serves / without loading yt-dlp or spotipy
+services = Services()
+
+telemetry.register_stats("jobs", services.stats_of("jobs", lambda s: s.stats()))
+telemetry.register_stats("download_cache", services.stats_of("download_cache", lambda s: s.stats()))
+telemetry.register_stats("transcode_scheduler", services.stats_of("transcode_scheduler", lambda s: s.stats()))
+telemetry.register_stats("spotify_rate_limiter", services.stats_of("spotify", lambda s: s.rate_limiter.stats()))
+telemetry.register_stats("upstream_spotify", services.stats_of("spotify", lambda s: s.guard.stats()))
+telemetry.register_stats("upstream_tidal", services.stats_of("tidal", lambda s: s.guard.stats()))
+telemetry.register_stats("upstream_youtube", services.stats_of("youtube", lambda s: s.guard.stats()))
+telemetry.register_stats("track_index", services.stats_of("track_index", lambda s: s.stats()))
+telemetry.register_stats("upstream_youtube_download", services.stats_of("youtube", lambda s: s.download_guard.stats()))
+
+async def get_metadata_async(url: str) -> SongMetadata:
+    name = "async_tidal" if "tidal.com" in url else "async_spotify"
+    return await (await services.resolve(name)).get_metadata(url)
+
+@app.on_event("startup")
+def start_exporter():
+    if OTLP_ENDPOINT:
+        threading.Thread(target=attach_otlp_exporter, name="otlp-exporter-setup", daemon=True).start()
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await services.aclose()
+
+@app.on_event("shutdown")
+def shutdown_services():
+    services.shutdown()
 
 @app.get("/")
 def health():
-    return {
-        "status": "online", 
+    """Reports on the services built so far; never builds one."""
+    status = {
+        "status": "online",
         "service": "miravaz-spotify2mp3",
-        "spotify_connected": spotify_service.sp is not None
+        "spotify_connected": bool(os.environ.get("SPOTIFY_CLIENT_ID") and os.environ.get("SPOTIFY_CLIENT_SECRET")),
+        "services_built": services.build_seconds,
     }
+    metadata_cache = {}
+    if (spotify := services.peek("spotify")) is not None:
+        status["spotify"] = {"rate_limiter": spotify.rate_limiter.stats(), "batches": spotify.batcher.stats()}
+        metadata_cache["spotify"] = spotify.metadata_cache.stats()
+    if (async_spotify := services.peek("async_spotify")) is not None:
+        status["spotify"]["async_batches"] = async_spotify.batcher.stats()
+    if (tidal := services.peek("tidal")) is not None:
+        metadata_cache["tidal"] = tidal.metadata_cache.stats()
+    if metadata_cache:
+        status["metadata_cache"] = metadata_cache
+    if (jobs := services.peek("jobs")) is not None:
+        status["jobs"] = jobs.stats()
+    if (cache := services.peek("download_cache")) is not None:
+        status["cache"] = cache.stats()
+    if (youtube := services.peek("youtube")) is not None:
+        status["youtube"] = {
+            "search_cache": youtube.search_cache.stats(),
+            "search_pool": youtube.search_pool.stats(),
+            "match_pool": youtube.match_pool.stats(),
+            "download_pools": {spec: pool.stats() for spec, pool in youtube.download_pools.items()},
+            "transcode": youtube.transcode_summary(),
+            "tagging": youtube.tagging_summary(),
+            "resumed_downloads": {"count": youtube.resumed_downloads, "bytes": youtube.resumed_bytes}
+        }
+    if (scheduler := services.peek("transcode_scheduler")) is not None:
+        status["transcode_scheduler"] = scheduler.stats()
+    if (http_client := services.peek("http_client")) is not None:
+        status["http_client"] = http_client.stats()
+    singleflight = {}
+    if (convert := services.peek("convert")) is not None:
+        singleflight["convert"] = convert.convert_flight.stats()
+    if youtube is not None:
+        singleflight["download"] = youtube.download_flight.stats()
+    if singleflight:
+        status["singleflight"] = singleflight
+    if (track_index := services.peek("track_index")) is not None:
+        status["track_index"] = track_index.stats()
+    if (state := peek_shared_state()) is not None:
+        status["shared_state"] = state.stats()
+    # Concurrency limit and circuit breaker per provider
+    upstreams = {}
+    if spotify is not None:
+        upstreams["spotify"] = spotify.guard.stats()
+    if tidal is not None:
+        upstreams["tidal"] = tidal.guard.stats()
+    if youtube is not None:
+        upstreams["youtube"] = youtube.guard.stats()
+        upstreams["youtube_download"] = youtube.download_guard.stats()
+    if upstreams:
+        status["upstreams"] = upstreams
+    return status
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus exposition: stage histograms, cache lookups, jobs in flight, disk cache usage."""
+    return Response(telemetry.render_metrics(), media_type=telemetry.METRICS_CONTENT_TYPE)
 
 @app.post("/v1/spotify/meta", response_model=SongMetadata)
-def get_spotify_metadata(request: ConvertRequest):
-    return spotify_service.get_metadata(request.url)
+async def get_spotify_metadata(request: ConvertRequest):
+    return await (await services.resolve("async_spotify")).get_metadata(request.url)
 
 @app.post("/v1/tidal/meta", response_model=SongMetadata, response_model_exclude_none=True)
-def get_tidal_metadata(request: TidalRequest):
-    return tidal_service.get_metadata(request.url)
+async def get_tidal_metadata(request: TidalRequest):
+    return await (await services.resolve("async_tidal")).get_metadata(request.url)
+
+@app.post("/v1/tidal/meta/batch", response_model=TidalBatchResponse, response_model_exclude_none=True)
+def get_tidal_metadata_batch(request: TidalBatchRequest):
+    return TidalBatchResponse(tracks=services.tidal.get_metadata_batch(request.urls))
 
 
 
 @app.post("/v1/youtube/search", response_model=YouTubeSearchResult)
 def search_youtube(request: YouTubeSearchRequest):
-    return youtube_service.search_video(request.query)
+    return services.youtube.search_video(request.query)
 
 @app.post("/v1/youtube/download")
 def download_youtube_audio(request: YouTubeDownloadRequest, req: Request):
     # For direct download, we use a generic name or parse from video title if available
-    # Here we just use video ID as base
-    filename = youtube_service.download_file(request.video_url, "downloaded_audio")
+    # Here we just use video ID as base, so different videos never share a name
+    # (imported here: the handler builds the YouTube stack anyway)
+    from services.youtube_service import extract_video_id
+    video_id = extract_video_id(request.video_url)
+    filename_base = f"downloaded_audio-{video_id}" if video_id else "downloaded_audio"
+    filename = services.youtube.download_file(
+        request.video_url, filename_base, audio_format=request.audio_format, quality=request.quality,
+        transcoder=services.interactive_transcoder)
     download_url = construct_download_url(req, filename)
     return {"filename": filename, "download_url": download_url}
 
 @app.post("/v1/convert", response_model=ConvertResponse)
-def convert_to_mp3(request: ConvertRequest, req: Request):
-    # 1. Get Metadata based on Source
-    if "tidal.com" in request.url:
-         metadata = tidal_service.get_metadata(request.url)
-    elif "spotify.com" in request.url:
-         metadata = spotify_service.get_metadata(request.url)
-    else:
-         # Fallback to Spotify or raise error? Defaulting to Spotify for now as legacy behavior or raise
-         # Actually safest to raise if unknown, but for backward compat maybe assume spotify?
-         # Given generic 'url', best to raise if not recognized.
-         if "open.spotify.com" not in request.url and "http" in request.url:
-              pass # logic check
-         
-         # strict check
-         metadata = spotify_service.get_metadata(request.url)
-
-    # 2. Search YouTube
-    query = f"{metadata.artist} - {metadata.title} audio"
-    yt_result = youtube_service.search_video(query)
-    
-    # 3. Download
-    filename_base = f"{metadata.artist} - {metadata.title}"
-    filename = youtube_service.download_file(yt_result.video_url, filename_base)
-    
-    download_url = construct_download_url(req, filename)
+async def convert_to_mp3(request: ConvertRequest, req: Request):
+    # Metadata on the event loop; search/download/ffmpeg stay on the threadpool
+    metadata = await get_metadata_async(request.url)
+    # Resolved in the worker thread too: the first call builds the YouTube stack
+    result = await run_in_threadpool(lambda: services.convert.convert(
+        request.url, audio_format=request.audio_format, quality=request.quality,
+        transcoder=services.interactive_transcoder, metadata=metadata))
+    return to_convert_response(req, result)
 
-    return ConvertResponse(
-        metadata=metadata,
-        youtube_url=yt_result.video_url,
-        download_url=download_url,
-        filename=filename
+@app.get("/v1/stream")
+def stream_mp3(url: str):
+    """
+    Streams the MP3 while ffmpeg is still encoding it, so playback can start
+    right away. Already converted tracks are served from the cache.
+    """
+    metadata = services.convert.get_metadata(url)
+    yt_result = services.convert.match_video(metadata)
+    kind, target, filename = services.stream.open(metadata, yt_result.video_id, yt_result.video_url)
+    if kind == "file":
+        return FileResponse(target, media_type="audio/mpeg", filename=filename)
+    return StreamingResponse(
+        target,
+        media_type="audio/mpeg",
+        headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"}
+    )
+
+@app.post("/v1/convert/batch")
+def convert_batch(request: BatchConvertRequest, req: Request):
+    # Expand before streaming so bad URLs still get a proper HTTP error
+    tracks = services.batch.expand(request.url)
+
+    def encode(event: str, payload: dict) -> str:
+        if request.format == "sse":
+            return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        return json.dumps({"event": event, **payload}) + "\n"
+
+    def stream():
+        yield encode("start", {"total": len(tracks)})
+        completed = failed = 0
+        for index, metadata, outcome in services.batch.run(
+                tracks, audio_format=request.audio_format, quality=request.quality):
+            if isinstance(outcome, Exception):
+                failed += 1
+                error = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+                item = BatchTrackResult(index=index, status="failed", metadata=metadata, error=str(error))
+            else:
+                completed += 1
+                item = BatchTrackResult(index=index, status="completed", metadata=metadata,
+                                        result=to_convert_response(req, outcome))
+            yield encode("track", item.model_dump(exclude_none=True))
+        yield encode("done", {"completed": completed, "failed": failed})
+
+    media_type = "text/event-stream" if request.format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type)
+
+@app.post("/v1/jobs", response_model=JobSubmitResponse, status_code=202)
+def submit_convert_job(request: ConvertRequest, req: Request):
+    job = services.jobs.submit(request.url, audio_format=request.audio_format, quality=request.quality)
+    return JobSubmitResponse(
+        job_id=job.job_id,
+        status=job.status,
+        status_url=str(req.url_for("get_job_status", job_id=job.job_id))
     )
 
+@app.get("/v1/jobs/{job_id}", response_model=JobStatus, response_model_exclude_none=True)
+def get_job_status(job_id: str, req: Request):
+    job = services.jobs.get(job_id)
+    status = job.to_status()
+    if job.result is not None:
+        status.result = to_convert_response(req, job.result)
+    return status
+
+@app.api_route("/downloads/{filename}", methods=["GET", "HEAD"])
+def serve_download(filename: str, req: Request):
+    return services.downloads.response(req, filename)
+
+@app.post("/v1/bundles", response_model=BundleResponse)
+def create_bundle(request: BundleRequest, req: Request):
+    """One ZIP/tar download for many converted files, instead of a request per file."""
+    filenames = list(request.filenames)
+    for job_id in request.job_ids:
+        job = services.jobs.get(job_id)
+        if job.result is None:
+            raise HTTPException(status_code=409, detail=f"Job {job_id} has no file yet ({job.status})")
+        filenames.append(job.result.filename)
+    bundle = services.bundles.create(filenames, request.format, request.name)
+    return BundleResponse(
+        bundle_id=bundle["bundle_id"],
+        format=request.format,
+        files=bundle["files"],
+        size=bundle["size"],
+        download_url=construct_download_url(req, bundle["filename"], prefix="/bundles")
+    )
+
+@app.api_route("/bundles/{filename}", methods=["GET", "HEAD"])
+def serve_bundle(filename: str, req: Request):
+    return services.bundles.response(req, filename)
+
+@app.get("/v1/track-index/export")
+def export_track_index():
+    """Every track -> video mapping as NDJSON, for warming another node through /v1/track-index/import."""
+    return StreamingResponse(
+        services.track_index.export(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=track_index.ndjson"}
+    )
+
+@app.post("/v1/track-index/import", response_model=TrackIndexImportResponse)
+async def import_track_index(req: Request):
+    """Merges an export (NDJSON request body) into the index; later matches win."""
+    index = await services.resolve("track_index")
+    return await index.import_stream(req.stream())
+
+def to_convert_response(req: Request, result) -> ConvertResponse:
     return ConvertResponse(
-        metadata=metadata,
-        youtube_url=yt_result.video_url,
-        download_url=download_url,
-        filename=filename
+        metadata=result.metadata,
+        youtube_url=result.youtube_url,
+        download_url=construct_download_url(req, result.filename),
+        filename=result.filename
     )
 
-def construct_download_url(req: Request, filename: str) -> str:
+def construct_download_url(req: Request, filename: str, prefix: str = "/downloads") -> str:
     scheme = req.url.scheme
     host = req.headers.get("host", "localhost")
     root_path = os.environ.get("ROOT_PATH", "")
@@ -141,4 +320,4 @@ def construct_download_url(req: Request, filename: str) -> str:
     if root_path and root_path.endswith("/"):
         root_path = root_path[:-1]
 
-    return f"{scheme}://{host}{root_path}/downloads/{filename}"
+    return f"{scheme}://{host}{root_path}{prefix}/{filename}"
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Literal
 
 # Spotify Metadata
 class SongMetadata(BaseModel):
@@ -10,6 +10,7 @@ class SongMetadata(BaseModel):
     spotify_url: Optional[str] = None
     tidal_url: Optional[str] = None
     album_art_url: Optional[str] = None
+    isrc: Optional[str] = None
 
 # YouTube Search
 class YouTubeSearchResult(BaseModel):
@@ -17,6 +18,11 @@ class YouTubeSearchResult(BaseModel):
     video_url: str
     title: str
     duration: int
+    confidence: Optional[float] = None  # set when picked by the matching engine
+
+# Output audio: "original" keeps YouTube's stream untouched
+AudioFormatName = Literal["mp3", "m4a", "opus", "original"]
+QualityPreset = Literal["low", "standard", "high"]
 
 # API Request/Response
 class YouTubeSearchRequest(BaseModel):
@@ -24,15 +30,80 @@ class YouTubeSearchRequest(BaseModel):
 
 class YouTubeDownloadRequest(BaseModel):
     video_url: str = Field(..., alias="url")
+    audio_format: AudioFormatName = "mp3"
+    quality: QualityPreset = "standard"
 
 class ConvertRequest(BaseModel):
     url: str
+    audio_format: AudioFormatName = "mp3"
+    quality: QualityPreset = "standard"
 
 class TidalRequest(BaseModel):
     url: str
 
+class TidalBatchRequest(BaseModel):
+    urls: List[str] = Field(..., min_length=1, max_length=500)
+
+class TidalBatchResponse(BaseModel):
+    tracks: List[Optional[SongMetadata]]  # same order as urls; null where unavailable
+
 class ConvertResponse(BaseModel):
     metadata: SongMetadata
     youtube_url: str
     download_url: str  # URL to download the file
     filename: str
+
+# Conversion pipeline result (download_url is built per-request)
+class ConversionResult(BaseModel):
+    metadata: SongMetadata
+    youtube_url: str
+    filename: str
+
+# Background jobs
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str  # queued | running | completed | failed
+    stage: Optional[str] = None  # metadata | search | download | transcode
+    progress: float = 0.0
+    error: Optional[str] = None
+    result: Optional[ConvertResponse] = None
+
+# Album / playlist batches
+class BatchConvertRequest(BaseModel):
+    url: str
+    format: Literal["ndjson", "sse"] = "ndjson"
+    audio_format: AudioFormatName = "mp3"
+    quality: QualityPreset = "standard"
+
+class BatchTrackResult(BaseModel):
+    index: int
+    status: str  # completed | failed
+    metadata: SongMetadata
+    result: Optional[ConvertResponse] = None
+    error: Optional[str] = None
+
+# Archives of converted files
+class BundleRequest(BaseModel):
+    filenames: List[str] = Field(default_factory=list, max_length=1000)
+    job_ids: List[str] = Field(default_factory=list, max_length=1000)  # completed jobs; their files are added
+    format: Literal["zip", "tar"] = "zip"
+    name: str = "bundle"  # archive name offered to the client
+
+class BundleResponse(BaseModel):
+    bundle_id: str
+    format: str
+    files: int
+    size: int  # exact archive size in bytes
+    download_url: str
+
+# Track -> video index snapshots
+class TrackIndexImportResponse(BaseModel):
+    imported: int
+    unchanged: int  # already mapped by an equal or later match
+    invalid: int
+    errors: List[str]  # the first few, with line numbers
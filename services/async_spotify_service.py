@@ -0,0 +1,101 @@
+import os
+import asyncio
+import httpx
+from fastapi import HTTPException
+from models import SongMetadata
+from services.http_client import AsyncHTTPClient, AsyncClientCredentialsToken
+from services.micro_batcher import AsyncMicroBatcher
+from services.rate_limiter import retry_after_seconds
+from services.spotify_service import SPOTIFY_ID_RE, canonical_track_id, track_to_metadata
+
+
+class AsyncSpotifyService:
+    """
+    Event-loop native Spotify track lookup on the shared httpx client.
+    Shares the metadata cache, rate limiter and upstream guard of the
+    blocking SpotifyService, and micro-batches concurrent lookups into
+    GET /tracks?ids= the same way.
+    """
+    def __init__(self, spotify_service, http: AsyncHTTPClient):
+        self.spotify_service = spotify_service
+        self.http = http
+        self.api_url = os.environ.get("SPOTIFY_API_URL", "https://api.spotify.com/v1")
+        client_id = os.environ.get("SPOTIFY_CLIENT_ID")
+        client_secret = os.environ.get("SPOTIFY_CLIENT_SECRET")
+        self.token = None
+        if client_id and client_secret:
+            self.token = AsyncClientCredentialsToken(
+                http, os.environ.get("SPOTIFY_AUTH_URL", "https://accounts.spotify.com/api/token"),
+                client_id, client_secret, source="spotify", guard=spotify_service.guard
+            )
+        self.rate_limiter = spotify_service.rate_limiter
+        self.guard = spotify_service.guard
+        self.batcher = AsyncMicroBatcher(self._fetch_tracks, spotify_service.batch_window, spotify_service.batch_size)
+
+    async def get_metadata(self, spotify_url: str) -> SongMetadata:
+        if not self.token:
+            raise HTTPException(status_code=500, detail="Spotify credentials not configured.")
+
+        key = canonical_track_id(spotify_url)
+        if key is None and SPOTIFY_ID_RE.match(spotify_url):
+            key = f"spotify:track:{spotify_url}"
+        if key is None:
+            raise HTTPException(status_code=400, detail="Invalid Spotify URL or API error: not a track URL")
+
+        track_id = key.rsplit(":", 1)[1]
+        return await self.spotify_service.metadata_cache.get_or_load_async(key, lambda: self._fetch(track_id))
+
+    async def _fetch(self, track_id: str) -> SongMetadata:
+        try:
+            if SPOTIFY_ID_RE.match(track_id):
+                track = await self.batcher.get(track_id)
+            else:
+                track = await self._fetch_one(track_id)
+            if track is None:
+                raise HTTPException(status_code=404, detail="Spotify track not found")
+            return track_to_metadata(track)
+        except HTTPException:
+            raise
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid Spotify URL or API error: {str(e)}")
+
+    async def _fetch_tracks(self, track_ids: list) -> dict:
+        """AsyncMicroBatcher loader: {id: track} for one GET /tracks call; unknown IDs are left out."""
+        resp = await self._get("/tracks", params={"ids": ",".join(track_ids)})
+        if resp.status_code == 400 and len(track_ids) > 1:
+            # Spotify rejects the whole call for one malformed ID: fall back to single lookups
+            tracks = await asyncio.gather(*(self._fetch_one(track_id) for track_id in track_ids))
+            return {track_id: track for track_id, track in zip(track_ids, tracks) if track}
+        resp.raise_for_status()
+        # Results are positional; a relinked track comes back under a different ID
+        return {track_id: track for track_id, track in zip(track_ids, resp.json()["tracks"]) if track}
+
+    async def _fetch_one(self, track_id: str):
+        resp = await self._get(f"/tracks/{track_id}")
+        if resp.status_code in (400, 404):
+            return None
+        resp.raise_for_status()
+        return resp.json()
+
+    async def _get(self, path: str, params: dict = None) -> httpx.Response:
+        """GET under the shared rate limiter and guard; retries once on 401 and waits out 429s (Retry-After)."""
+        refreshed = False
+        for attempt in range(self.spotify_service.MAX_THROTTLED_RETRIES + 1):
+            await self.rate_limiter.acquire_async()
+            token = await self.token.get()
+            async with self.guard.call_async() as call:
+                resp = await self.http.request(
+                    "GET", f"{self.api_url}{path}", params=params,
+                    headers={"Authorization": f"Bearer {token}"}, timeout=self.spotify_service.timeout
+                )
+                call.status = resp.status_code
+            if resp.status_code == 401 and not refreshed:
+                self.token.invalidate()
+                refreshed = True
+                continue
+            if resp.status_code != 429:
+                return resp
+            if attempt < self.spotify_service.MAX_THROTTLED_RETRIES:
+                self.rate_limiter.pause(retry_after_seconds(resp.headers))
+        raise HTTPException(status_code=503, detail="Spotify rate limit reached, retry later",
+                            headers={"Retry-After": str(int(retry_after_seconds(resp.headers)) + 1)})
@@ -0,0 +1,90 @@
+import asyncio
+import anyio
+import httpx
+from fastapi import HTTPException
+from models import SongMetadata
+from services.http_client import AsyncHTTPClient
+from services.rate_limiter import retry_after_seconds
+from services.tidal_service import RETRY_STATUSES, TRACK_INCLUDE, index_included
+
+
+class AsyncTidalService:
+    """
+    Event-loop native Tidal track lookup on the shared httpx client.
+    Configuration, URL parsing, the access token, payload parsing, the
+    metadata cache and the upstream guard come from the blocking
+    TidalService; 429s, 5xx and network errors are retried with the same
+    budget (TIDAL_MAX_RETRIES) and backoff as its pooled session.
+    """
+    # Seconds before the first retry; doubles per attempt unless the answer carries Retry-After
+    BACKOFF = 0.5
+
+    def __init__(self, tidal_service, http: AsyncHTTPClient):
+        self.tidal_service = tidal_service
+        self.http = http
+
+    async def get_metadata(self, url: str) -> SongMetadata:
+        if not (self.tidal_service.client_id and self.tidal_service.client_secret):
+            raise HTTPException(status_code=500, detail="TIDAL_CLIENT_ID and TIDAL_CLIENT_SECRET must be set")
+
+        key, track_id = self.tidal_service.parse_track_url(url)
+        return await self.tidal_service.metadata_cache.get_or_load_async(key, lambda: self._fetch(track_id, url))
+
+    async def _token(self) -> str:
+        # One token per process: refreshes (rare, and single-flight) go through TidalService in a thread
+        token = self.tidal_service.current_token()
+        if token is None:
+            token = await anyio.to_thread.run_sync(self.tidal_service._get_token)
+        return token
+
+    async def _fetch(self, track_id: str, url: str) -> SongMetadata:
+        token = await self._token()
+        try:
+            resp = await self._get(f"{self.tidal_service.base_url}/tracks/{track_id}", token,
+                                   params={"countryCode": "US", "include": TRACK_INCLUDE})
+            if resp.status_code == 404:
+                raise HTTPException(status_code=404, detail="Tidal track not found")
+            resp.raise_for_status()
+
+            payload = resp.json()
+            if "data" not in payload:
+                raise ValueError("Invalid API response format")
+            return self.tidal_service._parse_track(payload["data"], index_included(payload.get("included", [])), url)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Tidal API Error: {str(e)}")
+
+    async def _get(self, url: str, token: str, params: dict = None) -> httpx.Response:
+        """GET under the shared guard; refreshes the token once on 401, retries 429/5xx and network errors."""
+        refreshed = False
+        attempt = 0
+        while True:
+            try:
+                async with self.tidal_service.guard.call_async() as call:
+                    resp = await self.http.request(
+                        "GET", url, params=params,
+                        headers={"Authorization": f"Bearer {token}", "Accept": "application/vnd.api+json"},
+                        timeout=self.tidal_service.timeout
+                    )
+                    call.status = resp.status_code
+            except httpx.TransportError:
+                if attempt >= self.tidal_service.max_retries:
+                    raise
+                resp = None
+
+            if resp is not None and resp.status_code == 401 and not refreshed:
+                # Revoked or rotated early: drop it and fetch a fresh one
+                self.tidal_service.token = None
+                token = await self._token()
+                refreshed = True
+                continue
+            if resp is not None and (resp.status_code not in RETRY_STATUSES
+                                     or attempt >= self.tidal_service.max_retries):
+                return resp
+
+            delay = self.BACKOFF * 2 ** attempt
+            if resp is not None and "retry-after" in resp.headers:
+                delay = retry_after_seconds(resp.headers)
+            attempt += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,86 @@
+from typing import List, Optional, Tuple
+from fastapi import HTTPException
+
+QUALITY_PRESETS = ("low", "standard", "high")
+DEFAULT_FORMAT = "mp3"
+DEFAULT_PRESET = "standard"
+
+
+class AudioFormat:
+    """
+    An output format clients can ask for.
+
+    copy_codecs lists source codecs (yt-dlp 'acodec' prefixes) that can be
+    remuxed into this container as-is; anything else is encoded with
+    `encoder` at the preset bitrate. format_selector nudges yt-dlp towards
+    a source stream that can be copied. tag_muxer_args are muxer options
+    for tags; embeds_cover says whether the container takes an attached
+    picture stream.
+    """
+    def __init__(self, name: str, ext: Optional[str], encoder: Optional[str], bitrates: dict,
+                 copy_codecs: Tuple[str, ...], format_selector: str, tag_muxer_args: Tuple[str, ...] = (),
+                 embeds_cover: bool = False):
+        self.name = name
+        self.ext = ext
+        self.encoder = encoder
+        self.bitrates = bitrates
+        self.copy_codecs = copy_codecs
+        self.format_selector = format_selector
+        self.tag_muxer_args = tag_muxer_args
+        self.embeds_cover = embeds_cover
+
+    def bitrate(self, preset: str) -> str:
+        """Bitrate part of the cache key; 'source' when the stream is kept untouched."""
+        return self.bitrates.get(preset, "source")
+
+    def can_copy(self, source_codec: Optional[str]) -> bool:
+        codec = (source_codec or "").lower()
+        return any(codec.startswith(c) for c in self.copy_codecs)
+
+    def ffmpeg_args(self, preset: str, source_codec: Optional[str]) -> Tuple[str, List[str]]:
+        """("copy" | "encode", ffmpeg output args) for a given source codec."""
+        if self.can_copy(source_codec):
+            return "copy", ["-vn", "-codec:a", "copy"]
+        return "encode", ["-vn", "-codec:a", self.encoder, "-b:a", f"{self.bitrates[preset]}k"]
+
+    def tag_args(self, codec_args: List[str], tags: dict, cover_path: Optional[str] = None) -> List[str]:
+        """
+        codec_args extended to write `tags` (title, artist, ...) and, where
+        the container supports it, cover_path as the front cover, in the
+        same ffmpeg run.
+        """
+        # Drop the source's own tags (YouTube title, encoder) rather than mix them in
+        args = ["-map_metadata", "-1", *self.tag_muxer_args]
+        for field, value in tags.items():
+            if value:
+                args += ["-metadata", f"{field}={value}"]
+        if not (cover_path and self.embeds_cover):
+            return [*codec_args, *args]
+        # Second input: audio from the source, the picture as-is from the cover
+        return ["-i", cover_path, "-map", "0:a:0", "-map", "1:v:0",
+                *(arg for arg in codec_args if arg != "-vn"),
+                "-codec:v", "copy", "-disposition:v:0", "attached_pic",
+                "-metadata:s:v", "title=Album cover", "-metadata:s:v", "comment=Cover (front)", *args]
+
+
+FORMATS = {
+    # ID3v2.3: what most players and car stereos read
+    "mp3": AudioFormat("mp3", "mp3", "libmp3lame", {"low": "128", "standard": "192", "high": "320"},
+                       ("mp3",), "bestaudio/best", ("-id3v2_version", "3"), embeds_cover=True),
+    "m4a": AudioFormat("m4a", "m4a", "aac", {"low": "96", "standard": "160", "high": "256"},
+                       ("mp4a", "aac"), "bestaudio[ext=m4a]/bestaudio/best", embeds_cover=True),
+    # Ogg has no picture stream in ffmpeg's muxer: text tags only
+    "opus": AudioFormat("opus", "opus", "libopus", {"low": "64", "standard": "128", "high": "192"},
+                        ("opus",), "bestaudio[acodec=opus]/bestaudio/best"),
+    # Whatever YouTube serves, no ffmpeg at all
+    "original": AudioFormat("original", None, None, {}, (), "bestaudio/best"),
+}
+
+
+def get_format(name: str, preset: str) -> AudioFormat:
+    fmt = FORMATS.get((name or DEFAULT_FORMAT).lower())
+    if fmt is None:
+        raise HTTPException(status_code=400, detail=f"Unsupported audio format '{name}', use one of {sorted(FORMATS)}")
+    if preset not in QUALITY_PRESETS:
+        raise HTTPException(status_code=400, detail=f"Unsupported quality '{preset}', use one of {list(QUALITY_PRESETS)}")
+    return fmt
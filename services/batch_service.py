@@ -0,0 +1,80 @@
+import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, List, Tuple
+from fastapi import HTTPException
+from models import SongMetadata
+from services.audio_formats import DEFAULT_FORMAT, DEFAULT_PRESET
+from services.transcode_scheduler import PRIORITY_BATCH
+
+
+class StageLimiter:
+    """
+    One semaphore per pipeline stage, shared by every batch in the process,
+    so a playlist can keep searches, downloads and ffmpeg busy at the same
+    time without any stage exceeding its own limit.
+    """
+    def __init__(self, limits: dict):
+        self.limits = dict(limits)
+        self._semaphores = {stage: threading.BoundedSemaphore(n) for stage, n in limits.items()}
+
+    def gate(self, stage: str):
+        return self._semaphores[stage]
+
+    @property
+    def total(self) -> int:
+        return sum(self.limits.values())
+
+
+class BatchService:
+    """
+    Converts every track of an album or playlist through the
+    search -> download -> transcode pipeline and yields each result as soon
+    as that track is finished (completion order, not playlist order).
+    """
+    def __init__(self, convert_service, transcode_scheduler=None, search_concurrency: int = None,
+                 download_concurrency: int = None, transcode_concurrency: int = None, max_tracks: int = None):
+        self.convert_service = convert_service
+        # ffmpeg for batches queues behind interactive and job work
+        self.transcoder = transcode_scheduler.transcoder(PRIORITY_BATCH) if transcode_scheduler else None
+        self.max_tracks = max_tracks if max_tracks is not None else int(os.environ.get("BATCH_MAX_TRACKS", "500"))
+        self.limiter = StageLimiter({
+            "search": search_concurrency or int(os.environ.get("BATCH_SEARCH_CONCURRENCY", "8")),
+            "download": download_concurrency or int(os.environ.get("BATCH_DOWNLOAD_CONCURRENCY", "4")),
+            "transcode": transcode_concurrency or int(
+                os.environ.get("BATCH_TRANSCODE_CONCURRENCY", str(os.cpu_count() or 1))),
+        })
+
+    def expand(self, url: str) -> List[SongMetadata]:
+        tracks = self.convert_service.get_tracks(url)
+        if len(tracks) > self.max_tracks:
+            raise HTTPException(status_code=413, detail=f"Batch has {len(tracks)} tracks, limit is {self.max_tracks}")
+        return tracks
+
+    def run(self, tracks: List[SongMetadata], audio_format: str = DEFAULT_FORMAT,
+            quality: str = DEFAULT_PRESET) -> Iterator[Tuple[int, SongMetadata, object]]:
+        """
+        Yields (index, metadata, ConversionResult | Exception) per track.
+        Closing the generator early cancels tracks that have not started.
+        """
+        # Enough threads that every stage can be saturated at once; the
+        # stage semaphores do the actual limiting.
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.limiter.total, len(tracks))),
+                                      thread_name_prefix="batch")
+        try:
+            # copy_context: per-track stage spans stay children of the request's trace
+            futures = {
+                executor.submit(contextvars.copy_context().run, self.convert_service.convert_metadata, metadata,
+                                transcoder=self.transcoder, stage_gate=self.limiter.gate,
+                                audio_format=audio_format, quality=quality): (i, metadata)
+                for i, metadata in enumerate(tracks)
+            }
+            for future in as_completed(futures):
+                i, metadata = futures[future]
+                try:
+                    yield i, metadata, future.result()
+                except Exception as e:
+                    yield i, metadata, e
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
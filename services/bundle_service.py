@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import struct
+import bisect
+import hashlib
+import tarfile
+from email.utils import formatdate
+from typing import List, Optional
+from urllib.parse import quote
+import anyio
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from services.download_service import DownloadService
+from services.shared_state import get_shared_state
+
+FORMATS = {"zip": "application/zip", "tar": "application/x-tar"}
+
+# Sizes, offsets and counts from these up live in ZIP64 records; the classic field holds a marker
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_ENTRY_LIMIT = 0xFFFF
+ZIP_UTF8_FLAG = 0x0800
+# Version "made by": Unix, spec 4.5 (ZIP64)
+ZIP_MADE_BY = (3 << 8) | 45
+
+
+class Member:
+    """One file of a bundle: where it is and what the index knows about it."""
+    __slots__ = ("arcname", "key", "path", "size", "mtime", "etag", "crc32")
+
+    def __init__(self, arcname: str, key: str, path: str, size: int, mtime: float, etag: str,
+                 crc32: Optional[int]):
+        self.arcname = arcname
+        self.key = key
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.etag = etag
+        self.crc32 = crc32
+
+
+class ArchiveLayout:
+    """
+    An archive as a sequence of parts: header bytes built up front and
+    spans of member files read at send time. The total size, and where any
+    byte offset falls, are known before anything is read.
+    """
+    def __init__(self):
+        self.parts = []
+        self.starts = []
+        self.size = 0
+
+    def add_bytes(self, data: bytes):
+        if data:
+            self.starts.append(self.size)
+            self.parts.append((data, len(data)))
+            self.size += len(data)
+
+    def add_file(self, path: str, size: int):
+        if size:
+            self.starts.append(self.size)
+            self.parts.append((path, size))
+            self.size += size
+
+    def spans(self, offset: int, length: int):
+        """(bytes or path, start within the part, count) covering [offset, offset + length)."""
+        index = bisect.bisect_right(self.starts, offset) - 1
+        end = offset + length
+        while offset < end and index < len(self.parts):
+            payload, size = self.parts[index]
+            start = offset - self.starts[index]
+            count = min(size - start, end - offset)
+            yield payload, start, count
+            offset += count
+            index += 1
+
+
+def dos_datetime(timestamp: float) -> tuple:
+    # UTC, so every worker lays out identical bytes
+    t = time.gmtime(max(timestamp, 315532800))
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def zip_layout(members: List[Member]) -> ArchiveLayout:
+    """Store-mode (uncompressed) ZIP, with ZIP64 records only where sizes or offsets need them."""
+    layout = ArchiveLayout()
+    central = []
+    for member in members:
+        name = member.arcname.encode("utf-8")
+        offset = layout.size
+        dos_time, dos_date = dos_datetime(member.mtime)
+        large = member.size >= ZIP64_LIMIT
+        size_field = 0xFFFFFFFF if large else member.size
+
+        extra = struct.pack("<HHQQ", 1, 16, member.size, member.size) if large else b""
+        layout.add_bytes(struct.pack(
+            "<IHHHHHIIIHH", 0x04034b50, 45 if large else 20, ZIP_UTF8_FLAG, 0, dos_time, dos_date,
+            member.crc32, size_field, size_field, len(name), len(extra)
+        ) + name + extra)
+        layout.add_file(member.path, member.size)
+
+        fields = [member.size, member.size] if large else []
+        if offset >= ZIP64_LIMIT:
+            fields.append(offset)
+        extra = struct.pack(f"<HH{len(fields)}Q", 1, 8 * len(fields), *fields) if fields else b""
+        central.append(struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014b50, ZIP_MADE_BY, 45 if fields else 20, ZIP_UTF8_FLAG, 0,
+            dos_time, dos_date, member.crc32, size_field, size_field, len(name), len(extra), 0, 0, 0,
+            0o100644 << 16, 0xFFFFFFFF if offset >= ZIP64_LIMIT else offset
+        ) + name + extra)
+
+    directory = b"".join(central)
+    cd_offset, cd_size, count = layout.size, len(directory), len(members)
+    layout.add_bytes(directory)
+    if count >= ZIP_ENTRY_LIMIT or cd_size >= ZIP64_LIMIT or cd_offset >= ZIP64_LIMIT:
+        record_offset = layout.size
+        layout.add_bytes(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, ZIP_MADE_BY, 45, 0, 0,
+                                     count, count, cd_size, cd_offset))
+        layout.add_bytes(struct.pack("<IIQI", 0x07064b50, 0, record_offset, 1))
+        count, cd_size, cd_offset = 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF
+    layout.add_bytes(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0))
+    return layout
+
+
+def tar_layout(members: List[Member]) -> ArchiveLayout:
+    """POSIX tar; a PAX header is added only for names ustar cannot hold."""
+    layout = ArchiveLayout()
+    for member in members:
+        info = tarfile.TarInfo(member.arcname)
+        info.size = member.size
+        info.mtime = int(member.mtime)
+        info.mode = 0o644
+        layout.add_bytes(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+        layout.add_file(member.path, member.size)
+        layout.add_bytes(b"\0" * (-member.size % tarfile.BLOCKSIZE))
+    layout.add_bytes(b"\0" * (2 * tarfile.BLOCKSIZE))
+    return layout
+
+
+class ArchiveResponse(Response):
+    """Sends `length` bytes of an ArchiveLayout starting at `offset`, reading member files in chunks."""
+    def __init__(self, layout: ArchiveLayout, offset: int, length: int, status_code: int, headers: dict,
+                 media_type: str, chunk_size: int, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.layout = layout
+        self.offset = offset
+        self.length = length
+        self.chunk_size = chunk_size
+        self.send_body = send_body
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        remaining = self.length
+        for payload, start, count in self.layout.spans(self.offset, self.length):
+            if isinstance(payload, bytes):
+                remaining -= count
+                await send({"type": "http.response.body", "body": payload[start:start + count],
+                            "more_body": remaining > 0})
+                continue
+            fd = os.open(payload, os.O_RDONLY)
+            try:
+                position, end = start, start + count
+                while position < end:
+                    chunk = await anyio.to_thread.run_sync(
+                        os.pread, fd, min(self.chunk_size, end - position), position)
+                    if not chunk:
+                        # Member shrank under us; end the response rather than hang
+                        await send({"type": "http.response.body", "body": b""})
+                        return
+                    position += len(chunk)
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            finally:
+                os.close(fd)
+
+
+class BundleService:
+    """
+    ZIP or tar archives of converted files, streamed straight from the
+    blob store: nothing is compressed (the audio already is) or staged,
+    and memory use does not grow with the size of the files.
+
+    Sizes and CRC-32s come from the DownloadCache index, so the whole
+    archive layout, and with it Content-Length and any byte range, is
+    known before a byte is read. That lets interrupted bundle downloads
+    resume with Range / If-Range like single files.
+
+    create() stores the member list in the SharedState for BUNDLE_TTL
+    seconds, so any worker can serve the bundle.
+    """
+    def __init__(self, cache, state=None):
+        self.cache = cache
+        self.state = state if state is not None else get_shared_state()
+        self.ttl = int(os.environ.get("BUNDLE_TTL", "86400"))
+        self.max_files = int(os.environ.get("BUNDLE_MAX_FILES", "1000"))
+        self.chunk_size = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+    def create(self, filenames: List[str], archive_format: str = "zip", name: str = "bundle") -> dict:
+        """Registers a bundle and returns its id, archive filename, member count and size."""
+        if archive_format not in FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported bundle format: {archive_format}")
+        filenames = list(dict.fromkeys(filenames))
+        if not filenames:
+            raise HTTPException(status_code=400, detail="No files to bundle")
+        if len(filenames) > self.max_files:
+            raise HTTPException(status_code=400, detail=f"At most {self.max_files} files per bundle")
+        name = "".join(c for c in name if c.isalnum() or c in " .-_()").strip() or "bundle"
+
+        members = self._members(filenames, missing_status=404)
+        layout = self._layout(members, archive_format)
+        manifest = json.dumps({"format": archive_format, "name": name, "files": filenames})
+        bundle_id = hashlib.sha256(manifest.encode()).hexdigest()[:32]
+        self.state.set(f"bundle:{bundle_id}", manifest, ttl=self.ttl)
+        return {"bundle_id": bundle_id, "filename": f"{bundle_id}.{archive_format}",
+                "files": len(members), "size": layout.size}
+
+    def response(self, request: Request, filename: str) -> Response:
+        bundle_id, _, archive_format = filename.partition(".")
+        payload = self.state.get(f"bundle:{bundle_id}")
+        if payload is None:
+            raise HTTPException(status_code=404, detail="Bundle not found or expired")
+        manifest = json.loads(payload)
+        if archive_format != manifest["format"]:
+            raise HTTPException(status_code=404, detail="Bundle not found or expired")
+
+        # A member evicted since create() would change the layout under a resuming client
+        members = self._members(manifest["files"], missing_status=410)
+        layout = self._layout(members, archive_format)
+        digest = hashlib.sha256(archive_format.encode())
+        for member in members:
+            digest.update(f"\0{member.arcname}\0{member.etag}".encode())
+        blob = {"etag": f'"{digest.hexdigest()[:32]}"', "mtime": max(m.mtime for m in members), "size": layout.size}
+
+        headers = {
+            "etag": blob["etag"],
+            "last-modified": formatdate(blob["mtime"], usegmt=True),
+            "accept-ranges": "bytes",
+            "cache-control": "no-cache",
+            "content-disposition": f"attachment; filename*=utf-8''{quote(manifest['name'])}.{archive_format}",
+        }
+        if DownloadService._not_modified(request, blob):
+            return Response(status_code=304, headers=headers)
+
+        byte_range = DownloadService._byte_range(request, blob)
+        if byte_range == "unsatisfiable":
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{layout.size}"})
+        offset, length, status = 0, layout.size, 200
+        if byte_range is not None:
+            offset, end = byte_range
+            length, status = end - offset + 1, 206
+            headers["content-range"] = f"bytes {offset}-{end}/{layout.size}"
+        return ArchiveResponse(layout, offset, length, status, headers, FORMATS[archive_format],
+                               self.chunk_size, send_body=request.method != "HEAD")
+
+    def _members(self, filenames: List[str], missing_status: int) -> List[Member]:
+        members, missing = [], []
+        for filename in filenames:
+            blob = self.cache.describe(filename)
+            if blob is None:
+                missing.append(filename)
+                continue
+            members.append(Member(filename, blob["key"], blob["path"], blob["size"], blob["mtime"], blob["etag"],
+                                  blob["crc32"]))
+        if missing:
+            raise HTTPException(status_code=missing_status, detail=f"Not available: {', '.join(missing[:10])}")
+        return members
+
+    def _layout(self, members: List[Member], archive_format: str) -> ArchiveLayout:
+        if archive_format == "tar":
+            return tar_layout(members)
+        for member in members:
+            if member.crc32 is None:
+                member.crc32 = self.cache.backfill_crc32(member.key, member.path)
+        return zip_layout(members)
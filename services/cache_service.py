@@ -0,0 +1,460 @@
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import uuid
+from typing import Optional
+from services.shared_state import get_shared_state
+
+HASH_CHUNK = 1024 * 1024
+# Leftovers of the pre-staging layout in output_dir: yt-dlp sources (<video id>.<ext>),
+# partial downloads, transcode outputs and half-made alias links
+LEGACY_TEMP_RE = re.compile(r"^(?:[A-Za-z0-9_-]{11}\.[\w.]+|.+\.(?:part|ytdl|link))$")
+
+
+def file_checksums(path: str) -> tuple:
+    """(ETag, CRC-32) in one read: a strong ETag from the SHA-256 (first 128 bits are plenty) and the ZIP checksum."""
+    digest = hashlib.sha256()
+    crc = 0
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+    return f'"{digest.hexdigest()[:32]}"', crc
+
+
+class DownloadCache:
+    """
+    Content-addressed store for finished audio files.
+
+    Blobs are keyed by (video_id, codec, bitrate) and live under
+    <output_dir>/.blobs. Human-readable filenames in output_dir are hardlinks
+    (or symlinks when hardlinking is not possible) to a blob, so the same video
+    reached through different metadata spellings is stored once.
+
+    The SQLite index records the size, mtime, content hash (ETag) and CRC-32
+    of every blob when it is written, so opening the cache, computing its
+    footprint, serving downloads and laying out ZIP bundles never stat or
+    hash the files again.
+    When the total exceeds max_bytes the least recently used blobs (or least
+    frequently used, with policy="lfu") are evicted together with their aliases.
+
+    Work in progress lives in <output_dir>/.staging (same filesystem, so
+    publishing is a rename). The index keeps a journal of partial downloads
+    there and how many bytes each has, so a retry after a crash resumes
+    where it stopped; sweep() clears what no retry will pick up.
+
+    The SQLite index already covers every worker on the host. With a
+    cluster-wide SharedState (Redis), blobs and aliases are also published
+    there, and a replica that misses locally adopts entries whose files it
+    can reach (a shared volume mounted at the same path).
+    """
+    def __init__(self, output_dir: str, index_path: str = None, max_bytes: int = None, policy: str = None,
+                 state=None):
+        self.output_dir = output_dir
+        self.blob_dir = os.path.join(output_dir, ".blobs")
+        self.staging_dir = os.path.join(output_dir, ".staging")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+        # The index lives outside output_dir so it is never served as a download
+        index_path = index_path or os.environ.get("CACHE_INDEX_PATH", "/app/cache/index.db")
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.environ.get("CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+        self.policy = (policy or os.environ.get("CACHE_EVICTION_POLICY", "lru")).lower()
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                key TEXT PRIMARY KEY,
+                video_id TEXT NOT NULL,
+                codec TEXT NOT NULL,
+                bitrate TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS aliases (
+                filename TEXT PRIMARY KEY,
+                key TEXT NOT NULL REFERENCES blobs(key)
+            );
+            CREATE INDEX IF NOT EXISTS aliases_by_key ON aliases(key);
+            CREATE INDEX IF NOT EXISTS blobs_by_access ON blobs(last_access);
+            CREATE TABLE IF NOT EXISTS staging (
+                path TEXT PRIMARY KEY,
+                video_id TEXT NOT NULL,
+                downloaded INTEGER NOT NULL,
+                total INTEGER,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS staging_by_video ON staging(video_id);
+        """)
+        # Indexes written before downloads were served from it; filled in lazily by describe()
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(blobs)")}
+        for column, decl in (("mtime", "REAL"), ("etag", "TEXT"), ("crc32", "INTEGER")):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE blobs ADD COLUMN {column} {decl}")
+
+        state = state if state is not None else get_shared_state()
+        self._cluster = state if state.scope == "cluster" else None
+
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.bytes_written = 0
+        self.bytes_evicted = 0
+
+    @staticmethod
+    def make_key(video_id: str, codec: str, bitrate: str) -> str:
+        return f"{video_id}-{codec}-{bitrate}"
+
+    def lookup(self, video_id: str, codec: str, bitrate: str) -> Optional[str]:
+        """Returns the cache key if the blob is stored, counting a hit or a miss."""
+        key = self.make_key(video_id, codec, bitrate)
+        with self._lock:
+            row = self._db.execute("SELECT size, path FROM blobs WHERE key = ?", (key,)).fetchone()
+        if self._cluster is not None:
+            if row is not None and not os.path.exists(row[1]):
+                # Evicted by another replica sharing the volume
+                self._forget(key)
+                row = None
+            if row is None:
+                row = self._adopt(key)
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.hit_bytes += row[0]
+            self._db.execute("UPDATE blobs SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        return key
+
+    def _adopt(self, key: str):
+        """Indexes a blob another replica published, if its file is reachable from here."""
+        payload = self._cluster.get(f"blob:{key}")
+        if payload is None:
+            return None
+        entry = json.loads(payload)
+        if not os.path.exists(entry["path"]):
+            return None
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO blobs "
+                "(key, video_id, codec, bitrate, path, size, created_at, last_access, hits, mtime, etag, crc32) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?)",
+                (key, entry["video_id"], entry["codec"], entry["bitrate"], entry["path"], entry["size"],
+                 now, now, entry["mtime"], entry["etag"], entry.get("crc32"))
+            )
+        return entry["size"], entry["path"]
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM aliases WHERE key = ?", (key,))
+            self._db.execute("DELETE FROM blobs WHERE key = ?", (key,))
+
+    def peek(self, video_id: str, codec: str, bitrate: str) -> bool:
+        """Like lookup() but without touching counters or access times."""
+        key = self.make_key(video_id, codec, bitrate)
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM blobs WHERE key = ?", (key,)).fetchone() is not None
+
+    def path_for(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT path FROM blobs WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def staging_path(self, name: str) -> str:
+        """Scratch path on the blob filesystem, so put() can publish it with a rename."""
+        return os.path.join(self.staging_dir, f"{name}.{uuid.uuid4().hex}.tmp")
+
+    def journal(self, path: str, video_id: str, downloaded: int, total: Optional[int]):
+        """Records how far the staged download for `path` has got."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO staging (path, video_id, downloaded, total, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (path, video_id, downloaded, total, time.time())
+            )
+
+    def resumable_bytes(self, video_id: str, staging: str = None) -> int:
+        """
+        Bytes already on disk for a journaled download of this video, 0 if
+        none; with `staging`, only for the download staged under that name.
+        """
+        with self._lock:
+            paths = [row[0] for row in self._db.execute("SELECT path FROM staging WHERE video_id = ?", (video_id,))]
+        staged = 0
+        for path in paths:
+            if staging is not None and f".{staging}." not in os.path.basename(path):
+                continue
+            for candidate in (f"{path}.part", path):
+                try:
+                    staged = max(staged, os.path.getsize(candidate))
+                except OSError:
+                    pass
+        return staged
+
+    def unjournal(self, path: str):
+        with self._lock:
+            self._db.execute("DELETE FROM staging WHERE path = ?", (path,))
+
+    def sweep(self, resume_ttl: float = None, grace: float = None) -> dict:
+        """
+        Startup cleanup, leaving the cache and anything still resumable alone.
+
+        Removes staged files with no journal entry, or whose entry has not
+        moved for resume_ttl seconds; blob files the index does not know
+        (a crash between rename and insert); and legacy temp files in
+        output_dir. Files modified in the last `grace` seconds are skipped,
+        since another worker may be writing them right now.
+        """
+        resume_ttl = resume_ttl if resume_ttl is not None else float(os.environ.get("DOWNLOAD_RESUME_TTL", "86400"))
+        grace = grace if grace is not None else float(os.environ.get("DOWNLOAD_STAGING_GRACE", "600"))
+        now = time.time()
+        with self._lock:
+            journal = dict(self._db.execute("SELECT path, updated_at FROM staging").fetchall())
+            blob_paths = {row[0] for row in self._db.execute("SELECT path FROM blobs")}
+            aliases = {row[0] for row in self._db.execute("SELECT filename FROM aliases")}
+
+        result = {"removed_files": 0, "removed_bytes": 0, "resumable": 0}
+        live = set()
+
+        def remove(path: str, size: int):
+            self._unlink(path)
+            result["removed_files"] += 1
+            result["removed_bytes"] += size
+
+        def scan(directory: str, is_orphan):
+            # Judged by name and journal first: only the suspects are stat'ed
+            for entry in os.scandir(directory):
+                if not entry.is_file(follow_symlinks=False) and not entry.is_symlink():
+                    continue
+                if not is_orphan(entry):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                if now - st.st_mtime < grace:
+                    continue
+                remove(entry.path, st.st_size)
+
+        def staged_orphan(entry) -> bool:
+            # yt-dlp keeps in-progress data in <final path>.part (or .ytdl for fragments)
+            path = re.sub(r"\.(part|ytdl)$", "", entry.path)
+            updated_at = journal.get(path)
+            if updated_at is not None and now - updated_at < resume_ttl:
+                live.add(path)
+                return False
+            return True
+
+        scan(self.staging_dir, staged_orphan)
+        scan(self.blob_dir, lambda entry: entry.path not in blob_paths)
+        scan(self.output_dir, lambda entry: entry.name not in aliases and LEGACY_TEMP_RE.match(entry.name) is not None)
+
+        with self._lock:
+            for path in journal:
+                if path not in live:
+                    self._db.execute("DELETE FROM staging WHERE path = ?", (path,))
+        result["resumable"] = len(live)
+        if result["removed_files"] or result["resumable"]:
+            print(f"Download staging sweep: removed {result['removed_files']} orphaned files "
+                  f"({result['removed_bytes']} bytes), {result['resumable']} downloads resumable")
+        return result
+
+    def touch_alias(self, filename: str) -> bool:
+        """Records a hit if filename is a known alias (here, or published by another replica)."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT b.key, b.size FROM aliases a JOIN blobs b ON a.key = b.key WHERE a.filename = ?",
+                (filename,)
+            ).fetchone()
+        if row is None and self._cluster is not None:
+            key = self._cluster.get(f"alias:{filename}")
+            if key is not None and self._adopt(key) is not None:
+                self.alias(key, filename)
+                return self.touch_alias(filename)
+        with self._lock:
+            if row is None:
+                return False
+            self.hits += 1
+            self.hit_bytes += row[1]
+            self._db.execute("UPDATE blobs SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), row[0]))
+        return True
+
+    def put(self, video_id: str, codec: str, bitrate: str, src_path: str, ext: str = None) -> str:
+        """Moves a finished file into the blob store and returns its key."""
+        key = self.make_key(video_id, codec, bitrate)
+        ext = ext or os.path.splitext(src_path)[1].lstrip(".") or codec
+        blob_path = os.path.join(self.blob_dir, f"{key}.{ext}")
+        # Hashed while the freshly written file is still in the page cache
+        etag, crc = file_checksums(src_path)
+        # Durable before it becomes visible, so a crash can't leave a truncated blob behind a valid name
+        fd = os.open(src_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(src_path, blob_path)
+        st = os.stat(blob_path)
+        size = st.st_size
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO blobs "
+                "(key, video_id, codec, bitrate, path, size, created_at, last_access, hits, mtime, etag, crc32) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?)",
+                (key, video_id, codec, bitrate, blob_path, size, now, now, st.st_mtime, etag, crc)
+            )
+            self.bytes_written += size
+        if self._cluster is not None:
+            self._cluster.set(f"blob:{key}", json.dumps({
+                "video_id": video_id, "codec": codec, "bitrate": bitrate, "path": blob_path,
+                "size": size, "mtime": st.st_mtime, "etag": etag, "crc32": crc
+            }))
+        self._evict(keep=key)
+        return key
+
+    def describe(self, filename: str) -> Optional[dict]:
+        """
+        What /downloads/<filename> should serve: path, size, mtime and etag of
+        the blob behind an alias, or of a blob requested by its own
+        (content-addressed, hence 'immutable') name. None if not indexed.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT b.key, b.path, b.size, b.mtime, b.etag, b.crc32 FROM aliases a JOIN blobs b ON a.key = b.key "
+                "WHERE a.filename = ?", (filename,)
+            ).fetchone()
+            immutable = False
+            if row is None:
+                row = self._db.execute(
+                    "SELECT key, path, size, mtime, etag, crc32 FROM blobs WHERE path = ?",
+                    (os.path.join(self.blob_dir, filename),)
+                ).fetchone()
+                immutable = row is not None
+        if row is None:
+            return None
+
+        key, path, size, mtime, etag, crc = row
+        if etag is None or mtime is None:
+            try:
+                (etag, crc), mtime = file_checksums(path), os.stat(path).st_mtime
+            except FileNotFoundError:
+                return None
+            with self._lock:
+                self._db.execute("UPDATE blobs SET mtime = ?, etag = ?, crc32 = ? WHERE key = ?",
+                                 (mtime, etag, crc, key))
+        return {"key": key, "path": path, "size": size, "mtime": mtime, "etag": etag, "crc32": crc,
+                "immutable": immutable}
+
+    def backfill_crc32(self, key: str, path: str) -> int:
+        """Computes and records the CRC-32 of a blob indexed before it was recorded."""
+        crc = file_checksums(path)[1]
+        with self._lock:
+            self._db.execute("UPDATE blobs SET crc32 = ? WHERE key = ?", (crc, key))
+        return crc
+
+    def alias(self, key: str, filename: str) -> str:
+        """Exposes a stored blob under a human filename in output_dir."""
+        with self._lock:
+            row = self._db.execute("SELECT path FROM blobs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+
+        link_path = os.path.join(self.output_dir, filename)
+        tmp_path = f"{link_path}.{threading.get_ident()}.link"
+        try:
+            os.link(row[0], tmp_path)
+        except OSError:
+            # Different filesystem or no hardlink support
+            os.symlink(row[0], tmp_path)
+        os.replace(tmp_path, link_path)
+
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO aliases (filename, key) VALUES (?, ?)", (filename, key))
+        if self._cluster is not None:
+            self._cluster.set(f"alias:{filename}", key)
+        return filename
+
+    def _evict(self, keep: str = None):
+        # Every worker on the host writes to this index, so the budget is
+        # checked against the index itself, inside one write transaction
+        # (BEGIN IMMEDIATE: evictions in other processes wait for it)
+        order = "hits ASC, last_access ASC" if self.policy == "lfu" else "last_access ASC"
+        evicted = []
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                total = self._total_bytes()
+                if total > self.max_bytes:
+                    victims = self._db.execute(f"SELECT key, path, size FROM blobs ORDER BY {order}").fetchall()
+                    for key, path, size in victims:
+                        if total <= self.max_bytes:
+                            break
+                        if key == keep:
+                            continue
+                        aliases = [row[0] for row in
+                                   self._db.execute("SELECT filename FROM aliases WHERE key = ?", (key,))]
+                        self._db.execute("DELETE FROM aliases WHERE key = ?", (key,))
+                        self._db.execute("DELETE FROM blobs WHERE key = ?", (key,))
+                        evicted.append((key, path, aliases))
+                        total -= size
+                        self.bytes_evicted += size
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+        # Files go once the index no longer points at them
+        for key, path, aliases in evicted:
+            for filename in aliases:
+                self._unlink(os.path.join(self.output_dir, filename))
+                if self._cluster is not None:
+                    self._cluster.delete(f"alias:{filename}")
+            if self._cluster is not None:
+                self._cluster.delete(f"blob:{key}")
+            self._unlink(path)
+
+    def _total_bytes(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    @property
+    def total_bytes(self) -> int:
+        """Footprint of every blob in the index, whichever worker stored it."""
+        with self._lock:
+            return self._total_bytes()
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+            staged = self._db.execute("SELECT COUNT(*) FROM staging").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "staged_downloads": staged,
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "policy": self.policy,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "hit_bytes": self.hit_bytes,
+            "bytes_written": self.bytes_written,
+            "bytes_evicted": self.bytes_evicted,
+        }
@@ -0,0 +1,141 @@
+from typing import List, Optional, Tuple
+from contextlib import nullcontext
+from fastapi import HTTPException
+from models import SongMetadata, ConversionResult, YouTubeSearchResult
+from services.telemetry import cache_result
+from services.singleflight import SingleFlight
+from services.audio_formats import DEFAULT_FORMAT, DEFAULT_PRESET
+from services.spotify_service import canonical_track_id as spotify_track_id
+from services.tidal_service import canonical_track_id as tidal_track_id
+
+
+class ConvertService:
+    """
+    Runs the metadata -> search -> download pipeline for a single track.
+    Shared by the synchronous /v1/convert endpoint, the job workers and
+    the batch pipeline.
+
+    The search step asks the TrackIndex first and records every new match
+    there; a matched video that turns out to be gone is dropped from the
+    index and the cached search, and the track matched again without it.
+    """
+    def __init__(self, spotify_service, tidal_service, youtube_service, track_index=None):
+        self.spotify_service = spotify_service
+        self.tidal_service = tidal_service
+        self.youtube_service = youtube_service
+        self.track_index = track_index
+        # In-process only: across workers the download layer (keyed by video ID)
+        # holds the file lock, which is where the expensive work is.
+        self.convert_flight = SingleFlight("convert")
+
+    @staticmethod
+    def source_key(url: str) -> str:
+        """Normalizes the many URL spellings of a track to e.g. 'spotify:track:<id>'."""
+        canonical = tidal_track_id(url) if "tidal.com" in url else spotify_track_id(url)
+        return canonical or url.split("?")[0].rstrip("/")
+
+    @staticmethod
+    def track_id(metadata: SongMetadata) -> Optional[str]:
+        """Canonical source ID of resolved metadata, from its Spotify or Tidal URL."""
+        if metadata.spotify_url:
+            return spotify_track_id(metadata.spotify_url)
+        if metadata.tidal_url:
+            return tidal_track_id(metadata.tidal_url)
+        return None
+
+    def _source(self, url: str):
+        if "tidal.com" in url:
+            return self.tidal_service
+        # Anything else is handed to Spotify, which rejects unknown URLs itself
+        return self.spotify_service
+
+    def get_metadata(self, url: str) -> SongMetadata:
+        return self._source(url).get_metadata(url)
+
+    def get_tracks(self, url: str) -> List[SongMetadata]:
+        """Expands a track, album or playlist URL into track metadata."""
+        return self._source(url).get_tracks(url)
+
+    def convert(self, url: str, progress_hook=None, transcoder=None, stage_gate=None,
+                audio_format: str = DEFAULT_FORMAT, quality: str = DEFAULT_PRESET,
+                metadata: SongMetadata = None) -> ConversionResult:
+        """`metadata` skips step 1 when the caller already resolved it (the async endpoints)."""
+        def run():
+            # 1. Get Metadata based on Source
+            if progress_hook:
+                progress_hook("metadata", 0.0)
+            track = metadata if metadata is not None else self.get_metadata(url)
+            return self.convert_metadata(track, progress_hook, transcoder, stage_gate, audio_format, quality)
+
+        # Identical conversions already in flight are joined, not repeated.
+        # Progress is only reported to the caller that runs the conversion.
+        return self.convert_flight.do(f"{self.source_key(url)}:{audio_format}:{quality}", run)
+
+    def convert_metadata(self, metadata: SongMetadata, progress_hook=None, transcoder=None, stage_gate=None,
+                         audio_format: str = DEFAULT_FORMAT, quality: str = DEFAULT_PRESET) -> ConversionResult:
+        if stage_gate is None:
+            stage_gate = lambda stage: nullcontext()
+
+        # 2. Search YouTube (unless the track is already mapped)
+        if progress_hook:
+            progress_hook("search", 0.0)
+        with stage_gate("search"):
+            yt_result, _ = self._match(metadata)
+
+        # 3. Download
+        if progress_hook:
+            progress_hook("download", 0.0)
+        filename_base = f"{metadata.artist} - {metadata.title}"
+
+        def download(video_url: str) -> str:
+            return self.youtube_service.download_file(
+                video_url, filename_base,
+                progress_hook=progress_hook, transcoder=transcoder, stage_gate=stage_gate,
+                audio_format=audio_format, quality=quality, metadata=metadata
+            )
+
+        try:
+            filename = download(yt_result.video_url)
+        except HTTPException as e:
+            if e.status_code != 410:
+                raise
+            # The video was taken down since it was matched (or since the
+            # search listing it was cached): match again without it
+            gone = yt_result.video_id
+            if self.track_index is not None:
+                self.track_index.forget_video(gone)
+            self.youtube_service.forget_search(metadata)
+            with stage_gate("search"):
+                yt_result, _ = self._match(metadata, exclude={gone})
+            filename = download(yt_result.video_url)
+
+        return ConversionResult(
+            metadata=metadata,
+            youtube_url=yt_result.video_url,
+            filename=filename
+        )
+
+    def match_video(self, metadata: SongMetadata) -> YouTubeSearchResult:
+        """YouTubeService.match_video behind the track index."""
+        return self._match(metadata)[0]
+
+    def _match(self, metadata: SongMetadata, exclude=()) -> Tuple[YouTubeSearchResult, bool]:
+        """(match, whether it came from the index); `exclude` lists video IDs known to be gone."""
+        if self.track_index is None:
+            return self.youtube_service.match_video(metadata, exclude), False
+        track_id = self.track_id(metadata)
+        entry = self.track_index.lookup(track_id, metadata.isrc, self.youtube_service.match_min_confidence)
+        cache_result("track_index", entry is not None)
+        if entry is not None:
+            return YouTubeSearchResult(
+                video_id=entry["video_id"],
+                video_url=f"https://www.youtube.com/watch?v={entry['video_id']}",
+                title="",
+                duration=0,
+                confidence=entry["confidence"]
+            ), True
+
+        yt_result = self.youtube_service.match_video(metadata, exclude)
+        if track_id:
+            self.track_index.record(track_id, metadata.isrc, yt_result.video_id, yt_result.confidence)
+        return yt_result, False
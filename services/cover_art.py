@@ -0,0 +1,143 @@
+import os
+import time
+import hashlib
+import threading
+import subprocess
+from typing import Optional
+import requests
+from services.singleflight import SingleFlight
+from services.shared_state import get_shared_state
+from services.ttl_cache import TTLCache
+from services.telemetry import stage
+
+
+class CoverArtCache:
+    """
+    Album covers for embedding, fetched once per URL, downscaled to at most
+    COVER_MAX_PX on the long side (JPEG) and kept on disk under cache_dir,
+    so every track of an album reuses one small file.
+
+    Fetches are single-flight across workers. A cover that cannot be had
+    (HTTP error, not an image, no ffmpeg) yields None and is not retried
+    for COVER_RETRY_SECONDS; tracks are then tagged without art.
+    """
+    def __init__(self, cache_dir: str = None, max_px: int = None):
+        self.cache_dir = cache_dir or os.environ.get("COVER_CACHE_DIR") or os.path.join(
+            os.path.dirname(os.environ.get("CACHE_INDEX_PATH", "/app/cache/index.db")), "covers")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_px = max_px if max_px is not None else int(os.environ.get("COVER_MAX_PX", "600"))
+        self.max_bytes = int(os.environ.get("COVER_MAX_BYTES", str(10 * 1024 * 1024)))
+        self.max_files = int(os.environ.get("COVER_CACHE_MAX_FILES", "5000"))
+        self.timeout = float(os.environ.get("COVER_TIMEOUT", "10"))
+        self.session = requests.Session()
+        self._failed = TTLCache(max_entries=1000, ttl=float(os.environ.get("COVER_RETRY_SECONDS", "600")))
+        self._flight = SingleFlight("cover", state=get_shared_state())
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fetches = 0
+        self.failures = 0
+        self.fetch_seconds = 0.0
+
+    def get(self, url: Optional[str]) -> Optional[str]:
+        """Path of the downscaled cover for url, fetching it if needed; None if there is none."""
+        if not url or not url.startswith(("http://", "https://")):
+            return None
+        digest, path = self._path(url)
+        if self.cached(url):
+            return path
+        if self._failed.get(digest):
+            return None
+        return self._flight.do(digest, lambda: self._fetch(url, digest, path))
+
+    def cached(self, url: Optional[str]) -> Optional[str]:
+        """Path of the cover if it is already on disk; never fetches."""
+        if not url:
+            return None
+        path = self._path(url)[1]
+        if not self._touch(path):
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def _path(self, url: str) -> tuple:
+        digest = hashlib.sha256(url.encode()).hexdigest()[:32]
+        return digest, os.path.join(self.cache_dir, f"{digest}.jpg")
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        # mtime doubles as last use, for pruning
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _fetch(self, url: str, digest: str, path: str) -> Optional[str]:
+        # Another worker may have fetched it while we waited on its lock
+        if self._touch(path):
+            return path
+        started = time.monotonic()
+        raw_path = f"{path}.{threading.get_ident()}.src"
+        tmp_path = f"{path}.{threading.get_ident()}.tmp.jpg"
+        try:
+            with stage("cover", source="http"):
+                with self.session.get(url, timeout=self.timeout, stream=True) as resp:
+                    resp.raise_for_status()
+                    size = 0
+                    with open(raw_path, "wb") as fh:
+                        for chunk in resp.iter_content(64 * 1024):
+                            size += len(chunk)
+                            if size > self.max_bytes:
+                                raise ValueError(f"cover larger than {self.max_bytes} bytes")
+                            fh.write(chunk)
+                # Fit inside max_px x max_px, never upscale
+                scale = (f"scale='min({self.max_px},iw)':'min({self.max_px},ih)'"
+                         ":force_original_aspect_ratio=decrease")
+                subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-i", raw_path, "-vf", scale,
+                                "-frames:v", "1", "-q:v", "3", tmp_path],
+                               check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                os.replace(tmp_path, path)
+        except (requests.RequestException, subprocess.CalledProcessError, OSError, ValueError) as e:
+            print(f"WARNING: no cover art from {url}: {e}")
+            self._failed.put(digest, True)
+            with self._lock:
+                self.failures += 1
+            return None
+        finally:
+            for leftover in (raw_path, tmp_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        with self._lock:
+            self.fetches += 1
+            self.fetch_seconds += time.monotonic() - started
+            prune = self.fetches % 100 == 0
+        if prune:
+            self._prune()
+        return path
+
+    def _prune(self):
+        """Drops the least recently used covers beyond max_files."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".jpg") and entry.name.count(".") == 1:
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_files)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "fetches": self.fetches,
+                "failures": self.failures,
+                "avg_fetch_ms": round(self.fetch_seconds / self.fetches * 1000, 1) if self.fetches else 0.0,
+            }
@@ -0,0 +1,170 @@
+import os
+import re
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+import anyio
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class BlobResponse(Response):
+    """
+    Sends `length` bytes of a file starting at `offset`.
+
+    Uses the ASGI zero-copy extension (sendfile) when the server offers it,
+    'pathsend' for whole files, and otherwise large pread() chunks off the
+    event loop, so Python touches each megabyte once rather than each 64 KiB.
+    """
+    def __init__(self, path: str, offset: int, length: int, status_code: int, headers: dict,
+                 media_type: Optional[str], chunk_size: int, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.chunk_size = chunk_size
+        self.send_body = send_body
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if "http.response.pathsend" in extensions and self.status_code == 200:
+            await send({"type": "http.response.pathsend", "path": self.path})
+            return
+
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            if "http.response.zerocopysend" in extensions:
+                await send({"type": "http.response.zerocopysend", "file": fd, "offset": self.offset,
+                            "count": self.length})
+                return
+            position, end = self.offset, self.offset + self.length
+            while position < end:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(self.chunk_size, end - position), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": position < end})
+            if position < end:
+                # File shrank under us; end the response rather than hang
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            os.close(fd)
+
+
+class DownloadService:
+    """
+    Serves /downloads/<filename> from the DownloadCache index.
+
+    Size, mtime and ETag come from the index (recorded when the blob was
+    written), so a request costs one SQLite lookup: no stat, no hashing.
+    Supports single byte ranges (seeking, resumed downloads, If-Range),
+    If-None-Match / If-Modified-Since 304s and HEAD. Blobs requested by
+    their content-addressed name are cacheable forever; human-readable
+    aliases can be re-pointed, so clients revalidate them after
+    DOWNLOAD_ALIAS_MAX_AGE seconds.
+
+    With DOWNLOAD_ACCEL_REDIRECT_PREFIX set, a fronting nginx sends the
+    bytes instead (X-Accel-Redirect to <prefix>/.blobs/<blob>).
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.chunk_size = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+        self.alias_max_age = int(os.environ.get("DOWNLOAD_ALIAS_MAX_AGE", "3600"))
+        self.accel_prefix = os.environ.get("DOWNLOAD_ACCEL_REDIRECT_PREFIX", "").rstrip("/")
+
+    def response(self, request: Request, filename: str) -> Response:
+        # Dotfiles are the blob store and in-progress writes
+        if filename.startswith(".") or "/" in filename:
+            raise HTTPException(status_code=404, detail="Not Found")
+
+        blob = self.cache.describe(filename)
+        if blob is None:
+            # Files from before the index existed: plain static serving
+            path = os.path.join(self.cache.output_dir, filename)
+            if os.path.isfile(path):
+                return FileResponse(path)
+            raise HTTPException(status_code=404, detail="Not Found")
+
+        headers = {
+            "etag": blob["etag"],
+            "last-modified": formatdate(blob["mtime"], usegmt=True),
+            "accept-ranges": "bytes",
+            "cache-control": "public, max-age=31536000, immutable" if blob["immutable"]
+            else f"public, max-age={self.alias_max_age}, must-revalidate",
+        }
+        media_type = mimetypes.guess_type(blob["path"])[0] or "application/octet-stream"
+
+        if self._not_modified(request, blob):
+            return Response(status_code=304, headers=headers)
+
+        if self.accel_prefix:
+            # nginx handles Range itself on the internal location
+            headers["x-accel-redirect"] = f"{self.accel_prefix}/.blobs/{os.path.basename(blob['path'])}"
+            return Response(status_code=200, headers=headers, media_type=media_type)
+
+        size = blob["size"]
+        byte_range = self._byte_range(request, blob)
+        if byte_range == "unsatisfiable":
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+        offset, length, status = 0, size, 200
+        if byte_range is not None:
+            offset, end = byte_range
+            length, status = end - offset + 1, 206
+            headers["content-range"] = f"bytes {offset}-{end}/{size}"
+
+        return BlobResponse(blob["path"], offset, length, status, headers, media_type, self.chunk_size,
+                            send_body=request.method != "HEAD")
+
+    @staticmethod
+    def _not_modified(request: Request, blob: dict) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or blob["etag"] in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(blob["mtime"]) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _byte_range(request: Request, blob: dict):
+        """(first, last) inclusive, None for the whole file, or 'unsatisfiable'."""
+        header = request.headers.get("range")
+        if not header:
+            return None
+        # A stale If-Range means the client's partial copy is outdated: send everything
+        if_range = request.headers.get("if-range")
+        if if_range and if_range != blob["etag"] and if_range != formatdate(blob["mtime"], usegmt=True):
+            return None
+
+        match = RANGE_RE.match(header.strip())
+        if not match:
+            # Multiple or malformed ranges: ignoring Range is always allowed
+            return None
+        size = blob["size"]
+        first, last = match.groups()
+        if first == "" and last == "":
+            return None
+        if first == "":
+            suffix = int(last)
+            if suffix == 0:
+                return "unsatisfiable"
+            return max(0, size - suffix), size - 1
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+        if first >= size or first > last:
+            return "unsatisfiable"
+        return first, last
@@ -0,0 +1,139 @@
+import os
+import time
+import math
+import base64
+import asyncio
+from contextlib import nullcontext
+from typing import List, Optional
+from urllib.parse import urlsplit
+import httpx
+from services.telemetry import stage
+
+try:
+    import h2  # noqa: F401  (httpx only speaks HTTP/2 when h2 is installed)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class AsyncHTTPClient:
+    """
+    Process-wide async HTTP client for the async metadata services.
+
+    Keep-alive and HTTP/2 come from httpx. httpcore's pool rescans every
+    connection for every queued request, which gets expensive past a few
+    dozen connections, so the connection budget is split over several small
+    httpx.AsyncClient shards (HTTP_CONNECTIONS_PER_CLIENT each) and a
+    request goes to the least busy one. On top of that we cap concurrent
+    requests per host, so one slow provider cannot take every slot.
+    """
+    def __init__(self):
+        self.max_connections = int(os.environ.get("HTTP_MAX_CONNECTIONS", "200"))
+        self.max_per_host = int(os.environ.get("HTTP_MAX_PER_HOST", "100"))
+        self.connections_per_client = int(os.environ.get("HTTP_CONNECTIONS_PER_CLIENT", "8"))
+        self.timeout = float(os.environ.get("HTTP_TIMEOUT", "10"))
+        self._clients: List[httpx.AsyncClient] = []
+        self._in_flight: List[int] = []
+        self._host_limits = {}
+
+    def _build_clients(self):
+        # One SSL context for all shards; loading the CA bundle is not free
+        ssl_context = httpx.create_ssl_context()
+        per_client = max(1, min(self.connections_per_client, self.max_connections))
+        shards = math.ceil(self.max_connections / per_client)
+        self._clients = [
+            httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                verify=ssl_context,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=per_client,
+                    max_keepalive_connections=per_client,
+                    keepalive_expiry=60
+                )
+            )
+            for _ in range(shards)
+        ]
+        self._in_flight = [0] * shards
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return limit
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        async with self._host_limit(url):
+            if not self._clients:
+                self._build_clients()
+            shard = min(range(len(self._clients)), key=self._in_flight.__getitem__)
+            self._in_flight[shard] += 1
+            try:
+                return await self._clients[shard].request(method, url, **kwargs)
+            finally:
+                self._in_flight[shard] -= 1
+
+    def stats(self) -> dict:
+        return {
+            "http2": HTTP2_AVAILABLE,
+            "clients": len(self._clients),
+            "in_flight": sum(self._in_flight),
+        }
+
+    async def aclose(self):
+        clients, self._clients, self._in_flight = self._clients, [], []
+        for client in clients:
+            await client.aclose()
+
+
+class AsyncClientCredentialsToken:
+    """
+    OAuth client-credentials token, refreshed shortly before expiry.
+
+    Concurrent callers share one in-flight refresh and all wake together
+    when it lands (a lock would hand the token over one waiter per event
+    loop turn). The token request goes through the provider's
+    UpstreamGuard when one is given.
+    """
+    def __init__(self, http: AsyncHTTPClient, token_url: str, client_id: str, client_secret: str,
+                 refresh_margin: int = 60, source: str = "", guard=None):
+        self.http = http
+        self.guard = guard
+        self.source = source
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.expires_at = 0.0
+        self._refresh: Optional[asyncio.Task] = None
+
+    def _valid(self) -> bool:
+        return self.token is not None and time.time() < self.expires_at - self.refresh_margin
+
+    async def get(self) -> str:
+        if self._valid():
+            return self.token
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.ensure_future(self._fetch())
+        # shield: one cancelled caller must not cancel the refresh for everyone
+        return await asyncio.shield(self._refresh)
+
+    async def _fetch(self) -> str:
+        creds = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
+        with stage("token", source=self.source):
+            async with self.guard.call_async() if self.guard else nullcontext():
+                resp = await self.http.request(
+                    "POST", self.token_url,
+                    data={"grant_type": "client_credentials"},
+                    headers={"Authorization": f"Basic {creds}"}
+                )
+                resp.raise_for_status()
+            body = resp.json()
+        self.token = body["access_token"]
+        self.expires_at = time.time() + int(body.get("expires_in", 3600))
+        return self.token
+
+    def invalidate(self):
+        self.token = None
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from fastapi import HTTPException
+from models import JobStatus, ConversionResult
+from services.transcode_scheduler import PRIORITY_JOB
+from services.audio_formats import DEFAULT_FORMAT, DEFAULT_PRESET
+from services.telemetry import tracer
+from services.shared_state import get_shared_state
+
+# Rough share of the overall progress bar each stage owns
+STAGE_WEIGHTS = {
+    "metadata": (0.0, 0.05),
+    "search": (0.05, 0.10),
+    "download": (0.10, 0.80),
+    "transcode": (0.80, 1.0),
+}
+
+
+class Job:
+    def __init__(self, job_id: str, url: str, audio_format: str = DEFAULT_FORMAT, quality: str = DEFAULT_PRESET):
+        self.job_id = job_id
+        self.url = url
+        self.audio_format = audio_format
+        self.quality = quality
+        self.status = "queued"
+        self.stage: Optional[str] = None
+        self.progress = 0.0
+        self.error: Optional[str] = None
+        self.result: Optional[ConversionResult] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def update(self, stage: str, fraction: float):
+        start, end = STAGE_WEIGHTS.get(stage, (self.progress, self.progress))
+        self.stage = stage
+        self.progress = max(self.progress, start + (end - start) * fraction)
+
+    def snapshot(self) -> str:
+        return json.dumps({
+            "job_id": self.job_id, "url": self.url, "audio_format": self.audio_format, "quality": self.quality,
+            "status": self.status, "stage": self.stage, "progress": self.progress, "error": self.error,
+            "result": self.result.model_dump() if self.result is not None else None,
+            "created_at": self.created_at, "finished_at": self.finished_at,
+        })
+
+    @classmethod
+    def from_snapshot(cls, payload: str) -> "Job":
+        data = json.loads(payload)
+        job = cls(data["job_id"], data["url"], data["audio_format"], data["quality"])
+        for field in ("status", "stage", "progress", "error", "created_at", "finished_at"):
+            setattr(job, field, data[field])
+        if data["result"] is not None:
+            job.result = ConversionResult(**data["result"])
+        return job
+
+    def to_status(self) -> JobStatus:
+        return JobStatus(
+            job_id=self.job_id,
+            status=self.status,
+            stage=self.stage,
+            progress=round(self.progress, 3),
+            error=self.error
+        )
+
+
+class JobService:
+    """
+    Background conversion jobs.
+
+    I/O-bound stages (metadata, search, download) run on a thread pool;
+    ffmpeg goes through the shared TranscodeScheduler at job priority
+    (or inline on the worker thread when no scheduler is given, handy for
+    stubbed tests). Admission is bounded: at most
+    `workers + queue_size` jobs can be pending or running, beyond that
+    submit() answers 429 so clients back off instead of piling up.
+
+    Each job's state is also published to the SharedState (on status
+    changes, and at most every JOB_PUBLISH_INTERVAL seconds of progress),
+    so a status poll answered by another worker or replica sees it too.
+    """
+    # Snapshots of unfinished jobs outlive a worker that died holding them, but not forever
+    ACTIVE_TTL = 24 * 3600
+
+    def __init__(self, convert_service, transcode_scheduler=None, workers: int = None, queue_size: int = None,
+                 retention_seconds: int = None, state=None):
+        self.convert_service = convert_service
+        self.transcode_scheduler = transcode_scheduler
+        self.workers = workers if workers is not None else int(os.environ.get("JOB_WORKERS", "4"))
+        self.queue_size = queue_size if queue_size is not None else int(os.environ.get("JOB_QUEUE_SIZE", "32"))
+        self.retention_seconds = retention_seconds if retention_seconds is not None else int(
+            os.environ.get("JOB_RETENTION_SECONDS", "3600"))
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._transcoder = transcode_scheduler.transcoder(PRIORITY_JOB) if transcode_scheduler else None
+        self.state = state if state is not None else get_shared_state()
+        self.publish_interval = float(os.environ.get("JOB_PUBLISH_INTERVAL", "0.5"))
+        self._published_at = {}
+
+    def submit(self, url: str, audio_format: str = DEFAULT_FORMAT, quality: str = DEFAULT_PRESET) -> Job:
+        if not self._slots.acquire(blocking=False):
+            raise HTTPException(status_code=429, detail="Job queue is full, retry later")
+
+        self._prune()
+        job = Job(uuid.uuid4().hex, url, audio_format, quality)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        self._publish(job)
+
+        try:
+            self._executor.submit(self._run, job)
+        except Exception:
+            self._slots.release()
+            raise
+        return job
+
+    def get(self, job_id: str) -> Job:
+        """This worker's live Job, else the last snapshot another worker published."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            payload = self.state.get(f"job:{job_id}")
+            if payload is not None:
+                job = Job.from_snapshot(payload)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+    def _publish(self, job: Job, force: bool = True):
+        now = time.monotonic()
+        if not force and now - self._published_at.get(job.job_id, 0.0) < self.publish_interval:
+            return
+        self._published_at[job.job_id] = now
+        ttl = self.retention_seconds if job.finished_at else self.ACTIVE_TTL
+        try:
+            self.state.set(f"job:{job.job_id}", job.snapshot(), ttl=ttl)
+        except Exception as e:
+            # Other workers see a stale status; the job itself carries on
+            print(f"WARNING: could not publish job {job.job_id}: {e}")
+
+    def _progress(self, job: Job, stage: str, fraction: float):
+        changed = stage != job.stage
+        job.update(stage, fraction)
+        self._publish(job, force=changed)
+
+    def _run(self, job: Job):
+        try:
+            job.status = "running"
+            self._publish(job)
+            with tracer.start_as_current_span("convert_job", attributes={"job.id": job.job_id, "source.url": job.url}):
+                job.result = self.convert_service.convert(
+                    job.url, progress_hook=lambda stage, fraction: self._progress(job, stage, fraction),
+                    transcoder=self._transcoder, audio_format=job.audio_format, quality=job.quality
+                )
+            job.progress = 1.0
+            job.status = "completed"
+        except HTTPException as e:
+            job.error = str(e.detail)
+            job.status = "failed"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            self._slots.release()
+            self._publish(job)
+            self._published_at.pop(job.job_id, None)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [jid for jid, j in self._jobs.items() if j.finished_at and j.finished_at < cutoff]
+            for jid in expired:
+                del self._jobs[jid]
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "queued": sum(1 for j in jobs if j.status == "queued"),
+            "running": sum(1 for j in jobs if j.status == "running"),
+            "capacity": self.workers + self.queue_size,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
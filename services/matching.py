@@ -0,0 +1,114 @@
+"""
+Scoring of YouTube search candidates against track metadata.
+
+Everything here is pure: candidates are the plain dicts yt-dlp returns for
+a flat search (id, title, duration, channel/uploader), so recorded search
+results can be replayed offline. Features are computed column-wise over
+the whole candidate list and then combined with WEIGHTS.
+"""
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+from models import SongMetadata
+
+WEIGHTS = {
+    "duration": 0.45,
+    "title": 0.30,
+    "artist": 0.15,
+    "channel": 0.10,
+}
+
+# Subtracted for each marker that appears in the candidate but not in the
+# track title. Music videos are often fine apart from an intro, hence milder.
+MARKER_PENALTY = 0.35
+VERSION_MARKERS = {
+    "live", "remix", "cover", "karaoke", "instrumental", "extended", "acoustic",
+    "nightcore", "slowed", "reverb", "sped", "8d", "reaction", "video", "mashup",
+    "edit", "loop",
+}
+MILD_MARKERS = {"video": 0.15}
+
+# Seconds of difference that still count as a perfect duration match, and
+# how fast the score decays beyond that
+DURATION_GRACE = 2.0
+DURATION_DECAY = 10.0
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_STOPWORDS = {"the", "a", "an", "and", "feat", "ft", "with", "official", "audio", "music", "hd", "hq", "topic"}
+
+
+def tokenize(text: str) -> set:
+    return {t for t in _TOKEN_RE.findall((text or "").casefold()) if t not in _STOPWORDS}
+
+
+def _overlap(wanted: set, tokens: List[set]) -> List[float]:
+    if not wanted:
+        return [0.5] * len(tokens)
+    return [len(wanted & t) / len(wanted) for t in tokens]
+
+
+def duration_scores(target_ms: int, durations: List[Optional[float]]) -> List[float]:
+    if not target_ms:
+        return [0.5] * len(durations)
+    target = target_ms / 1000.0
+    return [
+        0.0 if not d else math.exp(-max(0.0, abs(d - target) - DURATION_GRACE) / DURATION_DECAY)
+        for d in durations
+    ]
+
+
+def channel_scores(artist_tokens: set, channels: List[str]) -> List[float]:
+    scores = []
+    for channel in channels:
+        lowered = (channel or "").casefold()
+        if lowered.endswith("- topic") or "vevo" in lowered:
+            # Auto-generated art tracks and label uploads are the studio version
+            scores.append(1.0)
+        elif artist_tokens and artist_tokens <= tokenize(channel):
+            scores.append(0.8)
+        else:
+            scores.append(0.0)
+    return scores
+
+
+def penalties(title_tokens: set, candidate_tokens: List[set]) -> List[float]:
+    allowed = title_tokens & VERSION_MARKERS
+    return [
+        sum(MILD_MARKERS.get(marker, MARKER_PENALTY) for marker in (t & VERSION_MARKERS) - allowed)
+        for t in candidate_tokens
+    ]
+
+
+def feature_columns(metadata: SongMetadata, candidates: List[dict]) -> Dict[str, List[float]]:
+    title_tokens = tokenize(metadata.title)
+    artist_tokens = tokenize(metadata.artist.split(",")[0])
+    channels = [c.get("channel") or c.get("uploader") or "" for c in candidates]
+    candidate_title_tokens = [tokenize(c.get("title")) for c in candidates]
+    candidate_all_tokens = [t | tokenize(ch) for t, ch in zip(candidate_title_tokens, channels)]
+
+    return {
+        "duration": duration_scores(metadata.duration_ms, [c.get("duration") for c in candidates]),
+        "title": _overlap(title_tokens, candidate_title_tokens),
+        "artist": _overlap(artist_tokens, candidate_all_tokens),
+        "channel": channel_scores(artist_tokens, channels),
+        "penalty": penalties(title_tokens, candidate_title_tokens),
+    }
+
+
+def score_candidates(metadata: SongMetadata, candidates: List[dict]) -> List[float]:
+    """Confidence in [0, 1] for every candidate, in input order."""
+    columns = feature_columns(metadata, candidates)
+    scores = []
+    for i in range(len(candidates)):
+        score = sum(weight * columns[name][i] for name, weight in WEIGHTS.items()) - columns["penalty"][i]
+        scores.append(round(min(1.0, max(0.0, score)), 4))
+    return scores
+
+
+def best_match(metadata: SongMetadata, candidates: List[dict]) -> Tuple[Optional[dict], float]:
+    """Highest-scoring candidate (earlier search rank wins ties) and its confidence."""
+    if not candidates:
+        return None, 0.0
+    scores = score_candidates(metadata, candidates)
+    best = max(range(len(candidates)), key=lambda i: (scores[i], -i))
+    return candidates[best], scores[best]
@@ -0,0 +1,167 @@
+import os
+import time
+import json
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from fastapi import HTTPException
+from models import SongMetadata
+from services.telemetry import stage, cache_result
+from services.shared_state import LocalState, get_shared_state
+
+
+class _Negative:
+    """Cached upstream 'not found' answer."""
+    __slots__ = ("status_code", "detail")
+
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+
+
+class MetadataCache:
+    """
+    SongMetadata cache keyed by canonical track ID (e.g. 'spotify:track:<id>').
+
+    A bounded in-memory LRU sits in front of the SharedState (SQLite for
+    the workers of one host, Redis across replicas), so hot tracks never
+    leave the process, every worker benefits from what one has fetched,
+    and a restart keeps the warm set. METADATA_CACHE_DB still selects a
+    dedicated SQLite file. 404s are remembered for a short negative TTL so
+    repeated lookups of dead links do not spend rate-limit budget either.
+    """
+    def __init__(self, name: str, max_entries: int = None, ttl: int = None, negative_ttl: int = None,
+                 db_path: str = None, state=None):
+        self.name = name
+        self.max_entries = max_entries if max_entries is not None else int(
+            os.environ.get("METADATA_CACHE_SIZE", "10000"))
+        self.ttl = ttl if ttl is not None else int(os.environ.get("METADATA_CACHE_TTL", "86400"))
+        self.negative_ttl = negative_ttl if negative_ttl is not None else int(
+            os.environ.get("METADATA_CACHE_NEGATIVE_TTL", "300"))
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+        db_path = db_path or os.environ.get("METADATA_CACHE_DB")
+        if state is None:
+            state = LocalState(db_path) if db_path else get_shared_state()
+        # A per-process store would only duplicate the LRU
+        self._store = state if state.scope != "process" else None
+
+    def get(self, key: str):
+        """Returns SongMetadata, a _Negative, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    if isinstance(value, _Negative):
+                        self.negative_hits += 1
+                    else:
+                        self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value = self._load(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key: str, metadata: SongMetadata):
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, metadata)
+        if self._store is not None:
+            payload = json.dumps({"expires_at": expires_at, "metadata": metadata.model_dump()})
+            self._store.set(self._store_key(key), payload, ttl=self.ttl)
+
+    def put_negative(self, key: str, status_code: int, detail: str):
+        # Negative entries stay in memory only; they are cheap to re-learn
+        self._remember(key, time.time() + self.negative_ttl, _Negative(status_code, detail))
+
+    def get_or_load(self, key: Optional[str], loader: Callable[[], SongMetadata]) -> SongMetadata:
+        with stage("metadata", source=self.name):
+            if key is None:
+                return loader()
+
+            cached = self._cached(key)
+            if cached is not None:
+                return cached
+
+            try:
+                metadata = loader()
+            except HTTPException as e:
+                if e.status_code == 404:
+                    self.put_negative(key, e.status_code, e.detail)
+                raise
+            self.put(key, metadata)
+            return metadata
+
+    async def get_or_load_async(self, key: Optional[str], loader: Callable[[], Awaitable[SongMetadata]]) -> SongMetadata:
+        """get_or_load for coroutine loaders (the async metadata services)."""
+        with stage("metadata", source=self.name):
+            if key is None:
+                return await loader()
+
+            cached = self._cached(key)
+            if cached is not None:
+                return cached
+
+            try:
+                metadata = await loader()
+            except HTTPException as e:
+                if e.status_code == 404:
+                    self.put_negative(key, e.status_code, e.detail)
+                raise
+            self.put(key, metadata)
+            return metadata
+
+    def _cached(self, key: str) -> Optional[SongMetadata]:
+        """Cached metadata or None; a remembered 404 is raised again."""
+        cached = self.get(key)
+        cache_result("metadata", cached is not None)
+        if isinstance(cached, _Negative):
+            raise HTTPException(status_code=cached.status_code, detail=cached.detail)
+        return cached
+
+    def _remember(self, key: str, expires_at: float, value):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _store_key(self, key: str) -> str:
+        return f"metadata:{self.name}:{key}"
+
+    def _load(self, key: str, now: float) -> Optional[SongMetadata]:
+        if self._store is None:
+            return None
+        payload = self._store.get(self._store_key(key))
+        if payload is None:
+            return None
+        entry = json.loads(payload)
+        if entry["expires_at"] <= now:
+            return None
+        metadata = SongMetadata(**entry["metadata"])
+        self._remember(key, entry["expires_at"], metadata)
+        return metadata
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+                "shared": self._store.scope if self._store is not None else "process",
+            }
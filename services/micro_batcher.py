@@ -0,0 +1,152 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class _Batch:
+    def __init__(self):
+        self.futures = {}
+        self.full = threading.Event()
+
+
+class _AsyncBatch:
+    def __init__(self):
+        self.futures = {}
+        self.full = asyncio.Event()
+
+
+class _BatchStats:
+    def __init__(self):
+        self.batches = 0
+        self.keys = 0
+        self.largest = 0
+
+    def record(self, size: int):
+        self.batches += 1
+        self.keys += size
+        self.largest = max(self.largest, size)
+
+    def as_dict(self) -> dict:
+        return {
+            "batches": self.batches,
+            "keys": self.keys,
+            "avg_batch": round(self.keys / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest,
+        }
+
+
+class MicroBatcher:
+    """
+    Turns concurrent single-key lookups into bulk calls.
+
+    The first caller opens a batch, waits up to `window` seconds for others
+    to join (less if it fills to `max_size`), then runs fetch_many(keys)
+    once for everyone. fetch_many returns {key: value}; keys it leaves out
+    resolve to None. An exception from fetch_many is raised in every caller
+    of that batch. Duplicate keys in a window share one slot.
+    """
+    def __init__(self, fetch_many, window: float, max_size: int):
+        self.fetch_many = fetch_many
+        self.window = window
+        self.max_size = max_size
+        self._open = None
+        self._lock = threading.Lock()
+        self._stats = _BatchStats()
+
+    def get(self, key):
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            future = batch.futures.get(key)
+            if future is None:
+                future = batch.futures[key] = Future()
+            if len(batch.futures) >= self.max_size:
+                self._open = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+                self._stats.record(len(batch.futures))
+            self._run(batch)
+        return future.result()
+
+    def _run(self, batch: _Batch):
+        try:
+            results = self.fetch_many(list(batch.futures))
+        except BaseException as e:
+            for future in batch.futures.values():
+                future.set_exception(e)
+            return
+        for key, future in batch.futures.items():
+            future.set_result(results.get(key))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return self._stats.as_dict()
+
+
+class AsyncMicroBatcher:
+    """
+    MicroBatcher for the event loop: fetch_many is a coroutine function and
+    each batch is flushed by its own task, so a caller that disconnects does
+    not strand the others waiting on the same batch.
+    """
+    def __init__(self, fetch_many, window: float, max_size: int):
+        self.fetch_many = fetch_many
+        self.window = window
+        self.max_size = max_size
+        self._open = None
+        self._tasks = set()
+        self._stats = _BatchStats()
+
+    async def get(self, key):
+        batch = self._open
+        if batch is None:
+            batch = self._open = _AsyncBatch()
+            task = asyncio.get_running_loop().create_task(self._flush(batch))
+            # The loop only keeps weak references to tasks
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        future = batch.futures.get(key)
+        if future is None:
+            future = batch.futures[key] = asyncio.get_running_loop().create_future()
+        if len(batch.futures) >= self.max_size:
+            self._open = None
+            batch.full.set()
+        return await asyncio.shield(future)
+
+    async def _flush(self, batch: _AsyncBatch):
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        if self._open is batch:
+            self._open = None
+        futures = batch.futures
+        self._stats.record(len(futures))
+        try:
+            results = await self.fetch_many(list(futures))
+        except BaseException as e:
+            for future in futures.values():
+                if future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+                    # Callers that went away never retrieve it
+                    future.exception()
+            if not isinstance(e, Exception):
+                raise
+            return
+        for key, future in futures.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+    def stats(self) -> dict:
+        return self._stats.as_dict()
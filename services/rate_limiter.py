@@ -0,0 +1,96 @@
+import time
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from fastapi import HTTPException
+
+
+def retry_after_seconds(headers, default: float = 1.0) -> float:
+    """Retry-After as seconds; accepts both delta-seconds and HTTP-date forms."""
+    value = (headers or {}).get("Retry-After") or (headers or {}).get("retry-after")
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """
+    Paces calls to one upstream at `rate` per second with bursts of `burst`.
+
+    Callers reserve the next free slot and sleep until it comes up instead
+    of being refused, so a burst is spread out rather than turned into 429s.
+    A 429's Retry-After pushes every pending and future slot back (pause()).
+    A caller whose slot is more than `max_wait` seconds away gets a 503 with
+    Retry-After rather than holding its request open.
+
+    Thread-safe, and shared by the blocking and async clients of a provider:
+    acquire() sleeps the thread, acquire_async() awaits.
+    """
+    def __init__(self, name: str, rate: float, burst: int, max_wait: float):
+        self.name = name
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.burst = max(1, burst)
+        self.max_wait = max_wait
+        # Theoretical arrival time of the next call, GCRA style
+        self._tat = 0.0
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.delayed = 0
+        self.waited_seconds = 0.0
+        self.throttled = 0
+        self.rejected = 0
+
+    def _reserve(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tat = max(self._tat, now) + self.interval
+            delay = max(0.0, tat - now - self.burst * self.interval)
+            if delay > self.max_wait:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503, detail=f"{self.name} rate limit reached, retry later",
+                    headers={"Retry-After": str(int(delay) + 1)}
+                )
+            self._tat = tat
+            self.acquired += 1
+            if delay:
+                self.delayed += 1
+                self.waited_seconds += delay
+        return delay
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Upstream said 429: nothing goes out for `seconds`, then pacing resumes from an empty bucket."""
+        until = time.monotonic() + seconds
+        with self._lock:
+            self.throttled += 1
+            self._tat = max(self._tat, until + (self.burst - 1) * self.interval)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate_per_s": round(1.0 / self.interval, 2) if self.interval else 0.0,
+                "burst": self.burst,
+                "acquired": self.acquired,
+                "delayed": self.delayed,
+                "waited_seconds": round(self.waited_seconds, 3),
+                "throttled": self.throttled,
+                "rejected": self.rejected,
+                "backlog_seconds": round(max(0.0, self._tat - time.monotonic() - self.burst * self.interval), 3),
+            }
@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+import anyio
+
+
+class lazy:
+    """Builds the service on first access, exactly once, under the registry lock."""
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+        self.__doc__ = factory.__doc__
+
+    def __get__(self, registry, owner):
+        if registry is None:
+            return self
+        service = registry._built.get(self.name)
+        if service is None:
+            # Re-entrant: building convert builds spotify, tidal and youtube first
+            with registry._lock:
+                service = registry._built.get(self.name)
+                if service is None:
+                    started = time.perf_counter()
+                    service = self.factory(registry)
+                    registry.build_seconds[self.name] = round(time.perf_counter() - started, 4)
+                    registry._built[self.name] = service
+        return service
+
+
+class Services:
+    """
+    The app's services, each constructed (and its heavy imports - yt-dlp,
+    spotipy, the process pool - loaded) the first time a request needs it.
+
+    A fresh worker can answer / and /downloads without paying for the
+    YouTube or Spotify stacks; peek() lets health and metrics report on
+    whatever has been built so far without building the rest.
+    """
+    def __init__(self):
+        self._built = {}
+        self._lock = threading.RLock()
+        self.build_seconds = {}
+
+    def peek(self, name: str):
+        """The service if it has been built, else None."""
+        return self._built.get(name)
+
+    async def resolve(self, name: str):
+        """
+        The service, for async handlers: a first build (and any build it
+        waits on under the registry lock) runs in a worker thread, never
+        on the event loop.
+        """
+        service = self._built.get(name)
+        if service is None:
+            service = await anyio.to_thread.run_sync(getattr, self, name)
+        return service
+
+    def stats_of(self, name: str, fn):
+        """Stats callable for telemetry.register_stats that does not build the service."""
+        def stats() -> dict:
+            service = self._built.get(name)
+            return fn(service) if service is not None else {}
+        return stats
+
+    @lazy
+    def spotify(self):
+        from services.spotify_service import SpotifyService
+        return SpotifyService()
+
+    @lazy
+    def tidal(self):
+        from services.tidal_service import TidalService
+        return TidalService()
+
+    @lazy
+    def download_cache(self):
+        from services.cache_service import DownloadCache
+        cache = DownloadCache(os.environ.get("DOWNLOAD_DIR", "/app/downloads"))
+        cache.sweep()
+        return cache
+
+    @lazy
+    def youtube(self):
+        from services.youtube_service import YouTubeService
+        return YouTubeService(self.download_cache)
+
+    @lazy
+    def convert(self):
+        from services.convert_service import ConvertService
+        return ConvertService(self.spotify, self.tidal, self.youtube, self.track_index)
+
+    @lazy
+    def track_index(self):
+        from services.track_index import TrackIndex
+        index = TrackIndex()
+        snapshot = os.environ.get("TRACK_INDEX_SNAPSHOT")
+        # Warm a fresh node (empty index) from an export baked into the image or volume
+        if snapshot and len(index) == 0:
+            index.import_file(snapshot)
+        return index
+
+    @lazy
+    def transcode_scheduler(self):
+        from services.transcode_scheduler import TranscodeScheduler
+        return TranscodeScheduler()
+
+    @lazy
+    def interactive_transcoder(self):
+        from services.transcode_scheduler import PRIORITY_INTERACTIVE
+        return self.transcode_scheduler.transcoder(PRIORITY_INTERACTIVE)
+
+    @lazy
+    def jobs(self):
+        from services.job_service import JobService
+        return JobService(self.convert, self.transcode_scheduler)
+
+    @lazy
+    def batch(self):
+        from services.batch_service import BatchService
+        return BatchService(self.convert, self.transcode_scheduler)
+
+    @lazy
+    def stream(self):
+        from services.stream_service import StreamService
+        return StreamService(self.youtube)
+
+    @lazy
+    def downloads(self):
+        from services.download_service import DownloadService
+        return DownloadService(self.download_cache)
+
+    @lazy
+    def bundles(self):
+        from services.bundle_service import BundleService
+        return BundleService(self.download_cache)
+
+    @lazy
+    def http_client(self):
+        from services.http_client import AsyncHTTPClient
+        return AsyncHTTPClient()
+
+    @lazy
+    def async_spotify(self):
+        from services.async_spotify_service import AsyncSpotifyService
+        return AsyncSpotifyService(self.spotify, self.http_client)
+
+    @lazy
+    def async_tidal(self):
+        from services.async_tidal_service import AsyncTidalService
+        return AsyncTidalService(self.tidal, self.http_client)
+
+    def shutdown(self):
+        """Stops the worker pools of whatever was built."""
+        if (jobs := self.peek("jobs")) is not None:
+            jobs.shutdown()
+        if (scheduler := self.peek("transcode_scheduler")) is not None:
+            scheduler.shutdown()
+        if (youtube := self.peek("youtube")) is not None:
+            youtube.search_pool.close()
+            for pool in youtube.download_pools.values():
+                pool.close()
+
+    async def aclose(self):
+        if (http_client := self.peek("http_client")) is not None:
+            await http_client.aclose()
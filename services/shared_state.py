@@ -0,0 +1,298 @@
+import os
+import time
+import uuid
+import fcntl
+import sqlite3
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Optional
+
+# Atomic "delete / extend only if we still own it" for Redis locks
+RELEASE_SCRIPT = 'if redis.call("get", KEYS[1]) == ARGV[1] then return redis.call("del", KEYS[1]) else return 0 end'
+RENEW_SCRIPT = ('if redis.call("get", KEYS[1]) == ARGV[1] then '
+                'return redis.call("pexpire", KEYS[1], ARGV[2]) else return 0 end')
+
+
+class SharedState(ABC):
+    """
+    String key-value store with TTLs plus named exclusive locks, for state
+    that several workers must agree on: metadata cache entries, job
+    snapshots, single-flight locks and the download index.
+
+    `scope` says how far it is shared: "process" (MemoryState), "host"
+    (LocalState: SQLite + flock) or "cluster" (RedisState).
+    """
+    scope = "process"
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: float = None):
+        ...
+
+    @abstractmethod
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        """set() only if the key is absent; True if it was written."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def lock(self, name: str):
+        """Context manager, exclusive across everyone sharing this state; blocks until acquired."""
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "scope": self.scope}
+
+    def close(self):
+        pass
+
+
+class MemoryState(SharedState):
+    """Per-process dict; the default for tests and single-worker setups."""
+    scope = "process"
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def _live(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._live(key)
+        return entry[0] if entry else None
+
+    def set(self, key: str, value: str, ttl: float = None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    @contextmanager
+    def lock(self, name: str):
+        with self._lock:
+            entry = self._locks.get(name)
+            if entry is None:
+                entry = self._locks[name] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[name]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**super().stats(), "keys": len(self._entries)}
+
+
+class LocalState(SharedState):
+    """
+    One host: a SQLite table (WAL, so every uvicorn worker reads and writes
+    it concurrently) and flock-based locks in lock_dir.
+    """
+    scope = "host"
+    # Expired rows are purged every this many writes
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str, lock_dir: str = None):
+        self.path = path
+        self.lock_dir = lock_dir or os.path.join(os.path.dirname(path) or ".", "locks")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self._writes = 0
+        self.lock_waits = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row[0]
+
+    def set(self, key: str, value: str, ttl: float = None):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                             (key, value, time.time() + ttl if ttl else None))
+            self._maybe_purge()
+
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM kv WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = self._db.execute("INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                                      (key, value, now + ttl if ttl else None))
+            self._maybe_purge()
+            return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def _maybe_purge(self):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._db.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+    @contextmanager
+    def lock(self, name: str):
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        with open(os.path.join(self.lock_dir, f"{digest}.lock"), "a") as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker process is on it; wait for it to finish
+                self.lock_waits += 1
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def stats(self) -> dict:
+        with self._lock:
+            keys = self._db.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+        return {**super().stats(), "keys": keys, "lock_waits": self.lock_waits}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RedisState(SharedState):
+    """
+    Any Redis-protocol server (Redis, Valkey, KeyDB, ...), so every replica
+    shares one view. Keys are namespaced with `prefix`.
+
+    Locks are SET NX leases of lock_ttl seconds, renewed from a background
+    thread while held, so a crashed holder frees its lock within lock_ttl.
+    Waiters poll with capped backoff.
+    """
+    scope = "cluster"
+
+    def __init__(self, url: str, prefix: str = "spotify2mp3:", lock_ttl: float = 30):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SHARED_STATE_BACKEND=redis needs the 'redis' package")
+        self.url = url
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self._client = redis.Redis.from_url(url, decode_responses=True, health_check_interval=30)
+        self.lock_waits = 0
+
+    def get(self, key: str) -> Optional[str]:
+        return self._client.get(self.prefix + key)
+
+    def set(self, key: str, value: str, ttl: float = None):
+        self._client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        return bool(self._client.set(self.prefix + key, value, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    def delete(self, key: str):
+        self._client.delete(self.prefix + key)
+
+    @contextmanager
+    def lock(self, name: str):
+        key = f"{self.prefix}lock:{name}"
+        token = uuid.uuid4().hex
+        ttl_ms = int(self.lock_ttl * 1000)
+        delay = 0.01
+        while not self._client.set(key, token, nx=True, px=ttl_ms):
+            if delay == 0.01:
+                self.lock_waits += 1
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+        released = threading.Event()
+
+        def renew():
+            while not released.wait(self.lock_ttl / 3):
+                try:
+                    self._client.eval(RENEW_SCRIPT, 1, key, token, ttl_ms)
+                except Exception as e:
+                    print(f"WARNING: could not renew lock {name}: {e}")
+
+        renewer = threading.Thread(target=renew, name="lock-renew", daemon=True)
+        renewer.start()
+        try:
+            yield
+        finally:
+            released.set()
+            self._client.eval(RELEASE_SCRIPT, 1, key, token)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "lock_waits": self.lock_waits}
+
+    def close(self):
+        self._client.close()
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_shared_state() -> SharedState:
+    """
+    The process-wide SharedState chosen by SHARED_STATE_BACKEND:
+    "local" (default; SQLite at SHARED_STATE_PATH, locks in
+    SINGLEFLIGHT_LOCK_DIR), "redis" (REDIS_URL) or "memory".
+    """
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                backend = os.environ.get("SHARED_STATE_BACKEND", "local").lower()
+                if backend == "memory":
+                    _state = MemoryState()
+                elif backend == "redis":
+                    _state = RedisState(
+                        os.environ.get("REDIS_URL", "redis://localhost:6379/0"),
+                        prefix=os.environ.get("REDIS_KEY_PREFIX", "spotify2mp3:"),
+                        lock_ttl=float(os.environ.get("REDIS_LOCK_TTL", "30"))
+                    )
+                else:
+                    if backend != "local":
+                        print(f"WARNING: unknown SHARED_STATE_BACKEND '{backend}', using 'local'")
+                    _state = LocalState(
+                        os.environ.get("SHARED_STATE_PATH", "/app/cache/state.db"),
+                        lock_dir=os.environ.get("SINGLEFLIGHT_LOCK_DIR", "/app/cache/locks")
+                    )
+    return _state
+
+
+def peek_shared_state() -> Optional[SharedState]:
+    """The SharedState if something has already asked for it, else None."""
+    return _state
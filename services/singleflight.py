@@ -0,0 +1,68 @@
+import threading
+from contextlib import nullcontext
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls that share a key into one execution.
+
+    The first caller for a key runs fn(); everyone arriving while it is in
+    flight waits and receives the same result (or exception).
+
+    With a SharedState, the running caller also holds its lock for the key,
+    so uvicorn workers (LocalState) or replicas (RedisState) queue behind
+    each other. fn() must then be idempotent with respect to its own cache:
+    a worker that waited on the lock runs fn() afterwards and is expected to
+    find the finished result there.
+    """
+    def __init__(self, name: str, state=None):
+        self.name = name
+        self.state = state
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with self.state.lock(f"singleflight:{self.name}:{key}") if self.state else nullcontext():
+                call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls),
+            }
@@ -1,41 +1,209 @@
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
+from spotipy.exceptions import SpotifyException
 import os
+import re
+from typing import List, Optional
 from models import SongMetadata
 from fastapi import HTTPException
+from services.metadata_cache import MetadataCache
+from services.micro_batcher import MicroBatcher
+from services.rate_limiter import TokenBucket, retry_after_seconds
+from services.upstream_guard import UpstreamGuard, build_guard
+
+# Matches both open.spotify.com/<kind>/<id> URLs and spotify:<kind>:<id> URIs
+SPOTIFY_RESOURCE_RE = re.compile(r"(track|album|playlist)[/:]([A-Za-z0-9]+)")
+# Well-formed base62 track ID; only these go into bulk calls, where one bad ID fails the lot
+SPOTIFY_ID_RE = re.compile(r"^[A-Za-z0-9]{22}$")
+# GET /tracks takes at most this many IDs
+MAX_TRACKS_PER_CALL = 50
+
+
+def canonical_track_id(spotify_url: str) -> Optional[str]:
+    """'spotify:track:<id>' for any track URL/URI spelling (?si=, intl-xx/ paths), else None."""
+    match = SPOTIFY_RESOURCE_RE.search(spotify_url)
+    if match and match.group(1) == "track":
+        return f"spotify:track:{match.group(2)}"
+    return None
+
+
+def track_to_metadata(track: dict, album: Optional[dict] = None) -> SongMetadata:
+    # Album track listings carry simplified tracks without the album object
+    album = album or track['album']
+    artists = ", ".join([artist['name'] for artist in track['artists']])
+    album_art = album['images'][0]['url'] if album.get('images') else None
+
+    return SongMetadata(
+        title=track['name'],
+        artist=artists,
+        album=album['name'],
+        duration_ms=track['duration_ms'],
+        spotify_url=track['external_urls']['spotify'],
+        album_art_url=album_art,
+        isrc=track.get('external_ids', {}).get('isrc')
+    )
+
+
+def build_rate_limiter() -> TokenBucket:
+    return TokenBucket(
+        "Spotify",
+        rate=float(os.environ.get("SPOTIFY_RATE_LIMIT", "10")),
+        burst=int(os.environ.get("SPOTIFY_RATE_BURST", "20")),
+        max_wait=float(os.environ.get("SPOTIFY_MAX_RATE_LIMIT_WAIT", "30"))
+    )
+
+
+def build_upstream_guard() -> UpstreamGuard:
+    # Most lookups queue on the event loop (AsyncSpotifyService), where waiting costs no thread
+    return build_guard("Spotify", "SPOTIFY", concurrency=10, max_concurrency=50, latency_target_ms=2000,
+                       queue_timeout=5)
+
 
 class SpotifyService:
+    """
+    Spotify metadata over spotipy.
+
+    Concurrent single-track lookups are micro-batched into one GET /tracks
+    call per SPOTIFY_BATCH_WINDOW_MS (up to 50 IDs), and every API call goes
+    through a token bucket that paces requests and waits out 429s instead
+    of failing them. The bucket is shared with AsyncSpotifyService, since
+    both spend the same client-credentials quota, and so is the upstream
+    guard (adaptive concurrency limit and circuit breaker) around the calls.
+    """
+    # 429s retried (after waiting Retry-After) before giving up on a call
+    MAX_THROTTLED_RETRIES = 5
+
     def __init__(self):
         client_id = os.environ.get("SPOTIFY_CLIENT_ID")
         client_secret = os.environ.get("SPOTIFY_CLIENT_SECRET")
-        
+        self.timeout = float(os.environ.get("SPOTIFY_TIMEOUT", "10"))
+
         if not client_id or not client_secret:
             # We don't raise here to allow app startup, but methods will fail
             print("WARNING: Spotify credentials not found in environment.")
             self.sp = None
         else:
-            self.sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
+            auth_manager = SpotifyClientCredentials(
                 client_id=client_id,
-                client_secret=client_secret
-            ))
+                client_secret=client_secret,
+                requests_timeout=self.timeout
+            )
+            auth_manager.OAUTH_TOKEN_URL = os.environ.get("SPOTIFY_AUTH_URL", auth_manager.OAUTH_TOKEN_URL)
+            # 429s are left to the rate limiter, which pauses every caller, not just this one
+            self.sp = spotipy.Spotify(auth_manager=auth_manager, status_forcelist=(500, 502, 503, 504),
+                                      requests_timeout=self.timeout)
+            self.sp.prefix = os.environ.get("SPOTIFY_API_URL", "https://api.spotify.com/v1").rstrip("/") + "/"
+        self.metadata_cache = MetadataCache("spotify")
+        self.rate_limiter = build_rate_limiter()
+        self.guard = build_upstream_guard()
+        self.batch_window = float(os.environ.get("SPOTIFY_BATCH_WINDOW_MS", "20")) / 1000
+        self.batch_size = max(1, min(MAX_TRACKS_PER_CALL, int(os.environ.get("SPOTIFY_BATCH_SIZE", "50"))))
+        self.batcher = MicroBatcher(self._fetch_tracks, self.batch_window, self.batch_size)
 
     def get_metadata(self, spotify_url: str) -> SongMetadata:
         if not self.sp:
             raise HTTPException(status_code=500, detail="Spotify credentials not configured.")
 
+        return self.metadata_cache.get_or_load(
+            canonical_track_id(spotify_url), lambda: self._fetch_metadata(spotify_url))
+
+    def _fetch_metadata(self, spotify_url: str) -> SongMetadata:
+        key = canonical_track_id(spotify_url)
+        track_id = key.rsplit(":", 1)[1] if key else spotify_url
+        try:
+            if SPOTIFY_ID_RE.match(track_id):
+                track = self.batcher.get(track_id)
+                if track is None:
+                    raise HTTPException(status_code=404, detail="Spotify track not found")
+            else:
+                track = self._call(self.sp.track, spotify_url)
+        except HTTPException:
+            raise
+        except SpotifyException as e:
+            if e.http_status == 404:
+                raise HTTPException(status_code=404, detail="Spotify track not found")
+            if e.http_status == 429:
+                raise HTTPException(status_code=503, detail="Spotify rate limit reached, retry later",
+                                    headers={"Retry-After": str(int(retry_after_seconds(e.headers)) + 1)})
+            raise HTTPException(status_code=400, detail=f"Invalid Spotify URL or API error: {str(e)}")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid Spotify URL or API error: {str(e)}")
+
+        return track_to_metadata(track)
+
+    def _fetch_tracks(self, track_ids: List[str]) -> dict:
+        """MicroBatcher loader: {id: track} for one GET /tracks call; unknown IDs are left out."""
+        try:
+            tracks = self._call(self.sp.tracks, track_ids)["tracks"]
+        except SpotifyException as e:
+            if e.http_status != 400 or len(track_ids) == 1:
+                raise
+            # Spotify rejects the whole call for one malformed ID: fall back to single lookups
+            return {track_id: track for track_id in track_ids
+                    if (track := self._fetch_one(track_id)) is not None}
+        # Results are positional; a relinked track comes back under a different ID
+        return {track_id: track for track_id, track in zip(track_ids, tracks) if track}
+
+    def _fetch_one(self, track_id: str) -> Optional[dict]:
+        try:
+            return self._call(self.sp.track, track_id)
+        except SpotifyException as e:
+            if e.http_status in (400, 404):
+                return None
+            raise
+
+    def _call(self, fn, *args, **kwargs):
+        """Runs one spotipy call under the rate limiter and guard, waiting out 429s (Retry-After)."""
+        for attempt in range(self.MAX_THROTTLED_RETRIES + 1):
+            self.rate_limiter.acquire()
+            try:
+                with self.guard.call():
+                    return fn(*args, **kwargs)
+            except SpotifyException as e:
+                if e.http_status != 429 or attempt == self.MAX_THROTTLED_RETRIES:
+                    raise
+                self.rate_limiter.pause(retry_after_seconds(e.headers))
+
+    def get_tracks(self, spotify_url: str) -> List[SongMetadata]:
+        """
+        Expands a track, album or playlist URL into its tracks.
+        Albums and playlists are read page by page (50/100 items per call).
+        """
+        if not self.sp:
+            raise HTTPException(status_code=500, detail="Spotify credentials not configured.")
+
+        match = SPOTIFY_RESOURCE_RE.search(spotify_url)
+        kind = match.group(1) if match else "track"
+        if kind == "track":
+            return [self.get_metadata(spotify_url)]
+
         try:
-            track = self.sp.track(spotify_url)
+            if kind == "album":
+                album = self._call(self.sp.album, match.group(2))
+                items = self._collect_pages(album['tracks'])
+                return [self._remember(track, album) for track in items]
+
+            page = self._call(self.sp.playlist_items, match.group(2), limit=100, additional_types=('track',))
+            items = self._collect_pages(page)
+            # Playlist entries can be local files, removed tracks or episodes
+            return [
+                self._remember(item['track']) for item in items
+                if item.get('track') and item['track'].get('type') == 'track' and item['track'].get('id')
+            ]
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid Spotify URL or API error: {str(e)}")
 
-        artists = ", ".join([artist['name'] for artist in track['artists']])
-        album_art = track['album']['images'][0]['url'] if track['album']['images'] else None
-
-        return SongMetadata(
-            title=track['name'],
-            artist=artists,
-            album=track['album']['name'],
-            duration_ms=track['duration_ms'],
-            spotify_url=track['external_urls']['spotify'],
-            album_art_url=album_art
-        )
+    def _collect_pages(self, page: dict) -> list:
+        items = list(page['items'])
+        while page.get('next'):
+            page = self._call(self.sp.next, page)
+            items.extend(page['items'])
+        return items
+
+    def _remember(self, track: dict, album: Optional[dict] = None) -> SongMetadata:
+        """Converts a bulk-listed track and seeds the metadata cache with it."""
+        metadata = track_to_metadata(track, album)
+        self.metadata_cache.put(f"spotify:track:{track['id']}", metadata)
+        return metadata
@@ -0,0 +1,125 @@
+import os
+import subprocess
+import threading
+import anyio
+import requests
+from fastapi import HTTPException
+from models import SongMetadata
+from services.audio_formats import FORMATS
+from services.youtube_service import DEFAULT_QUALITY, mp3_encoder_args, mp3_filename, metadata_tags
+
+# Bytes moved per read/write; with the OS pipe buffers this bounds the memory a stream holds
+CHUNK_SIZE = 64 * 1024
+
+
+class TranscodeStream:
+    """
+    Live source -> ffmpeg -> client pipeline for one track.
+
+    A feeder thread copies the source audio into ffmpeg's stdin while the
+    async iterator reads encoded MP3 from its stdout. Every chunk sent to the
+    client is also written to a staging file, which is published to the
+    download cache if (and only if) the whole track was encoded, so the next
+    request for it is served from disk.
+    """
+    def __init__(self, source: dict, cache, filename: str, quality: str = DEFAULT_QUALITY, codec_args: list = None):
+        self.source = source
+        self.cache = cache
+        self.filename = filename
+        self.quality = quality
+        self.codec_args = codec_args or mp3_encoder_args(quality)
+        self.staging_path = cache.staging_path(source["video_id"])
+        self.feed_error = None
+        self.process = None
+
+    def start(self):
+        cmd = [
+            "ffmpeg", "-loglevel", "error",
+            "-i", "pipe:0",
+            *self.codec_args,
+            "-f", "mp3", "pipe:1"
+        ]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        threading.Thread(target=self._feed, name="stream-feed", daemon=True).start()
+        return self
+
+    def _feed(self):
+        try:
+            with requests.get(self.source["url"], headers=self.source["http_headers"], stream=True, timeout=30) as resp:
+                resp.raise_for_status()
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    self.process.stdin.write(chunk)
+        except Exception as e:
+            # BrokenPipeError included: ffmpeg was killed because the client left
+            self.feed_error = e
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def _read_chunk(self, staging) -> bytes:
+        """Next piece of encoded MP3, already written to the staging file."""
+        chunk = self.process.stdout.read(CHUNK_SIZE)
+        if chunk:
+            staging.write(chunk)
+        return chunk
+
+    def _publish(self):
+        key = self.cache.put(self.source["video_id"], "mp3", self.quality, self.staging_path, ext="mp3")
+        self.cache.alias(key, self.filename)
+
+    async def __aiter__(self):
+        complete = False
+        try:
+            # File I/O and the cache stay off the event loop; put() hashes and fsyncs the whole track
+            with open(self.staging_path, "wb") as staging:
+                while True:
+                    chunk = await anyio.to_thread.run_sync(self._read_chunk, staging)
+                    if not chunk:
+                        break
+                    yield chunk
+            returncode = await anyio.to_thread.run_sync(self.process.wait)
+            complete = returncode == 0 and self.feed_error is None
+        finally:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.stdout.close()
+            if complete:
+                # Finished tracks are kept even if the client goes away right at the end
+                with anyio.CancelScope(shield=True):
+                    await anyio.to_thread.run_sync(self._publish)
+            elif os.path.exists(self.staging_path):
+                os.remove(self.staging_path)
+
+
+class StreamService:
+    """Serves a track as MP3 while it is being transcoded, or straight from the cache."""
+    def __init__(self, youtube_service):
+        self.youtube_service = youtube_service
+
+    def open(self, metadata: SongMetadata, video_id: str, video_url: str):
+        """
+        Returns (kind, target, filename): ("file", blob path, ...) for cached
+        tracks, otherwise ("stream", started TranscodeStream, ...).
+        """
+        cache = self.youtube_service.cache
+        filename = mp3_filename(f"{metadata.artist} - {metadata.title}")
+        key = cache.lookup(video_id, "mp3", DEFAULT_QUALITY)
+        if key:
+            path = cache.path_for(key)
+            if path:
+                return "file", path, filename
+
+        codec_args = mp3_encoder_args(DEFAULT_QUALITY)
+        if self.youtube_service.embed_tags:
+            # Only a cover that is already cached: fetching one would delay the first byte
+            cover = self.youtube_service.covers.cached(metadata.album_art_url)
+            codec_args = FORMATS["mp3"].tag_args(codec_args, metadata_tags(metadata), cover)
+        try:
+            source = self.youtube_service.resolve_audio_source(video_url)
+            return "stream", TranscodeStream(source, cache, filename, codec_args=codec_args).start(), filename
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Streaming failed: {str(e)}")
@@ -0,0 +1,86 @@
+import time
+from contextlib import contextmanager
+from opentelemetry import trace
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+tracer = trace.get_tracer("miravaz-spotify2mp3")
+
+# Downloads and encodes of long tracks run well past the default 10s top bucket
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "spotify2mp3_stage_seconds", "Wall time of one pipeline stage",
+    ["stage", "source", "outcome"], buckets=STAGE_BUCKETS
+)
+CACHE_LOOKUPS = Counter(
+    "spotify2mp3_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"]
+)
+DOWNLOAD_BYTES = Counter("spotify2mp3_download_bytes_total", "Source audio bytes fetched from YouTube")
+TRANSCODE_SPEED = Histogram(
+    "spotify2mp3_transcode_speed_ratio", "Seconds of audio converted per wall-clock second",
+    ["mode"], buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+
+
+@contextmanager
+def stage(name: str, source: str = "", **attributes):
+    """
+    Child span plus a spotify2mp3_stage_seconds sample around one pipeline
+    step (metadata, token, search, download, transcode). Yields the span
+    so the step can attach what it learns (bytes, durations, cache result).
+    """
+    outcome = "ok"
+    start = time.perf_counter()
+    with tracer.start_as_current_span(name, attributes={"pipeline.stage": name, "source": source, **attributes}) as span:
+        try:
+            yield span
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            STAGE_SECONDS.labels(name, source, outcome).observe(time.perf_counter() - start)
+
+
+def cache_result(cache: str, hit: bool):
+    """Counts a lookup and tags the current span (normally the enclosing stage) with the result."""
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+    trace.get_current_span().set_attribute(f"cache.{cache}.hit", hit)
+
+
+def record_download(span, num_bytes: int):
+    DOWNLOAD_BYTES.inc(num_bytes)
+    span.set_attribute("download.bytes", num_bytes)
+
+
+def record_transcode(span, mode: str, audio_seconds: float, wall_seconds: float, cpu_seconds: float):
+    span.set_attribute("transcode.mode", mode)
+    span.set_attribute("audio.duration_seconds", audio_seconds)
+    span.set_attribute("transcode.cpu_seconds", cpu_seconds or 0.0)
+    if audio_seconds and wall_seconds > 0:
+        ratio = audio_seconds / wall_seconds
+        span.set_attribute("transcode.speed_ratio", ratio)
+        TRANSCODE_SPEED.labels(mode).observe(ratio)
+
+
+class StatsCollector:
+    """Exposes the numeric fields of a service's stats() dict as gauges, read at scrape time."""
+    def __init__(self, prefix: str, stats_fn):
+        self.prefix = prefix
+        self.stats_fn = stats_fn
+
+    def collect(self):
+        for key, value in self.stats_fn().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            yield GaugeMetricFamily(f"spotify2mp3_{self.prefix}_{key}", f"{self.prefix} {key}", value=value)
+
+
+def register_stats(prefix: str, stats_fn):
+    REGISTRY.register(StatsCollector(prefix, stats_fn))
+
+
+def render_metrics() -> bytes:
+    return generate_latest(REGISTRY)
@@ -1,21 +1,104 @@
 import requests
 import os
 import base64
+import re
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from fastapi import HTTPException
 from models import SongMetadata
+from services.metadata_cache import MetadataCache
+from services.telemetry import stage, cache_result
+from services.upstream_guard import build_guard
+
+# tidal.com/browse/<kind>/<id>, listen.tidal.com/<kind>/<id>; playlist IDs are UUIDs
+TIDAL_RESOURCE_RE = re.compile(r"/(track|album|playlist)/([0-9A-Za-z-]+)")
+
+
+# Cover art hangs off the album, so it needs the nested include
+TRACK_INCLUDE = os.environ.get("TIDAL_TRACK_INCLUDE", "artists,albums,albums.coverArt")
+
+
+def index_included(included: list) -> dict:
+    """(type, id) -> resource over a JSON:API 'included' list, built once per payload."""
+    return {(item.get("type"), item.get("id")): item for item in included}
+
+
+# Answers worth retrying (with backoff, honouring Retry-After)
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+def canonical_track_id(url: str) -> Optional[str]:
+    """'tidal:track:<id>' for any track URL spelling (/browse/, /u suffix, query strings), else None."""
+    match = TIDAL_RESOURCE_RE.search(url)
+    if match and match.group(1) == "track":
+        return f"tidal:track:{match.group(2)}"
+    return None
 
 class TidalService:
+    # Upper bound on IDs per filter[id] request
+    BATCH_SIZE = 20
+
     def __init__(self):
-        self.auth_url = "https://auth.tidal.com/v1/oauth2/token"
-        self.base_url = "https://openapi.tidal.com/v2"
+        self.auth_url = os.environ.get("TIDAL_AUTH_URL", "https://auth.tidal.com/v1/oauth2/token")
+        self.base_url = os.environ.get("TIDAL_API_URL", "https://openapi.tidal.com/v2")
         self.client_id = os.environ.get("TIDAL_CLIENT_ID")
         self.client_secret = os.environ.get("TIDAL_CLIENT_SECRET")
         self.token = None
+        self.token_expires_at = 0.0
+        # Refresh this many seconds before the token actually expires
+        self.token_refresh_margin = int(os.environ.get("TIDAL_TOKEN_REFRESH_MARGIN", "60"))
+        self.timeout = float(os.environ.get("TIDAL_TIMEOUT", "10"))
+        self.max_retries = int(os.environ.get("TIDAL_MAX_RETRIES", "3"))
+        self._token_lock = threading.Lock()
+        self._refresh_timer = None
+        self.session = self._build_session()
+        self.metadata_cache = MetadataCache("tidal")
+        # Adaptive concurrency limit and circuit breaker, shared with AsyncTidalService.
+        # Batch and playlist lookups queue for it on threadpool threads, so they give up quickly.
+        self.guard = build_guard("Tidal", "TIDAL", concurrency=10,
+                                 max_concurrency=int(os.environ.get("TIDAL_POOL_SIZE", "20")),
+                                 latency_target_ms=2000, queue_timeout=1)
+
+    def _build_session(self) -> requests.Session:
+        """Shared keep-alive session; retries 429/5xx with backoff (honouring Retry-After)."""
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=0.5,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=["GET", "POST"],
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        pool_size = int(os.environ.get("TIDAL_POOL_SIZE", "20"))
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def current_token(self) -> Optional[str]:
+        """The cached token while it is still good to use, else None; never fetches."""
+        if self.token and time.time() < self.token_expires_at - self.token_refresh_margin:
+            return self.token
+        return None
 
     def _get_token(self) -> str:
         if not self.client_id or not self.client_secret:
              raise HTTPException(status_code=500, detail="TIDAL_CLIENT_ID and TIDAL_CLIENT_SECRET must be set")
 
+        if self.current_token():
+            return self.token
+
+        # Only one caller refreshes; the rest wait and reuse its token
+        with self._token_lock:
+            if self.token and time.time() < self.token_expires_at - self.token_refresh_margin:
+                return self.token
+            return self._fetch_token()
+
+    def _fetch_token(self) -> str:
         # Encode credentials
         creds = f"{self.client_id}:{self.client_secret}"
         b64_creds = base64.b64encode(creds.encode()).decode()
@@ -29,102 +112,241 @@ class TidalService:
         }
 
         try:
-            resp = requests.post(self.auth_url, data=data, headers=headers)
-            resp.raise_for_status()
-            return resp.json()["access_token"]
+            with stage("token", source="tidal"):
+                with self.guard.call():
+                    resp = self.session.post(self.auth_url, data=data, headers=headers, timeout=self.timeout)
+                    resp.raise_for_status()
+                body = resp.json()
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to authenticate with Tidal: {str(e)}")
 
-    def get_metadata(self, url: str) -> SongMetadata:
+        expires_in = int(body.get("expires_in", 3600))
+        self.token = body["access_token"]
+        self.token_expires_at = time.time() + expires_in
+        self._schedule_refresh(expires_in)
+        return self.token
+
+    def _schedule_refresh(self, expires_in: int):
+        """Refreshes in the background shortly before expiry so requests never wait on auth."""
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+        delay = max(expires_in - 2 * self.token_refresh_margin, 1)
+        self._refresh_timer = threading.Timer(delay, self._background_refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _background_refresh(self):
+        try:
+            with self._token_lock:
+                self._fetch_token()
+        except HTTPException as e:
+            # The current token stays valid until the margin; callers retry on demand
+            print(f"WARNING: Tidal token refresh failed: {e.detail}")
+
+    def _api_get(self, url: str, params: dict = None) -> dict:
+        """GET against the Tidal API with the cached token; retries once on 401."""
+        for attempt in range(2):
+            headers = {
+                "Authorization": f"Bearer {self._get_token()}",
+                "Accept": "application/vnd.api+json"
+            }
+            with self.guard.call():
+                resp = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+                if resp.status_code == 401 and attempt == 0:
+                    # Revoked or rotated early: drop it and fetch a fresh one
+                    self.token = None
+                    continue
+                resp.raise_for_status()
+            return resp.json()
+
+    @staticmethod
+    def parse_track_url(url: str) -> Tuple[Optional[str], str]:
+        """(cache key or None, track ID); URLs the pattern misses fall back to their last path segment."""
+        key = canonical_track_id(url)
+        if key:
+            return key, key.rsplit(":", 1)[1]
         try:
             track_id = url.split("/")[-1]
             if not track_id.isdigit():
                  track_id = track_id.split("?")[0]
         except:
              raise HTTPException(status_code=400, detail="Invalid Tidal URL format")
+        return None, track_id
 
-        token = self._get_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/vnd.api+json" 
-        }
+    def get_metadata(self, url: str) -> SongMetadata:
+        key, track_id = self.parse_track_url(url)
+        return self.metadata_cache.get_or_load(key, lambda: self._fetch_metadata(track_id, url))
+
+    def _fetch_metadata(self, track_id: str, url: str) -> SongMetadata:
+        # Surface auth problems as such rather than as a generic API error
+        self._get_token()
 
         try:
             # V2 Endpoint with includes
             # Docs confirm 'albums' (plural) for include param
-            api_url = f"{self.base_url}/tracks/{track_id}?countryCode=US&include=artists,albums"
-            
-            resp = requests.get(api_url, headers=headers)
-            resp.raise_for_status()
-            
-            payload = resp.json()
+            api_url = f"{self.base_url}/tracks/{track_id}"
+
+            payload = self._api_get(api_url, params={"countryCode": "US", "include": TRACK_INCLUDE})
             if "data" not in payload:
                  raise ValueError("Invalid API response format")
-            
-            data = payload["data"]
-            attributes = data.get("attributes", {})
-            relationships = data.get("relationships", {})
-            included = payload.get("included", [])
-
-            # Helper to find included resource
-            def find_included(rtype, rid):
-                for item in included:
-                    if item.get("type") == rtype and item.get("id") == rid:
-                        return item
-                return None
-
-            title = attributes.get("title", "Unknown Title")
-            
-            # Resolve Album
-            album_name = "Unknown Album"
-            if "albums" in relationships:
-                # 'data' is array for to-many
-                rel_data = relationships["albums"].get("data", [])
-                if rel_data and len(rel_data) > 0:
-                    album_obj = find_included("albums", rel_data[0]["id"])
-                    if album_obj:
-                         album_name = album_obj.get("attributes", {}).get("title", "Unknown Album")
-
-            # Resolve Artist
-            artist_name = "Unknown Artist"
-            if "artists" in relationships:
-                # 'data' is array for to-many
-                rel_data = relationships["artists"].get("data", [])
-                if rel_data and len(rel_data) > 0:
-                    # Just take the first one
-                    artist_obj = find_included("artists", rel_data[0]["id"])
-                    if artist_obj:
-                        artist_name = artist_obj.get("attributes", {}).get("name", "Unknown Artist")
-
-            # Fallback if lookup failed but attributes has it (V2 sometimes denormalizes)
-            if artist_name == "Unknown Artist" and "artistName" in attributes:
-                 artist_name = attributes["artistName"]      
-            if album_name == "Unknown Album" and "album" in attributes and isinstance(attributes["album"], str): # improbable in V2 but safe
-                 album_name = attributes["album"]
-
-
-            # Duration
-            duration_iso = attributes.get("duration", "PT0S")
-            duration_ms = self._parse_iso_duration(duration_iso)
-            
-            # Album Art - usually in album attributes 'imageLinks' or similar in V2? 
-            # Or constructed: https://resources.tidal.com/images/{uuid}/origin.jpg
-            # Let's check the album object for cover
-            album_art_url = None
-            # (Parsing album art logic is complex without seeing exact V2 structure for images, leaving null for now unless easy)
-
-            return SongMetadata(
-                title=title,
-                artist=artist_name,
-                album=album_name,
-                duration_ms=duration_ms,
-                tidal_url=url,
-                album_art_url=album_art_url
-            )
 
+            return self._parse_track(payload["data"], index_included(payload.get("included", [])), url)
+
+        except HTTPException:
+            raise
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                raise HTTPException(status_code=404, detail="Tidal track not found")
+            raise HTTPException(status_code=500, detail=f"Tidal API Error: {str(e)}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Tidal API Error: {str(e)}")
 
+    def get_tracks(self, url: str) -> List[SongMetadata]:
+        """
+        Expands a track, album or playlist URL into its tracks.
+        Track IDs come from the paginated relationship endpoint, then the
+        tracks themselves are fetched BATCH_SIZE at a time via filter[id].
+        """
+        match = TIDAL_RESOURCE_RE.search(url)
+        kind = match.group(1) if match else "track"
+        if kind == "track":
+            return [self.get_metadata(url)]
+
+        # Surface auth problems as such rather than as a generic API error
+        self._get_token()
+
+        try:
+            collection = "albums" if kind == "album" else "playlists"
+            next_url = f"{self.base_url}/{collection}/{match.group(2)}/relationships/items?countryCode=US"
+            track_ids = []
+            while next_url:
+                page = self._api_get(next_url)
+                track_ids.extend(item["id"] for item in page.get("data", []) if item.get("type") == "tracks")
+                next_url = page.get("links", {}).get("next")
+                if next_url and next_url.startswith("/"):
+                    next_url = f"{self.base_url}{next_url}"
+
+            by_id = self.get_tracks_by_ids(track_ids)
+
+            # Keep album/playlist order; unavailable tracks are dropped
+            return [by_id[tid] for tid in track_ids if tid in by_id]
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Tidal API Error: {str(e)}")
+
+    def get_metadata_batch(self, urls: List[str]) -> List[Optional[SongMetadata]]:
+        """get_metadata for many track URLs in ceil(n / BATCH_SIZE) requests; None where unavailable."""
+        keys = [canonical_track_id(url) for url in urls]
+        invalid = [url for url, key in zip(urls, keys) if key is None]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Not a Tidal track URL: {invalid[0]}")
+
+        try:
+            by_id = self.get_tracks_by_ids([key.rsplit(":", 1)[1] for key in keys])
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Tidal API Error: {str(e)}")
+        return [by_id.get(key.rsplit(":", 1)[1]) for key in keys]
+
+    def get_tracks_by_ids(self, track_ids: List[str]) -> Dict[str, SongMetadata]:
+        """
+        Resolves track IDs to SongMetadata, serving what it can from the
+        metadata cache and fetching the rest BATCH_SIZE at a time via
+        filter[id]. IDs Tidal does not return are left out.
+        """
+        by_id = {}
+        missing = []
+        for track_id in dict.fromkeys(track_ids):
+            cached = self.metadata_cache.get(f"tidal:track:{track_id}")
+            if isinstance(cached, SongMetadata):
+                by_id[track_id] = cached
+            elif cached is None:
+                missing.append(track_id)
+        cache_result("metadata", not missing)
+        if not missing:
+            return by_id
+
+        # Surface auth problems as such rather than as a generic API error
+        self._get_token()
+
+        for i in range(0, len(missing), self.BATCH_SIZE):
+            chunk = missing[i:i + self.BATCH_SIZE]
+            with stage("metadata", source="tidal", batch_size=len(chunk)):
+                payload = self._api_get(
+                    f"{self.base_url}/tracks",
+                    params={"countryCode": "US", "include": TRACK_INCLUDE, "filter[id]": ",".join(chunk)}
+                )
+            index = index_included(payload.get("included", []))
+            for data in payload.get("data", []):
+                metadata = self._parse_track(data, index, f"https://tidal.com/browse/track/{data['id']}")
+                self.metadata_cache.put(f"tidal:track:{data['id']}", metadata)
+                by_id[data["id"]] = metadata
+            for track_id in chunk:
+                if track_id not in by_id:
+                    self.metadata_cache.put_negative(f"tidal:track:{track_id}", 404, "Tidal track not found")
+        return by_id
+
+    def _parse_track(self, data: dict, index: dict, url: str) -> SongMetadata:
+        """Builds SongMetadata from a track resource and the payload's index_included() map."""
+        attributes = data.get("attributes", {})
+        relationships = data.get("relationships", {})
+
+        def related(resource, name):
+            # 'data' is an array for to-many relationships
+            rel_data = resource.get("relationships", {}).get(name, {}).get("data") or []
+            found = (index.get((ref.get("type"), ref.get("id"))) for ref in rel_data)
+            return [item for item in found if item is not None]
+
+        title = attributes.get("title", "Unknown Title")
+
+        # Resolve Album (and its cover, from the same included album object)
+        album_name = "Unknown Album"
+        album_art_url = None
+        albums = related(data, "albums")
+        if albums:
+            album_name = albums[0].get("attributes", {}).get("title", "Unknown Album")
+            album_art_url = self._album_art_url(albums[0], related(albums[0], "coverArt"))
+
+        # Resolve Artists, joined like the Spotify side does
+        names = [a.get("attributes", {}).get("name") for a in related(data, "artists")]
+        artist_name = ", ".join(n for n in names if n) or "Unknown Artist"
+
+        # Fallback if lookup failed but attributes has it (V2 sometimes denormalizes)
+        if artist_name == "Unknown Artist" and "artistName" in attributes:
+             artist_name = attributes["artistName"]
+        if album_name == "Unknown Album" and "album" in attributes and isinstance(attributes["album"], str): # improbable in V2 but safe
+             album_name = attributes["album"]
+
+        # Duration
+        duration_iso = attributes.get("duration", "PT0S")
+        duration_ms = self._parse_iso_duration(duration_iso)
+
+        return SongMetadata(
+            title=title,
+            artist=artist_name,
+            album=album_name,
+            duration_ms=duration_ms,
+            tidal_url=url,
+            album_art_url=album_art_url,
+            isrc=attributes.get("isrc")
+        )
+
+    @staticmethod
+    def _album_art_url(album: dict, artworks: list) -> Optional[str]:
+        """Largest cover image: album 'imageLinks', else the included coverArt artwork 'files'."""
+        links = album.get("attributes", {}).get("imageLinks") or []
+        for artwork in artworks:
+            links = links or artwork.get("attributes", {}).get("files") or []
+        links = [link for link in links if link.get("href")]
+        if not links:
+            return None
+        return max(links, key=lambda link: (link.get("meta") or {}).get("width") or 0)["href"]
+
     def _parse_iso_duration(self, duration_str: str) -> int:
         """Parses ISO 8601 duration (e.g. PT3M25S) to milliseconds"""
         import re
@@ -0,0 +1,291 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from typing import AsyncIterator, Iterable, Iterator, Optional
+import anyio
+from services.shared_state import get_shared_state
+
+SOURCE_ID_RE = re.compile(r"^(?:spotify|tidal):track:[A-Za-z0-9]+$")
+VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+ISRC_RE = re.compile(r"^[A-Z0-9]{12}$")
+IMPORT_BATCH = 1000
+MAX_IMPORT_ERRORS = 20
+
+
+def normalize_isrc(isrc: Optional[str]) -> Optional[str]:
+    """ISRCs are written with or without hyphens and in either case; None if it is not one."""
+    if not isrc:
+        return None
+    isrc = isrc.replace("-", "").strip().upper()
+    return isrc if ISRC_RE.match(isrc) else None
+
+
+class TrackIndex:
+    """
+    Persistent map from a source track ('spotify:track:<id>',
+    'tidal:track:<id>') to the YouTube video it was matched to, with the
+    match confidence and when the match was made. ConvertService looks a
+    track up here before searching, so each track is searched for once per
+    index instead of once per conversion.
+
+    Entries carry the ISRC when the source provides one, so the same
+    recording reached through the other service resolves without a search
+    too (and is then indexed under its own ID).
+
+    One SQLite table (WITHOUT ROWID, keyed by source ID, ISRC indexed)
+    covers every worker on the host; with a cluster-wide SharedState new
+    matches are also published there and adopted by replicas that miss.
+    export() / import_lines() move the index as NDJSON, one entry per line,
+    so a fresh node can be warmed from a snapshot.
+    """
+    def __init__(self, path: str = None, state=None):
+        path = path or os.environ.get("TRACK_INDEX_PATH") or os.path.join(
+            os.path.dirname(os.environ.get("CACHE_INDEX_PATH", "/app/cache/index.db")), "track_index.db")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS tracks (
+                source_id TEXT PRIMARY KEY,
+                isrc TEXT,
+                video_id TEXT NOT NULL,
+                confidence REAL,
+                matched_at INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS tracks_by_isrc ON tracks(isrc) WHERE isrc IS NOT NULL;
+            CREATE INDEX IF NOT EXISTS tracks_by_video ON tracks(video_id);
+        """)
+
+        state = state if state is not None else get_shared_state()
+        self._cluster = state if state.scope == "cluster" else None
+
+        self.hits = 0
+        self.isrc_hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self.forgotten = 0
+        self.imported = 0
+
+    def lookup(self, source_id: Optional[str], isrc: Optional[str] = None,
+               min_confidence: float = 0.0) -> Optional[dict]:
+        """
+        The entry for source_id, else the best entry for the same ISRC, as
+        {"video_id", "confidence", "matched_at"}; None on a miss. Entries
+        below min_confidence count as misses, so raising the threshold
+        re-searches weak matches.
+        """
+        isrc = normalize_isrc(isrc)
+        entry = via_isrc = None
+        if source_id:
+            entry = self._get("SELECT video_id, confidence, matched_at FROM tracks WHERE source_id = ?", source_id)
+            if entry is None and self._cluster is not None:
+                entry = self._adopt(f"trackmap:{source_id}", source_id)
+        if entry is None and isrc:
+            entry = self._get("SELECT video_id, confidence, matched_at FROM tracks WHERE isrc = ? "
+                              "ORDER BY confidence DESC LIMIT 1", isrc)
+            if entry is None and self._cluster is not None:
+                entry = self._adopt(f"trackmap:isrc:{isrc}")
+            via_isrc = entry is not None
+        if entry is not None and (entry["confidence"] or 0.0) < min_confidence:
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.isrc_hits += bool(via_isrc)
+        if via_isrc and source_id:
+            self._upsert([(source_id, isrc, entry["video_id"], entry["confidence"], entry["matched_at"])], newer=True)
+        return entry
+
+    def _get(self, sql: str, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(sql, (key,)).fetchone()
+        return {"video_id": row[0], "confidence": row[1], "matched_at": row[2]} if row else None
+
+    def _adopt(self, state_key: str, source_id: str = None) -> Optional[dict]:
+        """Indexes a match another replica published."""
+        payload = self._cluster.get(state_key)
+        if payload is None:
+            return None
+        entry = self._parse(json.loads(payload))
+        if source_id is not None:
+            self._upsert([(source_id,) + entry[1:]], newer=True)
+        return {"video_id": entry[2], "confidence": entry[3], "matched_at": entry[4]}
+
+    def record(self, source_id: str, isrc: Optional[str], video_id: str, confidence: Optional[float]):
+        """Stores a fresh match, replacing whatever the track was mapped to."""
+        isrc = normalize_isrc(isrc)
+        row = (source_id, isrc, video_id, confidence, int(time.time()))
+        self._upsert([row], newer=False)
+        with self._lock:
+            self.recorded += 1
+        if self._cluster is not None:
+            payload = json.dumps(self._line(row))
+            self._cluster.set(f"trackmap:{source_id}", payload)
+            if isrc:
+                self._cluster.set(f"trackmap:isrc:{isrc}", payload)
+
+    def forget_video(self, video_id: str) -> int:
+        """Drops every mapping to a video that can no longer be downloaded; returns how many."""
+        with self._lock:
+            rows = self._db.execute("SELECT source_id, isrc FROM tracks WHERE video_id = ?", (video_id,)).fetchall()
+            self._db.execute("DELETE FROM tracks WHERE video_id = ?", (video_id,))
+            self.forgotten += len(rows)
+        if self._cluster is not None:
+            for source_id, isrc in rows:
+                self._cluster.delete(f"trackmap:{source_id}")
+                if isrc:
+                    self._cluster.delete(f"trackmap:isrc:{isrc}")
+        return len(rows)
+
+    def _upsert(self, rows: list, newer: bool) -> int:
+        """Inserts or replaces rows; with newer=True an existing entry is only replaced by a later match."""
+        sql = ("INSERT INTO tracks (source_id, isrc, video_id, confidence, matched_at) VALUES (?, ?, ?, ?, ?) "
+               "ON CONFLICT(source_id) DO UPDATE SET isrc = COALESCE(excluded.isrc, tracks.isrc), "
+               "video_id = excluded.video_id, confidence = excluded.confidence, matched_at = excluded.matched_at")
+        if newer:
+            sql += " WHERE excluded.matched_at > tracks.matched_at"
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                before = self._db.total_changes
+                self._db.executemany(sql, rows)
+                changed = self._db.total_changes - before
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return changed
+
+    @staticmethod
+    def _line(row: tuple) -> dict:
+        source_id, isrc, video_id, confidence, matched_at = row
+        line = {"source_id": source_id, "video_id": video_id, "confidence": confidence, "matched_at": matched_at}
+        if isrc:
+            line["isrc"] = isrc
+        return line
+
+    @staticmethod
+    def _parse(entry: dict) -> tuple:
+        """Validated (source_id, isrc, video_id, confidence, matched_at) from an exported line."""
+        source_id, video_id = entry.get("source_id"), entry.get("video_id")
+        if not isinstance(source_id, str) or not SOURCE_ID_RE.match(source_id):
+            raise ValueError(f"bad source_id {source_id!r}")
+        if not isinstance(video_id, str) or not VIDEO_ID_RE.match(video_id):
+            raise ValueError(f"bad video_id {video_id!r}")
+        confidence = entry.get("confidence")
+        if confidence is not None and (isinstance(confidence, bool) or not isinstance(confidence, (int, float))
+                                       or not 0.0 <= confidence <= 1.0):
+            raise ValueError(f"bad confidence {confidence!r}")
+        matched_at = entry.get("matched_at")
+        if isinstance(matched_at, bool) or not isinstance(matched_at, (int, float)) or matched_at < 0:
+            raise ValueError(f"bad matched_at {matched_at!r}")
+        return source_id, normalize_isrc(entry.get("isrc")), video_id, confidence, int(matched_at)
+
+    def export(self, batch: int = IMPORT_BATCH) -> Iterator[str]:
+        """Every entry as an NDJSON line, in source ID order, read one batch at a time."""
+        after = ""
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT source_id, isrc, video_id, confidence, matched_at FROM tracks "
+                    "WHERE source_id > ? ORDER BY source_id LIMIT ?", (after, batch)
+                ).fetchall()
+            if not rows:
+                return
+            yield "".join(json.dumps(self._line(row), separators=(",", ":")) + "\n" for row in rows)
+            after = rows[-1][0]
+
+    def import_lines(self, lines: Iterable, first_line: int = 1) -> dict:
+        """
+        Merges exported NDJSON lines (str or bytes) into the index; on a
+        conflict the later match wins. Returns counts of imported,
+        unchanged (already as new) and invalid lines, with the first errors.
+        """
+        result = {"imported": 0, "unchanged": 0, "invalid": 0, "errors": []}
+        rows = []
+
+        def flush():
+            changed = self._upsert(rows, newer=True)
+            result["imported"] += changed
+            result["unchanged"] += len(rows) - changed
+            rows.clear()
+
+        for number, line in enumerate(lines, first_line):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                if not isinstance(entry, dict):
+                    raise ValueError("not an object")
+                rows.append(self._parse(entry))
+            except ValueError as e:
+                result["invalid"] += 1
+                if len(result["errors"]) < MAX_IMPORT_ERRORS:
+                    result["errors"].append(f"line {number}: {e}")
+                continue
+            if len(rows) >= IMPORT_BATCH:
+                flush()
+        if rows:
+            flush()
+        with self._lock:
+            self.imported += result["imported"]
+        return result
+
+    async def import_stream(self, chunks: AsyncIterator[bytes]) -> dict:
+        """import_lines() for a request body, a batch of lines at a time off the event loop."""
+        total = {"imported": 0, "unchanged": 0, "invalid": 0, "errors": []}
+        buffered, lines, line_no = b"", [], 1
+
+        async def flush():
+            nonlocal line_no
+            result = await anyio.to_thread.run_sync(self.import_lines, list(lines), line_no)
+            line_no += len(lines)
+            lines.clear()
+            for key in ("imported", "unchanged", "invalid"):
+                total[key] += result[key]
+            total["errors"] = (total["errors"] + result["errors"])[:MAX_IMPORT_ERRORS]
+
+        async for chunk in chunks:
+            buffered += chunk
+            *complete, buffered = buffered.split(b"\n")
+            lines.extend(complete)
+            if len(lines) >= IMPORT_BATCH:
+                await flush()
+        if buffered:
+            lines.append(buffered)
+        if lines:
+            await flush()
+        return total
+
+    def import_file(self, path: str) -> dict:
+        with open(path, "rb") as fh:
+            result = self.import_lines(fh)
+        print(f"Track index: imported {result['imported']} entries from {path} "
+              f"({result['unchanged']} unchanged, {result['invalid']} invalid)")
+        return result
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0],
+                "hits": self.hits,
+                "isrc_hits": self.isrc_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "recorded": self.recorded,
+                "forgotten": self.forgotten,
+                "imported": self.imported,
+            }
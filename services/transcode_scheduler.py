@@ -0,0 +1,144 @@
+import os
+import math
+import time
+import queue
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from services.youtube_service import transcode_audio
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_JOB = 5
+PRIORITY_BATCH = 10
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_JOB: "job", PRIORITY_BATCH: "batch"}
+
+
+def available_cpus() -> int:
+    """
+    CPUs this process may actually use: the affinity mask, further capped by
+    a cgroup CPU quota (v2 cpu.max or v1 cfs_quota/period) when running in a
+    container with --cpus.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as fh:
+            limit, period = fh.read().split()
+            if limit != "max":
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as fh:
+                limit = int(fh.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as fh:
+                period = int(fh.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+class TranscodeScheduler:
+    """
+    Runs ffmpeg jobs off the request path, at most `workers` at a time.
+
+    Jobs wait in a priority queue (interactive < job < batch, FIFO within a
+    level) and `workers` dispatcher threads hand them one by one to a
+    process pool of the same size, so a playlist burst can never start more
+    ffmpeg processes than there are cores and single-track requests overtake
+    queued batch work.
+    """
+    def __init__(self, workers: int = None):
+        self.workers = workers or int(os.environ.get("TRANSCODE_WORKERS", "0")) or available_cpus()
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._threads = []
+        self.running = 0
+        self.stats_by_priority = {}
+
+    def _start(self):
+        with self._lock:
+            if self._pool is not None:
+                return
+            # forkserver: children are not forked from this multi-threaded process
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"))
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._dispatch, name=f"transcode-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, src_path: str, dst_path: str, codec_args: list = None,
+               priority: int = PRIORITY_BATCH) -> Future:
+        self._start()
+        future = Future()
+        self._queue.put((priority, next(self._seq), time.monotonic(), (src_path, dst_path, codec_args), future))
+        return future
+
+    def transcoder(self, priority: int):
+        """A (src, dst, codec_args) -> cpu seconds callable for YouTubeService.download_file."""
+        return lambda src, dst, codec_args=None: self.submit(src, dst, codec_args, priority).result()
+
+    def _dispatch(self):
+        while True:
+            priority, _, enqueued_at, args, future = self._queue.get()
+            if future is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            started_at = time.monotonic()
+            with self._lock:
+                self.running += 1
+            try:
+                future.set_result(self._pool.submit(transcode_audio, *args).result())
+                failed = False
+            except BaseException as e:
+                future.set_exception(e)
+                failed = True
+            finally:
+                with self._lock:
+                    self.running -= 1
+            self._record(priority, started_at - enqueued_at, time.monotonic() - started_at, failed)
+
+    def _record(self, priority: int, wait: float, run: float, failed: bool):
+        with self._lock:
+            s = self.stats_by_priority.setdefault(PRIORITY_NAMES.get(priority, str(priority)), {
+                "completed": 0, "failed": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+                "run_seconds_total": 0.0, "run_seconds_max": 0.0,
+            })
+            s["failed" if failed else "completed"] += 1
+            s["wait_seconds_total"] += wait
+            s["wait_seconds_max"] = max(s["wait_seconds_max"], wait)
+            s["run_seconds_total"] += run
+            s["run_seconds_max"] = max(s["run_seconds_max"], run)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self._queue.qsize(),
+                "running": self.running,
+                "by_priority": {
+                    name: {k: round(v, 3) if isinstance(v, float) else v for k, v in s.items()}
+                    for name, s in self.stats_by_priority.items()
+                },
+            }
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put((math.inf, next(self._seq), 0.0, None, None))
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
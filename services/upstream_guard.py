@@ -0,0 +1,379 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional
+from fastapi import HTTPException
+
+# How one upstream call went, as far as the limiter and breaker care
+OK, SLOW, THROTTLED, FAILED = "ok", "slow", "throttled", "failed"
+
+
+def status_of(exc: BaseException) -> Optional[int]:
+    """HTTP status carried by a requests/httpx/spotipy/yt-dlp/FastAPI error, if any."""
+    for attr in ("status_code", "http_status", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def classify_status(status: int) -> str:
+    if status == 429:
+        return THROTTLED
+    return FAILED if status >= 500 else OK
+
+
+def classify_exception(exc: BaseException) -> Optional[str]:
+    """
+    Outcome of a call that raised: 4xx answers mean the provider is fine
+    (bad ID, not found), 429 is throttling, and 5xx, timeouts and
+    connection errors are failures. None for cancellation, which says
+    nothing about the provider.
+    """
+    if not isinstance(exc, Exception):
+        return None
+    status = status_of(exc)
+    return FAILED if status is None else classify_status(status)
+
+
+class _Waiter:
+    __slots__ = ("wake", "granted")
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one upstream.
+
+    Every successful call under `latency_target` grows the limit by
+    1/limit (about one slot per limit's worth of calls, and only while the
+    limit is actually in use); a failure, a 429 or a call slower than
+    `latency_target` halves it (by `backoff`), at most once per generation
+    of calls, so a burst of timeouts from requests that were all in flight
+    together counts as one signal.
+
+    Callers over the limit queue for up to `queue_timeout` seconds and then
+    get a 503, as does anyone arriving while `max_queue` are waiting: a
+    slow provider costs a bounded number of threads instead of all of them.
+    Thread-safe; acquire() blocks the thread, acquire_async() awaits.
+    """
+    def __init__(self, name: str, initial: int, max_limit: int, min_limit: int = 1,
+                 latency_target: Optional[float] = None, backoff: float = 0.5, queue_timeout: float = 5.0,
+                 max_queue: int = 100):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        self._decreased_at = 0.0
+        self.decreases = 0
+        self.rejected = 0
+        self.latency_ewma = None
+
+    def _capacity(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def _overloaded(self) -> HTTPException:
+        return HTTPException(status_code=503, detail=f"{self.name} is overloaded, retry later",
+                             headers={"Retry-After": "1"})
+
+    def _enter(self, wake) -> Optional[_Waiter]:
+        """Takes a slot (returns None) or queues a waiter that wake() notifies once it has one."""
+        with self._lock:
+            if not self._waiters and self.in_flight < self._capacity():
+                self.in_flight += 1
+                return None
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise self._overloaded()
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter: _Waiter, timed_out: bool = True) -> bool:
+        """For a waiter giving up: True if a slot was handed to it meanwhile (it must be released)."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            self.rejected += timed_out
+            return False
+
+    def acquire(self):
+        event = threading.Event()
+        waiter = self._enter(event.set)
+        if waiter is not None and not event.wait(self.queue_timeout) and not self._abandon(waiter):
+            raise self._overloaded()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = self._enter(lambda: loop.call_soon_threadsafe(_resolve, future))
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(waiter):
+                raise self._overloaded()
+        except BaseException:
+            # Cancelled (client went away) while queued
+            if self._abandon(waiter, timed_out=False):
+                self.release(None, None, 0.0)
+            raise
+
+    def release(self, outcome: Optional[str], started: Optional[float], latency: float):
+        """Frees a slot and feeds the call's outcome (None: no signal) into the limit."""
+        with self._lock:
+            if outcome == OK:
+                self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+                if self.in_flight * 2 >= self._capacity():
+                    self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            elif outcome is not None and started >= self._decreased_at:
+                self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                self._decreased_at = time.monotonic()
+                self.decreases += 1
+            self.in_flight -= 1
+            woken = []
+            while self._waiters and self.in_flight < self._capacity():
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                self.in_flight += 1
+                woken.append(waiter)
+        for waiter in woken:
+            waiter.wake()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "max_limit": self.max_limit,
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "decreases": self.decreases,
+                "rejected": self.rejected,
+                "latency_ewma_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+            }
+
+
+class CircuitBreaker:
+    """
+    Opens when at least `failure_ratio` of the last `window` calls (and
+    no fewer than `min_calls`) failed. While open, calls fail at once with
+    a 503 and a Retry-After; after `cooldown` seconds a single probe call is
+    let through, whose outcome closes the breaker or opens it again.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 10, failure_ratio: float = 0.5,
+                 cooldown: float = 30.0):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._outcomes = deque(maxlen=window)
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    def _unavailable(self, retry_after: float) -> HTTPException:
+        return HTTPException(status_code=503, detail=f"{self.name} is unavailable, retry later",
+                             headers={"Retry-After": str(int(retry_after) + 1)})
+
+    def before(self) -> bool:
+        """Raises 503 while open; True if this call is the half-open probe."""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise self._unavailable(remaining)
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    raise self._unavailable(0)
+                self._probing = True
+                return True
+            return False
+
+    def record(self, failed: Optional[bool], probe: bool):
+        """failed=None: the call never reached the provider (or was cancelled)."""
+        with self._lock:
+            if probe:
+                self._probing = False
+                if failed:
+                    self._open()
+                elif failed is not None:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                return
+            # Calls that started before the breaker opened say nothing new
+            if failed is None or self.state != self.CLOSED:
+                return
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls and \
+                    sum(self._outcomes) >= self.failure_ratio * len(self._outcomes):
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.opened += 1
+        self._outcomes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "state": self.state,
+                "recent_failures": sum(self._outcomes),
+                "recent_calls": len(self._outcomes),
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+            if self.state == self.OPEN:
+                stats["retry_in_s"] = round(max(0.0, self.opened_at + self.cooldown - time.monotonic()), 1)
+            return stats
+
+
+class UpstreamCall:
+    """Yielded by UpstreamGuard.call(); set `status` when the response is not raised as an error."""
+    __slots__ = ("status",)
+
+    def __init__(self):
+        self.status = None
+
+
+class UpstreamGuard:
+    """
+    Circuit breaker plus adaptive concurrency limit around one provider's
+    calls. Wrap just the network call:
+
+        with guard.call() as call:
+            resp = session.get(...)
+            call.status = resp.status_code
+
+    An exception leaving the block is judged by `classify` (default:
+    classify_exception); otherwise by call.status, if set. Calls slower
+    than the limiter's latency target count as SLOW: they shrink the limit
+    but do not trip the breaker. Guard blocks must not nest.
+
+    State is per process; every worker adapts on its own.
+    """
+    def __init__(self, name: str, limiter: AdaptiveLimiter, breaker: CircuitBreaker, classify=classify_exception):
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker
+        self.classify = classify
+        self._lock = threading.Lock()
+        self.outcomes = {OK: 0, SLOW: 0, THROTTLED: 0, FAILED: 0}
+
+    def _enter(self) -> bool:
+        probe = self.breaker.before()
+        try:
+            self.limiter.acquire()
+        except BaseException:
+            self.breaker.record(None, probe)
+            raise
+        return probe
+
+    async def _enter_async(self) -> bool:
+        probe = self.breaker.before()
+        try:
+            await self.limiter.acquire_async()
+        except BaseException:
+            self.breaker.record(None, probe)
+            raise
+        return probe
+
+    def _exit(self, probe: bool, started: float, outcome: Optional[str]):
+        latency = time.monotonic() - started
+        target = self.limiter.latency_target
+        if outcome == OK and target and latency > target:
+            outcome = SLOW
+        self.limiter.release(outcome, started, latency)
+        self.breaker.record(None if outcome is None else outcome == FAILED, probe)
+        if outcome is not None:
+            with self._lock:
+                self.outcomes[outcome] += 1
+
+    def _outcome(self, call: UpstreamCall) -> str:
+        return OK if call.status is None else classify_status(call.status)
+
+    @contextmanager
+    def call(self):
+        probe = self._enter()
+        call, started = UpstreamCall(), time.monotonic()
+        try:
+            yield call
+        except BaseException as e:
+            self._exit(probe, started, self.classify(e))
+            raise
+        self._exit(probe, started, self._outcome(call))
+
+    @asynccontextmanager
+    async def call_async(self):
+        probe = await self._enter_async()
+        call, started = UpstreamCall(), time.monotonic()
+        try:
+            yield call
+        except BaseException as e:
+            self._exit(probe, started, self.classify(e))
+            raise
+        self._exit(probe, started, self._outcome(call))
+
+    def stats(self) -> dict:
+        breaker, limiter = self.breaker.stats(), self.limiter.stats()
+        rejected = {"rejected_unavailable": breaker.pop("rejected"), "rejected_overloaded": limiter.pop("rejected")}
+        with self._lock:
+            outcomes = {f"calls_{outcome}": count for outcome, count in self.outcomes.items()}
+        return {**breaker, **limiter, **outcomes, **rejected}
+
+
+def build_guard(name: str, env_prefix: str, concurrency: int, max_concurrency: int, latency_target_ms: int,
+                queue_timeout: float, classify=classify_exception) -> UpstreamGuard:
+    """
+    UpstreamGuard configured from <env_prefix>_CONCURRENCY, _MAX_CONCURRENCY,
+    _LATENCY_TARGET_MS (0: latency never counts against the limit) and
+    _QUEUE_TIMEOUT, plus the UPSTREAM_BREAKER_* settings shared by all providers.
+    """
+    latency_target = int(os.environ.get(f"{env_prefix}_LATENCY_TARGET_MS", str(latency_target_ms))) / 1000
+    limiter = AdaptiveLimiter(
+        name,
+        initial=int(os.environ.get(f"{env_prefix}_CONCURRENCY", str(concurrency))),
+        max_limit=int(os.environ.get(f"{env_prefix}_MAX_CONCURRENCY", str(max_concurrency))),
+        latency_target=latency_target or None,
+        backoff=float(os.environ.get("UPSTREAM_BACKOFF_RATIO", "0.5")),
+        queue_timeout=float(os.environ.get(f"{env_prefix}_QUEUE_TIMEOUT", str(queue_timeout))),
+        max_queue=int(os.environ.get("UPSTREAM_MAX_QUEUE", "100"))
+    )
+    breaker = CircuitBreaker(
+        name,
+        window=int(os.environ.get("UPSTREAM_BREAKER_WINDOW", "20")),
+        min_calls=int(os.environ.get("UPSTREAM_BREAKER_MIN_CALLS", "10")),
+        failure_ratio=float(os.environ.get("UPSTREAM_BREAKER_FAILURE_RATIO", "0.5")),
+        cooldown=float(os.environ.get("UPSTREAM_BREAKER_COOLDOWN", "30"))
+    )
+    return UpstreamGuard(name, limiter, breaker, classify)
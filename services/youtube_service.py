@@ -1,95 +1,449 @@
-import yt_dlp
 import os
-import glob
 import base64
+import re
+import subprocess
+import time
+import threading
+from contextlib import nullcontext
+from typing import Optional
 from models import SongMetadata, YouTubeSearchResult
 from fastapi import HTTPException
+from opentelemetry import trace
+from services.cache_service import DownloadCache
+from services.singleflight import SingleFlight
+from services.shared_state import get_shared_state
+from services.ttl_cache import TTLCache
+from services.cover_art import CoverArtCache
+from services.ytdl_pool import YoutubeDLPool
+from services.matching import best_match
+from services.telemetry import stage, cache_result, record_download, record_transcode
+from services.audio_formats import FORMATS, DEFAULT_FORMAT, DEFAULT_PRESET, get_format
+from services.upstream_guard import OK, FAILED, build_guard, classify_exception
+
+# MP3 bitrate (kbps) produced by transcode_audio
+DEFAULT_QUALITY = "192"
+
+YOUTUBE_ID_RE = re.compile(r"(?:v=|youtu\.be/|/shorts/|/embed/)([A-Za-z0-9_-]{11})")
+
+
+def extract_video_id(video_url: str) -> Optional[str]:
+    """Pulls the 11-character video ID out of the usual YouTube URL shapes."""
+    match = YOUTUBE_ID_RE.search(video_url)
+    return match.group(1) if match else None
+
+
+def safe_name(filename_base: str) -> str:
+    # Sanitize filename (basic)
+    return "".join([c for c in filename_base if c.isalpha() or c.isdigit() or c in " .-_()"]).strip()
+
+
+def mp3_filename(filename_base: str) -> str:
+    return f"{safe_name(filename_base)}.mp3"
+
+
+def mp3_encoder_args(quality: str = DEFAULT_QUALITY) -> list:
+    return ["-vn", "-codec:a", "libmp3lame", "-b:a", f"{quality}k"]
+
+
+def ytdl_cause(exc: BaseException) -> BaseException:
+    """The error behind yt-dlp's DownloadError / ExtractorError wrappers."""
+    cause = exc
+    while True:
+        inner = getattr(cause, "cause", None) or (getattr(cause, "exc_info", None) or (None, None))[1]
+        if inner is None or inner is cause:
+            return cause
+        cause = inner
+
+
+def classify_ytdl_error(exc: BaseException):
+    """
+    classify_exception for yt-dlp: DownloadError and ExtractorError are
+    unwrapped to the HTTP or network error behind them. An "expected"
+    extractor error (private, removed, region-locked video) is the video's
+    problem, not YouTube's; the bot check is YouTube refusing us.
+    """
+    cause = ytdl_cause(exc)
+    if "confirm you" in str(cause) and "not a bot" in str(cause):
+        return FAILED
+    if getattr(cause, "expected", False):
+        return OK
+    return classify_exception(cause)
+
+
+def metadata_tags(metadata: SongMetadata) -> dict:
+    return {"title": metadata.title, "artist": metadata.artist, "album_artist": metadata.artist,
+            "album": metadata.album}
+
+
+def transcode_audio(src_path: str, dst_path: str, codec_args: list = None) -> float:
+    """
+    Runs ffmpeg from src_path to dst_path (MP3 at DEFAULT_QUALITY unless
+    codec_args say otherwise) and returns the CPU seconds ffmpeg used.
+    Kept at module level so it can be shipped to a process pool.
+    """
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-i", src_path,
+        *(codec_args or mp3_encoder_args()),
+        dst_path
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = proc.stderr.read()
+    proc.stderr.close()
+    # wait4 instead of wait() to get this child's own resource usage
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+    return usage.ru_utime + usage.ru_stime
+
 
 class YouTubeService:
-    def __init__(self):
-        self.output_dir = "/app/downloads"
+    def __init__(self, cache: DownloadCache = None):
+        self.output_dir = os.environ.get("DOWNLOAD_DIR", "/app/downloads")
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir, exist_ok=True)
+        if cache is None:
+            cache = DownloadCache(self.output_dir)
+            cache.sweep()
+        self.cache = cache
+        # Journal progress every this many bytes; a resume re-fetches at most this much extra
+        self.journal_interval = int(os.environ.get("DOWNLOAD_JOURNAL_INTERVAL", str(4 * 1024 * 1024)))
+        self.resumed_downloads = 0
+        self.resumed_bytes = 0
+        self.download_flight = SingleFlight("download", state=get_shared_state())
+        # Searches and lookups adapt to latency; downloads take as long as the file does
+        self.guard = build_guard("YouTube", "YOUTUBE", concurrency=4, max_concurrency=16, latency_target_ms=10000,
+                                 queue_timeout=10, classify=classify_ytdl_error)
+        self.download_guard = build_guard("YouTube downloads", "YOUTUBE_DOWNLOAD", concurrency=4, max_concurrency=16,
+                                          latency_target_ms=0, queue_timeout=60, classify=classify_ytdl_error)
+        self.socket_timeout = float(os.environ.get("YTDL_SOCKET_TIMEOUT", "15"))
 
-    def search_video(self, query: str) -> YouTubeSearchResult:
-        ydl_opts = {
+        self.search_pool = YoutubeDLPool({
             'format': 'bestaudio/best',
             'noplaylist': True,
             'quiet': True,
+            'socket_timeout': self.socket_timeout,
             'default_search': 'ytsearch1'
+        }, size=int(os.environ.get("YTDL_SEARCH_POOL_SIZE", "4")))
+        # Only fetch the source audio here; the ffmpeg step runs separately
+        # so callers can move it off the request thread. One pool per
+        # format selector, since YoutubeDL compiles it at construction.
+        self.download_pools = {
+            fmt.format_selector: YoutubeDLPool({
+                'format': fmt.format_selector,
+                # Stable staging name per video and download flight (the
+                # "staging" field passed in extra_info), so a retry finds the
+                # .part file and continues it with a Range request, and flights
+                # sharing a selector (mp3 and original, every quality preset)
+                # never write or consume the same file
+                'outtmpl': f'{self.cache.staging_dir}/%(id)s.%(format_id)s.%(staging)s.%(ext)s',
+                'continuedl': True,
+                'nopart': False,
+                'quiet': True,
+                'socket_timeout': self.socket_timeout,
+                'noplaylist': True
+            }, size=int(os.environ.get("YTDL_DOWNLOAD_POOL_SIZE", "4")))
+            for fmt in FORMATS.values()
         }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        self.transcode_stats = {mode: {"count": 0, "cpu_seconds": 0.0} for mode in ("encode", "copy", "none")}
+        self._stats_lock = threading.Lock()
+        # Tags and cover art go into the transcode's own ffmpeg run
+        self.embed_tags = os.environ.get("EMBED_TAGS", "1") != "0"
+        self.covers = CoverArtCache()
+        self.tagged_files = 0
+        self.tagged_with_cover = 0
+        # Flat extraction: search result listings only, no per-video format resolution
+        self.match_pool = YoutubeDLPool({
+            'quiet': True,
+            'socket_timeout': self.socket_timeout,
+            'extract_flat': 'in_playlist',
+            'noplaylist': True
+        }, size=int(os.environ.get("YTDL_SEARCH_POOL_SIZE", "4")))
+        self.match_candidates = int(os.environ.get("YOUTUBE_MATCH_CANDIDATES", "10"))
+        self.match_min_confidence = float(os.environ.get("YOUTUBE_MATCH_MIN_CONFIDENCE", "0.5"))
+        self.search_cache = TTLCache(
+            max_entries=int(os.environ.get("YOUTUBE_SEARCH_CACHE_SIZE", "10000")),
+            ttl=int(os.environ.get("YOUTUBE_SEARCH_CACHE_TTL", "86400"))
+        )
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Case- and whitespace-insensitive cache key for a search query."""
+        return " ".join(query.casefold().split())
+
+    def search_video(self, query: str) -> YouTubeSearchResult:
+        cache_key = self.normalize_query(query)
+        cached = self.search_cache.get(cache_key)
+        cache_result("youtube_search", cached is not None)
+        if cached is not None:
+            return cached
+
+        with self.search_pool.lease() as ydl, stage("search", source="youtube"):
             try:
-                info = ydl.extract_info(query, download=False)
+                with self.guard.call():
+                    info = ydl.extract_info(query, download=False)
                 if 'entries' in info:
                     video = info['entries'][0]
                 else:
                     video = info
 
-                return YouTubeSearchResult(
+                result = YouTubeSearchResult(
                     video_id=video['id'],
                     video_url=video['webpage_url'],
                     title=video['title'],
                     duration=video.get('duration', 0)
                 )
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"YouTube search failed: {str(e)}")
+
+        self.search_cache.put(cache_key, result)
+        return result
+
+    def resolve_audio_source(self, video_url: str) -> dict:
+        """Direct URL and request headers of the best audio format, without downloading."""
+        with self.search_pool.lease() as ydl:
+            try:
+                with self.guard.call():
+                    info = ydl.extract_info(video_url, download=False)
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"YouTube lookup failed: {str(e)}")
+        if not info.get('url'):
+            raise HTTPException(status_code=500, detail="YouTube lookup returned no audio stream")
+        return {
+            "video_id": info['id'],
+            "url": info['url'],
+            "http_headers": info.get('http_headers') or {},
+            "ext": info.get('ext'),
+        }
+
+    def _candidates_key(self, query: str) -> str:
+        return f"candidates:{self.match_candidates}:{self.normalize_query(query)}"
+
+    def search_candidates(self, query: str) -> list:
+        """Top-N flat search entries for query (cached like search_video)."""
+        cache_key = self._candidates_key(query)
+        cached = self.search_cache.get(cache_key)
+        cache_result("youtube_search", cached is not None)
+        if cached is not None:
+            return cached
+
+        with self.match_pool.lease() as ydl, stage("search", source="youtube") as span:
+            try:
+                with self.guard.call():
+                    info = ydl.extract_info(f"ytsearch{self.match_candidates}:{query}", download=False)
+            except HTTPException:
+                raise
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"YouTube search failed: {str(e)}")
+            candidates = [entry for entry in info.get('entries') or [] if entry and entry.get('id')]
+            span.set_attribute("youtube.candidates", len(candidates))
+
+        self.search_cache.put(cache_key, candidates)
+        return candidates
 
-    def download_file(self, video_url: str, filename_base: str) -> str:
+    @staticmethod
+    def match_query(metadata: SongMetadata) -> str:
+        return f"{metadata.artist} - {metadata.title} audio"
+
+    def match_video(self, metadata: SongMetadata, exclude=()) -> YouTubeSearchResult:
         """
-        Downloads the video as MP3 to /app/downloads/filename.mp3
-        Returns the filename.
+        Picks the candidate that best fits the track's duration, title,
+        artist and channel, leaving out the video IDs in `exclude`. Rejects
+        the track with 422 when nothing is confident enough, before any
+        audio is downloaded.
         """
-        # Sanitize filename (basic)
-        safe_filename = "".join([c for c in filename_base if c.isalpha() or c.isdigit() or c in " .-_()"]).strip()
-        filename = f"{safe_filename}.mp3"
-        filepath = os.path.join(self.output_dir, filename)
+        query = self.match_query(metadata)
+        candidates = [c for c in self.search_candidates(query) if c['id'] not in exclude]
+        video, confidence = best_match(metadata, candidates)
+        trace.get_current_span().set_attribute("youtube.match_confidence", confidence)
+        if video is None or confidence < self.match_min_confidence:
+            raise HTTPException(
+                status_code=422,
+                detail=f"No confident YouTube match for '{metadata.artist} - {metadata.title}' "
+                       f"(best confidence {confidence:.2f}, need {self.match_min_confidence:.2f})"
+            )
 
-        # Check if exists to avoid redownload (optional, but good for speed)
-        if os.path.exists(filepath):
-            return filename
+        return YouTubeSearchResult(
+            video_id=video['id'],
+            video_url=video.get('webpage_url') or f"https://www.youtube.com/watch?v={video['id']}",
+            title=video.get('title') or "",
+            duration=int(video.get('duration') or 0),
+            confidence=confidence
+        )
 
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': f'{self.output_dir}/%(id)s.%(ext)s',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'keepvideo': False, 
-            'quiet': True,
-            'noplaylist': True
-        }
+    def forget_search(self, metadata: SongMetadata):
+        """Drops the track's cached candidates, e.g. after its match turned out to be unavailable."""
+        self.search_cache.delete(self._candidates_key(self.match_query(metadata)))
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(video_url, download=True)
+    def download_file(self, video_url: str, filename_base: str, progress_hook=None, transcoder=None,
+                      stage_gate=None, audio_format: str = DEFAULT_FORMAT, quality: str = DEFAULT_PRESET,
+                      metadata: SongMetadata = None) -> str:
+        """
+        Downloads the video to /app/downloads/<filename_base>.<ext> in the
+        requested audio format (mp3 by default), <filename_base>.<bitrate>k.<ext>
+        for presets other than the default. Returns the filename.
+
+        progress_hook is called with (stage, fraction) while the job runs.
+        transcoder is a callable (src_path, dst_path, codec_args) -> cpu
+        seconds used for the ffmpeg step; defaults to running transcode_audio
+        in the calling thread.
+        stage_gate(stage) returns a context manager held around the
+        "download" and "transcode" steps (used to cap per-stage concurrency).
+        metadata, when given, is written into the file as tags (with the
+        album cover where the format allows) by that same ffmpeg step; the
+        "original" format is never rewritten, so it stays untagged. Files are
+        shared by video, so the first conversion's tags are the ones kept.
+        """
+        fmt = get_format(audio_format, quality)
+        base = safe_name(filename_base)
+        if fmt.bitrate(quality) != fmt.bitrate(DEFAULT_PRESET):
+            # Each quality is its own blob, so it gets its own name: "A - B.320k.mp3"
+            base = f"{base}.{fmt.bitrate(quality)}k"
+
+        # Already converted (under this or another name): link it, skip the work.
+        # The blob is found by video ID; a filename alias says nothing about
+        # which video or quality is behind it, so it is only trusted when
+        # there is no video ID to go by ("original" has no fixed extension,
+        # so it always goes through the index).
+        video_id = extract_video_id(video_url)
+        key = None
+        if video_id:
+            key = self.cache.lookup(video_id, fmt.name, fmt.bitrate(quality))
+            cache_result("download", key is not None)
+        elif fmt.ext:
+            # Files predating the index still count if they're on disk
+            filename = f"{base}.{fmt.ext}"
+            if self.cache.touch_alias(filename) or os.path.exists(os.path.join(self.output_dir, filename)):
+                return filename
+
+        if key is None:
+            if transcoder is None:
+                transcoder = transcode_audio
+            if stage_gate is None:
+                stage_gate = lambda stage: nullcontext()
+
+            fetch = lambda: self._fetch_and_store(video_url, fmt, quality, progress_hook, transcoder, stage_gate,
+                                                  metadata)
+            if video_id:
+                # Concurrent requests for the same video share one download
+                key = self.download_flight.do(f"{video_id}:{fmt.name}:{fmt.bitrate(quality)}", fetch)
+            else:
+                key = fetch()
+
+        # Store the blob once, expose it under the human filename
+        filename = base + os.path.splitext(self.cache.path_for(key))[1]
+        self.cache.alias(key, filename)
+        if progress_hook:
+            progress_hook("transcode", 1.0)
+        return filename
+
+    def _fetch_and_store(self, video_url: str, fmt, quality: str, progress_hook, transcoder, stage_gate,
+                         metadata: SongMetadata = None) -> str:
+        """Downloads and converts one video into the cache. Returns the cache key."""
+        bitrate = fmt.bitrate(quality)
+        # Another worker process may have finished it while we waited on its lock
+        video_id = extract_video_id(video_url)
+        if video_id and self.cache.peek(video_id, fmt.name, bitrate):
+            return self.cache.make_key(video_id, fmt.name, bitrate)
+        # Names this flight's staged source, as download_flight keys it
+        staging = f"{fmt.name}-{bitrate}"
+
+        journaled = {"bytes": None}
+
+        def _report(d):
+            if d.get('status') != 'downloading':
+                return
+            downloaded = d.get('downloaded_bytes', 0)
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if journaled["bytes"] is None or downloaded - journaled["bytes"] >= self.journal_interval:
+                journaled["bytes"] = downloaded
+                self.cache.journal(d['filename'], video_id or d.get('info_dict', {}).get('id', ''), downloaded,
+                                   d.get('total_bytes'))
+            if progress_hook is not None and total:
+                progress_hook("download", min(downloaded / total, 1.0))
+
+        try:
+            with stage_gate("download"), stage("download", source="youtube") as span:
+                resumed = self.cache.resumable_bytes(video_id, staging) if video_id else 0
+                # The YoutubeDL instance is only needed for the fetch itself; the
+                # cover, the transcode queue and publishing happen without it
+                with self.download_pools[fmt.format_selector].lease(progress_hook=_report) as ydl:
+                    with self.download_guard.call():
+                        info = ydl.extract_info(video_url, download=True, extra_info={"staging": staging})
+                    source_filepath = ydl.prepare_filename(info)
                 video_id = info['id']
-                temp_filename = f"{video_id}.mp3"
-                temp_filepath = os.path.join(self.output_dir, temp_filename)
-                
-                if not os.path.exists(temp_filepath):
+
+                if not os.path.exists(source_filepath):
                     raise Exception("File not found after download")
+                size = os.path.getsize(source_filepath)
+                # Only what actually crossed the network this time
+                record_download(span, size - min(resumed, size))
+                if resumed:
+                    span.set_attribute("download.resumed_bytes", resumed)
+                    with self._stats_lock:
+                        self.resumed_downloads += 1
+                        self.resumed_bytes += resumed
 
-                # Rename to desired filename
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                os.rename(temp_filepath, filepath)
-                
-                return filename
-                
-            except Exception as e:
-                # Cleanup if something failed
-                if 'temp_filepath' in locals() and os.path.exists(temp_filepath):
-                    os.remove(temp_filepath)
-                raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
-
-    def _cleanup_tmp(self):
-        files = glob.glob(f"{self.output_dir}/*")
-        for f in files:
-            try:
-                os.remove(f)
-            except:
-                pass
+            if fmt.ext is None:
+                # "original": keep the downloaded file exactly as served
+                self._record_transcode("none", 0.0)
+                key = self.cache.put(video_id, fmt.name, bitrate, source_filepath)
+                self.cache.unjournal(source_filepath)
+                return key
+
+            mode, codec_args = fmt.ffmpeg_args(quality, info.get('acodec'))
+            cover = None
+            if metadata is not None and self.embed_tags:
+                # Fetched (once per album) before taking a transcode slot
+                cover = self.covers.get(metadata.album_art_url) if fmt.embeds_cover else None
+                codec_args = fmt.tag_args(codec_args, metadata_tags(metadata), cover)
+            temp_filepath = self.cache.staging_path(f"{video_id}.transcode") + f".{fmt.ext}"
+            if progress_hook:
+                progress_hook("transcode", 0.0)
+            with stage_gate("transcode"), stage("transcode", source="ffmpeg", format=fmt.name) as span:
+                started_at = time.monotonic()
+                cpu_seconds = transcoder(source_filepath, temp_filepath, codec_args)
+                record_transcode(span, mode, info.get('duration') or 0, time.monotonic() - started_at, cpu_seconds)
+            self._record_transcode(mode, cpu_seconds)
+            if metadata is not None and self.embed_tags:
+                with self._stats_lock:
+                    self.tagged_files += 1
+                    self.tagged_with_cover += cover is not None
+
+            key = self.cache.put(video_id, fmt.name, bitrate, temp_filepath, ext=fmt.ext)
+            os.remove(source_filepath)
+            self.cache.unjournal(source_filepath)
+            return key
+
+        except Exception as e:
+            # The staged source (partial or complete) stays for the retry;
+            # only a half-written transcode output is useless
+            path = locals().get('temp_filepath')
+            if path and os.path.exists(path):
+                os.remove(path)
+            if isinstance(e, HTTPException):
+                raise
+            if getattr(ytdl_cause(e), "expected", False):
+                # Removed, private or blocked: retrying the same video will not help
+                raise HTTPException(status_code=410, detail=f"Video unavailable: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
+
+    def _record_transcode(self, mode: str, cpu_seconds: float):
+        with self._stats_lock:
+            self.transcode_stats[mode]["count"] += 1
+            self.transcode_stats[mode]["cpu_seconds"] += cpu_seconds or 0.0
+
+    def tagging_summary(self) -> dict:
+        with self._stats_lock:
+            summary = {"enabled": self.embed_tags, "files": self.tagged_files, "with_cover": self.tagged_with_cover}
+        return {**summary, "covers": self.covers.stats()}
+
+    def transcode_summary(self) -> dict:
+        with self._stats_lock:
+            return {mode: {"count": v["count"], "cpu_seconds": round(v["cpu_seconds"], 3)}
+                    for mode, v in self.transcode_stats.items()}
@@ -0,0 +1,80 @@
+import queue
+import threading
+from contextlib import contextmanager
+import yt_dlp
+
+
+class PooledYoutubeDL:
+    """
+    A long-lived YoutubeDL plus a swappable progress hook.
+
+    YoutubeDL takes its hooks at construction time, so the pool installs a
+    single dispatcher and callers set `progress_hook` for the duration of
+    their lease.
+    """
+    def __init__(self, opts: dict):
+        self.progress_hook = None
+        self.ydl = yt_dlp.YoutubeDL({**opts, 'progress_hooks': [self._dispatch]})
+
+    def _dispatch(self, d):
+        hook = self.progress_hook
+        if hook is not None:
+            hook(d)
+
+
+class YoutubeDLPool:
+    """
+    Bounded pool of pre-configured YoutubeDL instances.
+
+    Building a YoutubeDL loads and initialises every extractor, which costs
+    far more than the lookups we do with it. Instances are not thread-safe,
+    so each one is leased to a single caller at a time; at most `size` are
+    ever built and further callers wait for one to be returned.
+    """
+    def __init__(self, opts: dict, size: int, factory=PooledYoutubeDL):
+        self.opts = opts
+        self.size = size
+        self._factory = factory
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lease(self, progress_hook=None):
+        pooled = self._take()
+        pooled.progress_hook = progress_hook
+        try:
+            yield pooled.ydl
+        finally:
+            pooled.progress_hook = None
+            self._idle.put(pooled)
+
+    def _take(self) -> PooledYoutubeDL:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                build = True
+            else:
+                build = False
+        if build:
+            try:
+                return self._factory(self.opts)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().ydl.close()
+            except queue.Empty:
+                return
+
+    def stats(self) -> dict:
+        return {"size": self.size, "created": self._created, "idle": self._idle.qsize()}
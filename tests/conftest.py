@@ -0,0 +1,6 @@
+import os
+
+# Keep the services off /app and away from a trace collector; tests that
+# touch the filesystem point the paths at tmp_path themselves
+os.environ.setdefault("SHARED_STATE_BACKEND", "memory")
+os.environ.setdefault("OTEL_EXPORTER_OTLP_ENDPOINT", "")
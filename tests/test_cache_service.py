@@ -0,0 +1,75 @@
+"""DownloadCache startup sweep."""
+import os
+import time
+import pytest
+from services.cache_service import DownloadCache
+from services.shared_state import MemoryState
+
+
+class CountingEntry:
+    """os.DirEntry that counts stat() calls."""
+    def __init__(self, entry, counter):
+        self._entry = entry
+        self._counter = counter
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+    def stat(self, **kwargs):
+        self._counter.append(self._entry.name)
+        return self._entry.stat(**kwargs)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DownloadCache(str(tmp_path / "downloads"), index_path=str(tmp_path / "index.db"), state=MemoryState())
+    for n in range(20):
+        src = cache.staging_path(f"v{n:010d}") + ".mp3"
+        with open(src, "wb") as fh:
+            fh.write(b"x" * 100)
+        key = cache.put(f"v{n:010d}", "mp3", "192", src, ext="mp3")
+        cache.alias(key, f"Artist - Track {n}.mp3")
+    return cache
+
+
+def write(path: str, age: float = 0.0):
+    with open(path, "wb") as fh:
+        fh.write(b"x" * 10)
+    if age:
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+    return path
+
+
+def test_sweep_removes_orphans_and_keeps_cache(cache):
+    old = [
+        write(os.path.join(cache.blob_dir, "unindexed-mp3-192.mp3"), age=3600),
+        write(os.path.join(cache.staging_dir, "abcdefghijk.251.mp3-192.webm.part"), age=3600),
+        write(os.path.join(cache.output_dir, "abcdefghijk.webm"), age=3600),
+    ]
+    fresh = write(os.path.join(cache.staging_dir, "bcdefghijkl.251.mp3-192.webm.part"))
+    journaled = write(os.path.join(cache.staging_dir, "cdefghijklm.251.mp3-192.webm.part"), age=3600)
+    cache.journal(journaled[:-len(".part")], "cdefghijklm", 10, 100)
+
+    result = cache.sweep(grace=600)
+    assert result == {"removed_files": 3, "removed_bytes": 30, "resumable": 1}
+    assert not any(os.path.exists(path) for path in old)
+    assert os.path.exists(fresh) and os.path.exists(journaled)
+    assert len(os.listdir(cache.blob_dir)) == 20
+    assert all(os.path.exists(os.path.join(cache.output_dir, f"Artist - Track {n}.mp3")) for n in range(20))
+
+
+def test_sweep_only_stats_suspects(cache, monkeypatch):
+    write(os.path.join(cache.blob_dir, "unindexed-mp3-192.mp3"), age=3600)
+    write(os.path.join(cache.output_dir, "abcdefghijk.webm"))
+
+    scandir, stated = os.scandir, []
+
+    def counting_scandir(path):
+        with scandir(path) as entries:
+            return [CountingEntry(entry, stated) for entry in entries]
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    cache.sweep(grace=600)
+    # Not one of the 20 blobs or their aliases
+    assert sorted(stated) == ["abcdefghijk.webm", "unindexed-mp3-192.mp3"]
@@ -0,0 +1,82 @@
+"""ConvertService's search -> download steps with the download stubbed out."""
+import os
+import json
+import pytest
+from fastapi import HTTPException
+from models import SongMetadata
+from services.convert_service import ConvertService
+from services.shared_state import MemoryState
+from services.track_index import TrackIndex
+from services.ytdl_pool import YoutubeDLPool
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "youtube_search", "topic_vs_music_video.json")
+TOPIC, MUSIC_VIDEO = "CmQz5Y0d2aM", "dX3k_QDnzHE"
+
+
+class FakeSearch:
+    """Stands in for a pooled YoutubeDL: every search answers with the fixture."""
+    searches = 0
+
+    def __init__(self, opts):
+        self.ydl = self
+
+    def extract_info(self, query, download=False):
+        FakeSearch.searches += 1
+        with open(FIXTURE) as fh:
+            return json.load(fh)["result"]
+
+
+@pytest.fixture
+def youtube(tmp_path, monkeypatch):
+    from services.youtube_service import YouTubeService
+
+    monkeypatch.setenv("DOWNLOAD_DIR", str(tmp_path / "downloads"))
+    monkeypatch.setenv("CACHE_INDEX_PATH", str(tmp_path / "cache" / "index.db"))
+    youtube = YouTubeService()
+    youtube.match_pool = YoutubeDLPool({}, size=1, factory=FakeSearch)
+    FakeSearch.searches = 0
+
+    # The art track has been taken down; everything else downloads
+    youtube.downloads = []
+
+    def download_file(video_url, filename_base, **kwargs):
+        youtube.downloads.append(video_url.rsplit("=", 1)[1])
+        if TOPIC in video_url:
+            raise HTTPException(status_code=410, detail="Video unavailable: This video has been removed")
+        return f"{filename_base}.mp3"
+
+    youtube.download_file = download_file
+    return youtube
+
+
+@pytest.fixture
+def metadata():
+    with open(FIXTURE) as fh:
+        track = json.load(fh)["track"]
+    return SongMetadata(**track, spotify_url="https://open.spotify.com/track/0u2P5u6lvoDfwTYjAADbn4")
+
+
+def test_unavailable_match_falls_back_to_next_candidate(youtube, metadata):
+    convert = ConvertService(None, None, youtube)
+    result = convert.convert_metadata(metadata)
+    assert youtube.downloads == [TOPIC, MUSIC_VIDEO]
+    assert result.youtube_url.endswith(MUSIC_VIDEO)
+    assert result.filename == "M83 - Midnight City.mp3"
+
+
+def test_unavailable_indexed_video_is_not_picked_again_from_cached_search(youtube, metadata, tmp_path):
+    index = TrackIndex(str(tmp_path / "track_index.db"), state=MemoryState())
+    convert = ConvertService(None, None, youtube, track_index=index)
+    # Matched (and the search cached) while the art track was still up
+    index.record("spotify:track:0u2P5u6lvoDfwTYjAADbn4", None, youtube.match_video(metadata).video_id, 1.0)
+    assert FakeSearch.searches == 1
+
+    result = convert.convert_metadata(metadata)
+    assert youtube.downloads == [TOPIC, MUSIC_VIDEO]
+    assert result.youtube_url.endswith(MUSIC_VIDEO)
+    assert index.lookup("spotify:track:0u2P5u6lvoDfwTYjAADbn4")["video_id"] == MUSIC_VIDEO
+
+    # The next conversion goes straight to the replacement
+    youtube.downloads.clear()
+    convert.convert_metadata(metadata)
+    assert youtube.downloads == [MUSIC_VIDEO]
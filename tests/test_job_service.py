@@ -0,0 +1,153 @@
+"""JobService state transitions with stubbed conversion and transcoding."""
+import json
+import time
+import threading
+import pytest
+from fastapi import HTTPException
+from models import ConversionResult, SongMetadata
+from services.job_service import JobService
+from services.shared_state import MemoryState
+from services.transcode_scheduler import PRIORITY_JOB
+
+METADATA = SongMetadata(title="Midnight City", artist="M83", album="Hurry Up, We're Dreaming", duration_ms=243960)
+
+
+class StubConvert:
+    """convert() that reports progress, transcodes once and then waits for the test to let it finish."""
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def convert(self, url, progress_hook=None, transcoder=None, audio_format=None, quality=None):
+        self.calls.append((url, audio_format, quality))
+        progress_hook("metadata", 1.0)
+        progress_hook("download", 0.5)
+        self.started.set()
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        transcoder("staging/src.webm", "downloads/M83 - Midnight City.mp3")
+        progress_hook("transcode", 1.0)
+        return ConversionResult(metadata=METADATA, youtube_url="https://www.youtube.com/watch?v=CmQz5Y0d2aM",
+                                filename="M83 - Midnight City.mp3")
+
+
+class StubScheduler:
+    def __init__(self):
+        self.transcodes = []
+
+    def transcoder(self, priority):
+        def run(src, dst, codec_args=None):
+            self.transcodes.append((priority, src, dst))
+            return 0.0
+        return run
+
+
+def wait_for(service, job, status):
+    """Until the job's published snapshot shows status (the last thing a worker does for it)."""
+    deadline = time.monotonic() + 5
+    while True:
+        payload = service.state.get(f"job:{job.job_id}")
+        if payload is not None and json.loads(payload)["status"] == status:
+            return
+        assert time.monotonic() < deadline, f"job stuck in {job.status}"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def make_service():
+    services = []
+
+    def make(convert, scheduler=None, **kwargs):
+        kwargs.setdefault("state", MemoryState())
+        service = JobService(convert, scheduler or StubScheduler(), **kwargs)
+        services.append(service)
+        return service
+
+    yield make
+    for service in services:
+        service.shutdown()
+
+
+def test_job_completes(make_service):
+    convert, scheduler = StubConvert(), StubScheduler()
+    service = make_service(convert, scheduler, workers=1, queue_size=1)
+    job = service.submit("https://open.spotify.com/track/x", audio_format="opus", quality="high")
+    assert job.status in ("queued", "running")
+
+    assert convert.started.wait(5)
+    wait_for(service, job, "running")
+    assert job.stage == "download"
+    assert 0.1 < job.progress < 0.8
+    assert service.stats()["running"] == 1
+
+    convert.release.set()
+    wait_for(service, job, "completed")
+    assert job.progress == 1.0
+    assert job.result.filename == "M83 - Midnight City.mp3"
+    assert job.error is None and job.finished_at is not None
+    assert convert.calls == [("https://open.spotify.com/track/x", "opus", "high")]
+    # ffmpeg went through the scheduler at job priority
+    assert scheduler.transcodes == [(PRIORITY_JOB, "staging/src.webm", "downloads/M83 - Midnight City.mp3")]
+    assert service.get(job.job_id).to_status().status == "completed"
+
+
+@pytest.mark.parametrize("error, detail", [
+    (HTTPException(status_code=422, detail="No confident YouTube match"), "No confident YouTube match"),
+    (RuntimeError("ffmpeg failed: boom"), "ffmpeg failed: boom"),
+])
+def test_job_fails(make_service, error, detail):
+    convert = StubConvert(error)
+    service = make_service(convert, workers=1, queue_size=0)
+    job = service.submit("https://open.spotify.com/track/x")
+    assert convert.started.wait(5)
+    convert.release.set()
+    wait_for(service, job, "failed")
+    assert job.error == detail
+    assert job.result is None and job.finished_at is not None
+    # The slot is free again
+    convert.started.clear()
+    service.submit("https://open.spotify.com/track/y")
+    assert convert.started.wait(5)
+
+
+def test_queued_behind_busy_workers_and_429_when_full(make_service):
+    convert = StubConvert()
+    service = make_service(convert, workers=1, queue_size=1)
+    first = service.submit("https://open.spotify.com/track/1")
+    assert convert.started.wait(5)
+    second = service.submit("https://open.spotify.com/track/2")
+    assert second.status == "queued"
+    assert service.stats() == {"queued": 1, "running": 1, "capacity": 2}
+
+    with pytest.raises(HTTPException) as excinfo:
+        service.submit("https://open.spotify.com/track/3")
+    assert excinfo.value.status_code == 429
+
+    convert.release.set()
+    wait_for(service, first, "completed")
+    wait_for(service, second, "completed")
+
+
+def test_status_visible_to_other_workers(make_service):
+    state = MemoryState()
+    convert = StubConvert()
+    service = make_service(convert, state=state, workers=1, queue_size=0)
+    other = make_service(StubConvert(), state=state, workers=1, queue_size=0)
+
+    job = service.submit("https://open.spotify.com/track/x")
+    assert convert.started.wait(5)
+    wait_for(service, job, "running")
+    assert other.get(job.job_id).status == "running"
+
+    convert.release.set()
+    wait_for(service, job, "completed")
+    seen = other.get(job.job_id)
+    assert seen.status == "completed"
+    assert seen.result == job.result
+
+    with pytest.raises(HTTPException) as excinfo:
+        other.get("missing")
+    assert excinfo.value.status_code == 404
@@ -0,0 +1,71 @@
+"""
+best_match against flat search results (tests/fixtures/youtube_search).
+
+Each fixture is the track's metadata, the query YouTubeService.match_video
+sends and a ytsearch10 flat extraction result for it, in the shape yt-dlp
+returns (entries of _type "url" with id, title, duration, channel, ...).
+"""
+import os
+import json
+import pytest
+from models import SongMetadata
+from services.matching import best_match, score_candidates
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "youtube_search")
+# YOUTUBE_MATCH_MIN_CONFIDENCE default
+MIN_CONFIDENCE = 0.5
+
+
+def load(name: str):
+    with open(os.path.join(FIXTURES, f"{name}.json")) as fh:
+        fixture = json.load(fh)
+    return SongMetadata(**fixture["track"]), fixture["result"]["entries"]
+
+
+@pytest.mark.parametrize("name, video_id, min_confidence", [
+    # Art track on the "- Topic" channel over the official music video, live, cover and remix
+    ("topic_vs_music_video", "CmQz5Y0d2aM", 0.95),
+    # Live and slowed uploads ranked above the official audio
+    ("decoys_ranked_first", "J7p4bzqLvCw", 0.9),
+    # "Live" is part of the title, so only the Knebworth recording's second "live" is a marker
+    ("marker_in_track_title", "Wn4rUe2GmyQ", 0.95),
+    # Only the first of several artists is matched; the radio edit is 2 minutes short
+    ("featured_artists", "5NV6Rdv1a3I", 0.9),
+])
+def test_picks_studio_version(name, video_id, min_confidence):
+    metadata, entries = load(name)
+    video, confidence = best_match(metadata, entries)
+    assert video["id"] == video_id
+    assert confidence >= min_confidence
+    others = [score for entry, score in zip(entries, score_candidates(metadata, entries)) if entry["id"] != video_id]
+    assert max(others) < confidence
+
+
+def test_decoys_score_below_threshold():
+    metadata, entries = load("topic_vs_music_video")
+    scores = dict(zip((entry["id"] for entry in entries), score_candidates(metadata, entries)))
+    # Live, cover and remix
+    for video_id in ("ZgW1x3S0pZk", "p8Lq2nV7rTs", "hT6yKc1bWfE"):
+        assert scores[video_id] < MIN_CONFIDENCE
+    # The music video is acceptable, just not preferred
+    assert MIN_CONFIDENCE <= scores["dX3k_QDnzHE"] < scores["CmQz5Y0d2aM"]
+
+
+def test_rejects_when_no_duration_fits():
+    # Only the radio edit and an hour-long loop of the 10:37 album version
+    metadata, entries = load("wrong_duration_only")
+    _, confidence = best_match(metadata, entries)
+    assert confidence < MIN_CONFIDENCE
+
+
+def test_marker_allowed_when_track_has_it():
+    _, entries = load("wrong_duration_only")
+    metadata = SongMetadata(title="Strobe (Radio Edit)", artist="deadmau5", album="Strobe", duration_ms=216_000)
+    video, confidence = best_match(metadata, entries)
+    assert video["id"] == "o8jM5vVYg0Q"
+    assert confidence >= 0.95
+
+
+def test_no_candidates():
+    metadata, _ = load("topic_vs_music_video")
+    assert best_match(metadata, []) == (None, 0.0)
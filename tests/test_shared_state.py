@@ -0,0 +1,166 @@
+"""
+SharedState backends: MemoryState, LocalState and RedisState (against
+benchmarks.fake_redis, so no Redis server is needed).
+"""
+import time
+import uuid
+import threading
+import pytest
+from models import ConversionResult, SongMetadata
+from services.job_service import Job, JobService
+from services.shared_state import LocalState, MemoryState, RedisState, SharedState
+
+
+@pytest.fixture(scope="module")
+def redis_url():
+    from benchmarks.fake_redis import FakeRedis
+    with FakeRedis() as server:
+        yield server.url
+
+
+@pytest.fixture(params=["memory", "local", "redis"])
+def open_state(request, tmp_path):
+    """Opens the backend; every call is another worker's view of the same state."""
+    states = []
+    memory = MemoryState()
+    prefix = f"test-{uuid.uuid4().hex}:"
+
+    def open_state():
+        if request.param == "memory":
+            return memory
+        if request.param == "local":
+            state = LocalState(str(tmp_path / "state.db"), lock_dir=str(tmp_path / "locks"))
+        else:
+            state = RedisState(request.getfixturevalue("redis_url"), prefix=prefix, lock_ttl=1)
+        states.append(state)
+        return state
+
+    yield open_state
+    for state in states:
+        state.close()
+
+
+def test_get_set_delete(open_state):
+    state, other = open_state(), open_state()
+    assert state.get("k") is None
+    state.set("k", "v1")
+    assert other.get("k") == "v1"
+    other.set("k", "v2")
+    assert state.get("k") == "v2"
+    state.delete("k")
+    assert other.get("k") is None
+    state.delete("k")
+
+
+def test_ttl(open_state):
+    state = open_state()
+    state.set("short", "v", ttl=0.2)
+    state.set("long", "v", ttl=60)
+    state.set("forever", "v")
+    assert state.get("short") == "v"
+    time.sleep(0.3)
+    assert state.get("short") is None
+    assert state.get("long") == "v"
+    assert state.get("forever") == "v"
+
+
+def test_add(open_state):
+    state, other = open_state(), open_state()
+    assert state.add("k", "first", ttl=0.2)
+    assert not other.add("k", "second")
+    assert other.get("k") == "first"
+    time.sleep(0.3)
+    # An expired entry no longer blocks
+    assert other.add("k", "third")
+    assert state.get("k") == "third"
+
+
+def test_lock_is_exclusive(open_state):
+    states = [open_state() for _ in range(3)]
+    held, overlaps, entered = [0], [0], []
+    guard = threading.Lock()
+
+    def worker(state, n):
+        for _ in range(3):
+            with state.lock("download:abc"):
+                with guard:
+                    held[0] += 1
+                    overlaps[0] += held[0] > 1
+                entered.append(n)
+                time.sleep(0.01)
+                with guard:
+                    held[0] -= 1
+
+    threads = [threading.Thread(target=worker, args=(state, n)) for n, state in enumerate(states)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert overlaps[0] == 0
+    assert sorted(entered) == [0, 0, 0, 1, 1, 1, 2, 2, 2]
+
+
+def test_locks_are_independent(open_state):
+    state, other = open_state(), open_state()
+    done = threading.Event()
+
+    def take_b():
+        with other.lock("b"):
+            done.set()
+
+    with state.lock("a"):
+        threading.Thread(target=take_b, daemon=True).start()
+        assert done.wait(5)
+
+
+def test_job_snapshot(open_state):
+    state = open_state()
+    job = Job("abc", "https://open.spotify.com/track/x", "opus", "high")
+    job.update("download", 0.5)
+    job.status = "completed"
+    job.finished_at = time.time()
+    job.result = ConversionResult(
+        metadata=SongMetadata(title="Midnight City", artist="M83", album="Hurry Up, We're Dreaming",
+                              duration_ms=243960),
+        youtube_url="https://www.youtube.com/watch?v=CmQz5Y0d2aM", filename="M83 - Midnight City.opus")
+    state.set(f"job:{job.job_id}", job.snapshot(), ttl=60)
+
+    restored = Job.from_snapshot(open_state().get("job:abc"))
+    assert vars(restored) == vars(job)
+
+
+def test_job_seen_by_other_worker(open_state):
+    class Convert:
+        def convert(self, url, progress_hook=None, **kwargs):
+            raise RuntimeError("no YouTube here")
+
+    service = JobService(Convert(), workers=1, queue_size=0, state=open_state())
+    other = JobService(Convert(), workers=1, queue_size=0, state=open_state())
+    try:
+        job = service.submit("https://open.spotify.com/track/x")
+        deadline = time.monotonic() + 5
+        while other.get(job.job_id).status != "failed":
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert other.get(job.job_id).error == "no YouTube here"
+    finally:
+        service.shutdown()
+        other.shutdown()
+
+
+def test_incomplete_backend_fails_on_creation():
+    class NoLocks(SharedState):
+        def get(self, key):
+            return None
+
+        def set(self, key, value, ttl=None):
+            pass
+
+        def add(self, key, value, ttl=None):
+            return True
+
+        def delete(self, key):
+            pass
+
+    with pytest.raises(TypeError, match="lock"):
+        NoLocks()
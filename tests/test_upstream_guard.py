@@ -0,0 +1,158 @@
+"""AdaptiveLimiter, CircuitBreaker and UpstreamGuard without any upstream."""
+import time
+import asyncio
+import pytest
+from fastapi import HTTPException
+from services.upstream_guard import (
+    OK, SLOW, THROTTLED, FAILED, AdaptiveLimiter, CircuitBreaker, UpstreamGuard, classify_exception, classify_status,
+)
+
+
+def busy_call(limiter: AdaptiveLimiter, outcome: str, concurrent: int):
+    """`concurrent` calls in flight together, all ending with outcome."""
+    started = time.monotonic()
+    for _ in range(concurrent):
+        limiter.acquire()
+    for _ in range(concurrent):
+        limiter.release(outcome, started, 0.01)
+
+
+def test_classify():
+    assert classify_status(200) == OK
+    assert classify_status(404) == OK
+    assert classify_status(429) == THROTTLED
+    assert classify_status(503) == FAILED
+    assert classify_exception(HTTPException(status_code=502)) == FAILED
+    assert classify_exception(ConnectionError("reset")) == FAILED
+    assert classify_exception(KeyboardInterrupt()) is None
+
+
+def test_limiter_grows_on_success():
+    limiter = AdaptiveLimiter("test", initial=4, max_limit=6)
+    # Only the first release sees half the limit in use
+    busy_call(limiter, OK, 2)
+    assert limiter.limit == 4.25
+    for _ in range(50):
+        busy_call(limiter, OK, 4)
+    assert limiter.limit == 6
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_limiter_only_grows_when_used():
+    limiter = AdaptiveLimiter("test", initial=4, max_limit=16)
+    for _ in range(20):
+        busy_call(limiter, OK, 1)
+    assert limiter.limit == 4
+
+
+@pytest.mark.parametrize("outcome", [THROTTLED, FAILED, SLOW])
+def test_limiter_shrinks_once_per_generation(outcome):
+    limiter = AdaptiveLimiter("test", initial=8, max_limit=16, min_limit=2)
+    # Four calls in flight together all fail: one signal
+    busy_call(limiter, outcome, 4)
+    assert limiter.limit == 4
+    assert limiter.decreases == 1
+    # Calls started after the decrease count again, down to the floor
+    busy_call(limiter, outcome, 1)
+    busy_call(limiter, outcome, 1)
+    assert limiter.limit == 2
+    assert limiter.stats()["decreases"] == 3
+
+
+def test_limiter_queues_then_rejects():
+    limiter = AdaptiveLimiter("test", initial=1, max_limit=1, queue_timeout=0.05)
+    limiter.acquire()
+    with pytest.raises(HTTPException) as excinfo:
+        limiter.acquire()
+    assert excinfo.value.status_code == 503
+    assert limiter.stats()["rejected"] == 1
+    limiter.release(OK, time.monotonic(), 0.01)
+    limiter.acquire()
+
+
+def test_breaker_open_half_open_closed():
+    breaker = CircuitBreaker("test", window=10, min_calls=4, failure_ratio=0.5, cooldown=0.1)
+    for failed in (False, True, True):
+        assert breaker.before() is False
+        breaker.record(failed, False)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(True, False)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(HTTPException) as excinfo:
+        breaker.before()
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.headers["Retry-After"] == "1"
+
+    time.sleep(0.15)
+    assert breaker.before() is True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one probe at a time
+    with pytest.raises(HTTPException):
+        breaker.before()
+    breaker.record(False, True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.before() is False
+    assert breaker.stats() == {"state": "closed", "recent_failures": 0, "recent_calls": 0, "opened": 1,
+                               "rejected": 2}
+
+
+def test_breaker_failed_probe_reopens():
+    breaker = CircuitBreaker("test", min_calls=2, cooldown=0.05)
+    breaker.record(True, False)
+    breaker.record(True, False)
+    time.sleep(0.1)
+    assert breaker.before() is True
+    breaker.record(True, True)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 2
+    # A probe that never reached the provider lets the next call probe instead
+    time.sleep(0.1)
+    assert breaker.before() is True
+    breaker.record(None, True)
+    assert breaker.before() is True
+
+
+def test_guard():
+    guard = UpstreamGuard("test", AdaptiveLimiter("test", initial=4, max_limit=8),
+                          CircuitBreaker("test", min_calls=4, cooldown=0.1))
+    for _ in range(2):
+        with guard.call() as call:
+            call.status = 429
+    assert guard.limiter.limit == 1
+    with pytest.raises(ConnectionError):
+        with guard.call():
+            raise ConnectionError("reset")
+    with pytest.raises(HTTPException):
+        with guard.call():
+            raise HTTPException(status_code=502)
+    # Two failures in four calls; 429s do not count against the breaker
+    assert guard.breaker.state == CircuitBreaker.OPEN
+
+    ran = []
+    with pytest.raises(HTTPException) as excinfo:
+        with guard.call():
+            ran.append(True)
+    assert excinfo.value.status_code == 503 and not ran
+
+    time.sleep(0.15)
+    with guard.call() as call:
+        call.status = 200
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+    stats = guard.stats()
+    assert (stats["calls_ok"], stats["calls_throttled"], stats["calls_failed"]) == (1, 2, 2)
+    assert stats["rejected_unavailable"] == 1
+
+
+def test_guard_async_releases_slot():
+    guard = UpstreamGuard("test", AdaptiveLimiter("test", initial=1, max_limit=1, queue_timeout=0.05),
+                          CircuitBreaker("test"))
+
+    async def calls():
+        for status in (200, 503, 200):
+            async with guard.call_async() as call:
+                call.status = status
+
+    asyncio.run(calls())
+    assert guard.limiter.stats()["in_flight"] == 0
+    assert guard.limiter.decreases == 1 and guard.limiter.limit == 1
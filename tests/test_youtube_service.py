@@ -0,0 +1,95 @@
+"""
+YouTubeService downloads through real yt-dlp against benchmarks.fake_youtube
+and the fake upstream's media; ffmpeg is replaced by a copy.
+"""
+import os
+import shutil
+import threading
+import pytest
+from benchmarks import fake_youtube, fixtures
+from benchmarks.fake_upstream import FakeUpstream
+
+
+@pytest.fixture(scope="module")
+def upstream(tmp_path_factory):
+    fixtures_dir = str(tmp_path_factory.mktemp("fixtures"))
+    formats = fixtures.make_fixtures(fixtures_dir, 5)
+    with FakeUpstream(0.0, fixtures_dir=fixtures_dir) as server:
+        fake_youtube.install(server.base_url, formats)
+        yield server
+
+
+@pytest.fixture
+def youtube(upstream, tmp_path, monkeypatch):
+    from services.youtube_service import YouTubeService
+
+    monkeypatch.setenv("DOWNLOAD_DIR", str(tmp_path / "downloads"))
+    monkeypatch.setenv("CACHE_INDEX_PATH", str(tmp_path / "cache" / "index.db"))
+    monkeypatch.setenv("EMBED_TAGS", "0")
+    return YouTubeService()
+
+
+def copy_transcoder(src, dst, codec_args=None):
+    shutil.copyfile(src, dst)
+    return 0.0
+
+
+def video_url(seed: str) -> str:
+    return f"https://www.youtube.com/watch?v={fake_youtube.video_id_for(seed)}"
+
+
+def test_flights_sharing_a_selector(youtube):
+    # mp3 at every preset and the original all download with bestaudio/best
+    requests = [("mp3", "low"), ("mp3", "standard"), ("mp3", "high"), ("original", "standard")]
+    url = video_url("shared selector")
+    barrier = threading.Barrier(len(requests))
+    filenames, errors = {}, []
+
+    def convert(audio_format, quality):
+        barrier.wait()
+        try:
+            filenames[audio_format, quality] = youtube.download_file(
+                url, "Artist - Song", transcoder=copy_transcoder, audio_format=audio_format, quality=quality)
+        except Exception as e:
+            errors.append((audio_format, quality, getattr(e, "detail", e)))
+
+    threads = [threading.Thread(target=convert, args=request) for request in requests]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+
+    assert errors == []
+    assert filenames[("mp3", "low")] == "Artist - Song.128k.mp3"
+    assert filenames[("mp3", "standard")] == "Artist - Song.mp3"
+    assert filenames[("mp3", "high")] == "Artist - Song.320k.mp3"
+    assert len(os.listdir(youtube.cache.blob_dir)) == 4
+    assert os.listdir(youtube.cache.staging_dir) == []
+
+
+def test_waiting_transcode_does_not_hold_a_downloader(youtube):
+    # One YoutubeDL per selector, held by a flight whose ffmpeg step is queued
+    youtube.download_pools = {selector: type(pool)(pool.opts, size=1)
+                              for selector, pool in youtube.download_pools.items()}
+    queued, release = threading.Event(), threading.Event()
+
+    def waiting_transcoder(src, dst, codec_args=None):
+        queued.set()
+        assert release.wait(30)
+        return copy_transcoder(src, dst)
+
+    stuck = threading.Thread(target=youtube.download_file, args=(video_url("batch"), "Batch - Song"),
+                             kwargs={"transcoder": waiting_transcoder})
+    stuck.start()
+    try:
+        assert queued.wait(30)
+        # Same selector, while the other flight still waits for its transcode
+        done = []
+        interactive = threading.Thread(target=lambda: done.append(youtube.download_file(
+            video_url("interactive"), "Interactive - Song", transcoder=copy_transcoder)))
+        interactive.start()
+        interactive.join(30)
+        assert done == ["Interactive - Song.mp3"]
+    finally:
+        release.set()
+        stuck.join(30)